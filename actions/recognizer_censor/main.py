@@ -1,83 +1,229 @@
 import os, json, re
+import hashlib
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections import deque
 
-# (DFAFilter 类的代码 保持不变，粘贴在此处)
-class DFAFilter():
+INDEX_MAGIC = b'ACIX'
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.acidx' # 编译好的自动机保存在关键字文件旁边: spooky_keywords.acidx
+# 头部: magic, version, 关键字文件 sha256, 状态数, 边数
+HEADER = struct.Struct('<4sI32sII')
+
+class AhoCorasickFilter():
+    """
+    Aho–Corasick 关键字过滤器，扫描一次消息即可找出所有关键字 (线性时间)。
+    自动机以扁平 int32 数组存储 (按状态排序的边表 + fail/输出链接)，可序列化后通过 mmap 零拷贝加载。
+    替换语义与原来的 DFAFilter 相同: 从左到右，每个位置取最短命中的关键字，替换后跳过它。
+    """
     def __init__(self):
-        self.keyword_chains = {}
-        self.delimit = '\x00'
-    def add(self, keyword):
-        if not isinstance(keyword, str):
-            keyword = keyword.decode('utf-8')
-        keyword = keyword.lower()
-        chars = keyword.strip()
-        if not chars:
-            return
-        level = self.keyword_chains
-        for i in range(len(chars)):
-            if chars[i] in level:
-                level = level[chars[i]]
-            else:
-                if not isinstance(level, dict):
-                    break
-                for j in range(i, len(chars)):
-                    level[chars[j]] = {}
-                    last_level, last_char = level, chars[j]
-                    level = level[chars[j]]
-                last_level[last_char] = {self.delimit: 0}
-                break
-        if i == len(chars) - 1:
-            level[self.delimit] = 0
+        self.edge_start = None # [n_states + 1]: 状态 s 的边在 edge_char/edge_next 中的区间
+        self.edge_char = None  # 每条边的字符 (码点)，同一状态内升序
+        self.edge_next = None  # 每条边的目标状态
+        self.fail = None       # 失配链接
+        self.term_len = None   # 以该状态结尾的关键字长度，0 表示不是终止状态
+        self.dict_link = None  # 沿 fail 链最近的终止状态，-1 表示没有
+        self._mmap = None
+        self._lower = {}
+
+    # --- 构建 ---
+    def build(self, keywords):
+        goto = [{}]
+        term_len = [0]
+        for keyword in keywords:
+            if not isinstance(keyword, str):
+                keyword = keyword.decode('utf-8')
+            chars = keyword.lower().strip()
+            if not chars:
+                continue
+            state = 0
+            for char in chars:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    term_len.append(0)
+                state = nxt
+            term_len[state] = len(chars)
+
+        # BFS 计算 fail 和 dict_link
+        n_states = len(goto)
+        fail = [0] * n_states
+        dict_link = [-1] * n_states
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0)
+                dict_link[nxt] = fail[nxt] if term_len[fail[nxt]] else dict_link[fail[nxt]]
+                queue.append(nxt)
+
+        edge_start, edge_char, edge_next = array('i', [0]), array('i'), array('i')
+        for edges in goto:
+            for char in sorted(edges):
+                edge_char.append(ord(char))
+                edge_next.append(edges[char])
+            edge_start.append(len(edge_char))
+
+        self.edge_start, self.edge_char, self.edge_next = edge_start, edge_char, edge_next
+        self.fail, self.term_len, self.dict_link = array('i', fail), array('i', term_len), array('i', dict_link)
+        return self
+
     def parse(self, path):
         # 假设关键字文件在 /proxy/actions/recognizer_censor/spooky_keywords
         full_path = os.path.join(os.path.dirname(__file__), path)
         try:
-            with open(full_path) as f:
-                for keyword in f:
-                    self.add(keyword.strip())
+            with open(full_path, 'rb') as f:
+                raw = f.read()
         except FileNotFoundError:
             print(f"Warning: Keyword file '{full_path}' not found. Censor will not filter anything.")
-            self.add("example_bad_word") # 添加一个默认词
+            return self.build(["example_bad_word"]) # 添加一个默认词
+
+        digest = hashlib.sha256(raw).digest()
+        index_path = full_path + INDEX_SUFFIX
+        if self.load(index_path, digest):
+            return self
+
+        self.build(raw.decode('utf-8').splitlines())
+        try:
+            self.save(index_path, digest)
+        except OSError as e:
+            print(f"Warning: could not write keyword index '{index_path}': {e}")
+        return self
+
+    # --- 序列化 ---
+    def _arrays(self):
+        return (self.edge_start, self.edge_char, self.edge_next, self.fail, self.term_len, self.dict_link)
+
+    def save(self, index_path, digest):
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, digest, len(self.fail), len(self.edge_char)))
+            for arr in self._arrays():
+                arr.tofile(f)
+        os.replace(tmp_path, index_path) # 原子替换，并发的容器不会读到半个文件
+
+    def load(self, index_path, digest):
+        # 关键字文件变化 (sha256 不同) 或格式不符时返回 False，由调用方重建
+        try:
+            with open(index_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if len(mm) < HEADER.size:
+            mm.close()
+            return False
+        magic, version, file_digest, n_states, n_edges = HEADER.unpack_from(mm, 0)
+        itemsize = array('i').itemsize
+        sizes = (n_states + 1, n_edges, n_edges, n_states, n_states, n_states)
+        if (magic, version, file_digest) != (INDEX_MAGIC, INDEX_VERSION, digest) or \
+                len(mm) != HEADER.size + sum(sizes) * itemsize:
+            mm.close()
+            return False
+
+        view = memoryview(mm)
+        arrays, offset = [], HEADER.size
+        for size in sizes:
+            arrays.append(view[offset:offset + size * itemsize].cast('i'))
+            offset += size * itemsize
+        (self.edge_start, self.edge_char, self.edge_next,
+         self.fail, self.term_len, self.dict_link) = arrays
+        self._mmap = mm
+        return True
+
+    # --- 匹配 ---
+    def _goto(self, state, code):
+        lo, hi = self.edge_start[state], self.edge_start[state + 1]
+        i = bisect_left(self.edge_char, code, lo, hi)
+        if i < hi and self.edge_char[i] == code:
+            return self.edge_next[i]
+        return -1
+
+    def _code(self, char):
+        # 逐字符小写 (带缓存)，不复制整条消息
+        code = self._lower.get(char)
+        if code is None:
+            lowered = char.lower()
+            code = ord(lowered) if len(lowered) == 1 else ord(char)
+            self._lower[char] = code
+        return code
+
+    def _shortest_matches(self, message):
+        # 一遍扫描: 返回 {起始位置: 从该位置开始的最短关键字长度}
+        term_len, dict_link, fail = self.term_len, self.dict_link, self.fail
+        shortest = {}
+        state = 0
+        for pos, char in enumerate(message):
+            code = self._code(char)
+            while True:
+                nxt = self._goto(state, code)
+                if nxt >= 0:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            out = state if term_len[state] else dict_link[state]
+            while out > 0:
+                length = term_len[out]
+                start = pos - length + 1
+                if length < shortest.get(start, length + 1):
+                    shortest[start] = length
+                out = dict_link[out]
+        return shortest
+
     def filter(self, message, repl="*"):
         if not isinstance(message, str):
             message = message.decode('utf-8')
-        message = message.lower()
+        shortest = self._shortest_matches(message)
+        if not shortest:
+            return message, 0
+
         ret = []
         replaced = 0
         start = 0
-        while start < len(message):
-            level = self.keyword_chains
-            step_ins = 0
-            for char in message[start:]:
-                if char in level:
-                    step_ins += 1
-                    if self.delimit not in level[char]:
-                        level = level[char]
-                    else:
-                        ret.append(repl * step_ins)
-                        replaced += 1
-                        start += step_ins - 1
-                        break
-                else:
-                    ret.append(message[start])
-                    break
-            else:
-                ret.append(message[start])
-            start += 1
+        for match_start in sorted(shortest):
+            if match_start < start:
+                continue # 与前一个替换重叠
+            length = shortest[match_start]
+            ret.append(message[start:match_start])
+            ret.append(repl * length)
+            replaced += 1
+            start = match_start + length
+        ret.append(message[start:])
         return ''.join(ret), replaced
 
-# --- DFAFilter 类结束 ---
+    def filter_batch(self, messages, repl="*"):
+        # 批量接口: 一次调用扫描多条文本
+        return [self.filter(message, repl) for message in messages]
+
+# --- AhoCorasickFilter 类结束 ---
 
-# 假设关键字文件与 main.py 放在一起
-gfw = DFAFilter()
+# 假设关键字文件与 main.py 放在一起；已编译的索引存在时直接 mmap 加载
+gfw = AhoCorasickFilter()
 gfw.parse("spooky_keywords") #
 
+def _verdict(filter_count):
+    return {"illegal": filter_count >= 1, "filter_count": filter_count} #
+
 def main(event):
+    # 批量模式: {"texts": [...]} -> {"results": [...]}
+    texts = event.get('texts')
+    if texts is not None:
+        return {"results": [_verdict(count) for _, count in gfw.filter_batch(texts, "*")]}
+
     text_content = event.get('text', '') #
-    
+
     word_filter, filter_count = gfw.filter(text_content, "*") #
-    
-    illegal = False
-    if filter_count >= 1: #
-        illegal = True
-    
-    return {"illegal": illegal, "filter_count": filter_count} #
\ No newline at end of file
+
+    return _verdict(filter_count)
+
+if __name__ == "__main__":
+    # 构建镜像时预编译关键字索引: python3 main.py
+    print(f"Keyword index ready: {len(gfw.fail)} states, {len(gfw.edge_char)} edges.")
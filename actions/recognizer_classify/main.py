@@ -0,0 +1,15 @@
+import os
+import model_server # 位于 /proxy/，两个分类模型在同一个 proxy 进程内常驻
+
+DEFAULT_MODELS = ["adult", "violence"]
+
+def main(event):
+    # 在一个暖进程里同时提供 adult 和 violence 两个分类器；图片只解码一次
+    image_path = event.get('image_path')
+    if not image_path or not os.path.exists(image_path):
+        raise FileNotFoundError(f"Valid image_path required: {image_path}")
+
+    models = event.get('models', DEFAULT_MODELS)
+    input_x = model_server.load_cached_input(image_path, event.get('image_cache'))
+
+    return {name: model_server.classify(name, image_path, input_x=input_x) for name in models}
@@ -1,28 +1,129 @@
 import cv2
 import pytesseract
 import os, json
+import queue
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 
-def get_string(img_path):
-    img = cv2.imread(img_path)
-    # 注意：原始代码缩放了 0.1，这对于OCR可能非常糟糕
-    # img = cv2.resize(img, None, fx=0.1, fy=0.1) 
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+OCR_THREADS = int(os.environ.get('OCR_THREADS', min(4, os.cpu_count() or 1)))
+OCR_LANG = os.environ.get('OCR_LANG', 'eng')
+MAX_REGIONS = 64 # 文本区域超过这个数 (密集文本页) 时直接整图识别
+MAX_REGION_AREA = 0.5 # 文本区域合计超过整图这个比例时直接整图识别
+REGION_PAD = 4
+
+class OCREngine():
+    """
+    常驻的 OCR 引擎池。有 tesserocr 时在进程内持有 OCR_THREADS 个 PyTessBaseAPI (语言数据只加载一次，
+    识别时释放 GIL，可以多线程并行)；没有时回退到 pytesseract (每次调用启动一个 tesseract 进程)。
+    """
+    def __init__(self, size=OCR_THREADS, lang=OCR_LANG):
+        self.size = size
+        self.apis = None
+        try:
+            from tesserocr import PyTessBaseAPI, PSM
+            self.psm = {False: PSM.AUTO, True: PSM.SINGLE_BLOCK}
+            self.apis = queue.Queue()
+            for _ in range(size):
+                self.apis.put(PyTessBaseAPI(lang=lang))
+            self.backend = 'tesserocr'
+        except ImportError:
+            self.backend = 'pytesseract'
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        print(f"OCR engine: {self.backend} x{size}")
+
+    def recognize(self, img, block=False):
+        # block=True 用于文本区域的裁剪图 (单个文本块)，整图保持 tesseract 默认的自动版面分析
+        if self.apis is None:
+            return pytesseract.image_to_string(img, config='--psm 6' if block else '')
+        api = self.apis.get()
+        try:
+            api.SetPageSegMode(self.psm[block])
+            api.SetImage(Image.fromarray(img))
+            return api.GetUTF8Text()
+        finally:
+            self.apis.put(api)
+
+    def recognize_many(self, images):
+        return list(self.executor.map(lambda img: self.recognize(img, block=True), images))
+
+    def max_regions(self):
+        # pytesseract 每个区域都要启动一个进程，区域太多时不如整图识别一次
+        return MAX_REGIONS if self.apis is not None else self.size * 2
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    # 惰性创建并在 proxy 进程内跨请求常驻
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = OCREngine()
+        return _engine
+
+def preprocess(img_path, gray=None):
+    if gray is None:
+        img = cv2.imread(img_path)
+        # 注意：原始代码缩放了 0.1，这对于OCR可能非常糟糕
+        # img = cv2.resize(img, None, fx=0.1, fy=0.1)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = np.asarray(gray)
     kernel = np.ones((1, 1), np.uint8)
     img = cv2.dilate(img, kernel, iterations=1)
     img = cv2.erode(img, kernel, iterations=1)
-    
-    # 使用 pytesseract
-    result = pytesseract.image_to_string(img)
-    return result
+    return img
+
+def detect_text_regions(gray):
+    # 形态学梯度 + Otsu 二值化，再横向闭运算把字符连成词/行；保留闭运算后填充率高的框 [x, y, w, h]
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, bw = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    connected = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1)))
+    contours = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    height, width = gray.shape[:2]
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 8 or h < 8:
+            continue
+        if cv2.countNonZero(connected[y:y + h, x:x + w]) / float(w * h) < 0.45:
+            continue
+        x0, y0 = max(0, x - REGION_PAD), max(0, y - REGION_PAD)
+        x1, y1 = min(width, x + w + REGION_PAD), min(height, y + h + REGION_PAD)
+        regions.append([x0, y0, x1 - x0, y1 - y0])
+    # 按阅读顺序 (从上到下、从左到右) 排列
+    regions.sort(key=lambda r: (r[1], r[0]))
+    return regions
+
+def get_string(img_path, gray=None, roi=True):
+    img = preprocess(img_path, gray)
+    engine = get_engine()
+    if roi:
+        regions = detect_text_regions(img)
+        area = sum(w * h for _, _, w, h in regions)
+        if regions and len(regions) <= engine.max_regions() and area <= MAX_REGION_AREA * img.shape[0] * img.shape[1]:
+            crops = [np.ascontiguousarray(img[y:y + h, x:x + w]) for x, y, w, h in regions]
+            texts = [t.strip() for t in engine.recognize_many(crops)]
+            return '\n'.join(t for t in texts if t), regions
+        # 没有检测到区域或文本铺满整图时，整图识别
+    return engine.recognize(np.ascontiguousarray(img)), None
 
 def main(event):
     image_path = event.get('image_path')
     if not image_path or not os.path.exists(image_path):
         raise FileNotFoundError(f"Valid image_path required: {image_path}")
 
-    text = get_string(image_path)
-    
+    # 优先使用 recognizer_upload 生成的灰度解码缓存 (mmap)
+    import image_cache # 位于 /proxy/
+    gray = image_cache.load(event.get('image_cache'), 'gray')
+
+    # roi: 先检测文本区域，只识别这些区域 (并行)；roi=false 时整图识别
+    text, regions = get_string(image_path, gray, roi=event.get('roi', True))
+
     # 返回提取的文本
-    return {"text": text}
\ No newline at end of file
+    result = {"text": text}
+    if regions is not None:
+        result["regions"] = regions
+    return result
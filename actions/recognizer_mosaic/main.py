@@ -1,44 +1,142 @@
 import cv2
 import os
 import json
+import numpy as np
 
 STORAGE_DIR = '/storage'
+MOSAIC_BLOCK = 8 # 默认马赛克块边长 (像素)
+DEFAULT_SCALE = 0.1 # 原始代码缩放了 0.1；传 scale=1.0 即可在全分辨率上处理
+
+def mosaic_loop(img, block=MOSAIC_BLOCK):
+    # 原始的逐像素实现，只保留作基准对照 (见文件末尾的 benchmark)。
+    # 注意 range(height - block) 让它只处理左上角坐标 < height - block 的块: 最后一行/列块 (以及不足一块的边缘) 保持原样
+    height, width, deep = img.shape
+    for m in range(height - block):
+        for n in range(width - block):
+            if m % block == 0 and n % block == 0:
+                for i in range(block):
+                    for j in range(block):
+                        b, g, r = img[m, n]
+                        img[m + i, n + j] = (b, g, r)
+    return img
+
+def mosaic(img, block=MOSAIC_BLOCK, mode='sample'):
+    """
+    向量化马赛克 (原地修改并返回 img)。
+    mode='sample': 每块填充左上角像素；mode='area': 每块填充块内均值。
+    与 mosaic_loop 不同，这里对整幅图打码，包括原始实现漏掉的最后一行/列块和不足一块的边缘；
+    因此 'sample' 只在 mosaic_loop 处理到的块上与之逐像素一致，边缘会不同。
+    """
+    height, width = img.shape[:2]
+    rows, cols = -(-height // block), -(-width // block)
+
+    # 边缘不足一块的部分用复制边缘补齐，使整幅图可以 reshape 成 (rows, block, cols, block, C)
+    pad = ((0, rows * block - height), (0, cols * block - width)) + ((0, 0),) * (img.ndim - 2)
+    padded = np.pad(img, pad, mode='edge') if any(p[1] for p in pad[:2]) else img.copy()
+    blocks = padded.reshape((rows, block, cols, block) + img.shape[2:])
+
+    if mode == 'area':
+        fill = blocks.mean(axis=(1, 3)).round().astype(img.dtype)
+    elif mode == 'sample':
+        fill = blocks[:, 0, :, 0].copy()
+    else:
+        raise ValueError(f"Unknown mosaic mode: {mode}")
+
+    # 广播写回每个块，不生成 np.repeat 的中间大数组
+    blocks[...] = fill[:, None, :, None]
+    img[...] = padded[:height, :width]
+    return img
+
+def mosaic_regions(img, regions, block=MOSAIC_BLOCK, mode='sample'):
+    # 只对给定的框 [x, y, w, h] 打码；框外像素保持不变
+    height, width = img.shape[:2]
+    for x, y, w, h in regions:
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(width, int(x + w)), min(height, int(y + h))
+        if x1 > x0 and y1 > y0:
+            mosaic(img[y0:y1, x0:x1], block, mode)
+    return img
 
 def main(event):
     image_path = event.get('image_path')
     if not image_path or not os.path.exists(image_path):
         raise FileNotFoundError(f"Valid image_path required: {image_path}")
 
-    # 原始代码 应用了全屏马赛克。我们将保持这个逻辑。
-    img = cv2.imread(image_path, 1)
-    
-    # 注意：原始代码缩放了 0.1。我们保留它。
-    img = cv2.resize(img, None, fx=0.1, fy=0.1)
-    
-    height, width, deep = img.shape
-    mosaic_height = 8
-    for m in range(height - mosaic_height):
-        for n in range(width - mosaic_height):
-            if m % mosaic_height == 0 and n % mosaic_height == 0:
-                for i in range(mosaic_height):
-                    for j in range(mosaic_height):
-                        b, g, r = img[m, n]
-                        img[m + i, n + j] = (b, g, r)
+    block = int(event.get('block_size', MOSAIC_BLOCK))
+    scale = float(event.get('scale', DEFAULT_SCALE))
+    mode = event.get('mode', 'sample')
+    regions = event.get('regions') # 可选: 原图坐标下的 [[x, y, w, h], ...]；不给则全图打码
+
+    # 优先使用 recognizer_upload 生成的 RGB 解码缓存 (mmap)，转成 cv2 的 BGR 后处理
+    import image_cache # 位于 /proxy/
+    rgb = image_cache.load(event.get('image_cache'), 'rgb')
+    if rgb is not None:
+        img = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2BGR)
+    else:
+        img = cv2.imread(image_path, 1)
+
+    if scale != 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale)
+
+    if regions:
+        scaled_regions = [[v * scale for v in box] for box in regions]
+        mosaic_regions(img, scaled_regions, block, mode)
+    else:
+        mosaic(img, block, mode)
 
     # 将处理后的文件写入 *共享存储*
     # 我们需要从原始文件名派生出一个新文件名
     base_name = os.path.basename(image_path)
     name, ext = os.path.splitext(base_name)
-    
+
     mosaic_filename = f"{name}_mosaic.jpg"
-    
+    attempt_id = event.get('attempt_id')
+    if attempt_id:
+        # 投机/重复执行: 写到本次尝试专属的文件，由编排器决定采用 (重命名) 还是丢弃
+        mosaic_filename = f"{name}_mosaic.{attempt_id}.jpg"
+
     # --- 关键：使用您指定的 'output/recognizer_mosaic' 目录 ---
     output_dir = os.path.join(STORAGE_DIR, 'output', 'recognizer_mosaic')
     os.makedirs(output_dir, exist_ok=True)
-    
+
     mosaic_filepath = os.path.join(output_dir, mosaic_filename)
-    
+
     cv2.imwrite(mosaic_filepath, img)
 
     # 返回新文件的 *容器内路径*
-    return {"mosaic_image_path": mosaic_filepath}
\ No newline at end of file
+    return {"mosaic_image_path": mosaic_filepath}
+
+if __name__ == "__main__":
+    # 基准: python3 main.py --sizes 256 1024 4096
+    import argparse
+    from time import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+', default=[256, 512, 1024, 2048, 4096])
+    parser.add_argument("--block", type=int, default=MOSAIC_BLOCK)
+    parser.add_argument("--loop-max", type=int, default=1024, help="逐像素实现只跑到这个尺寸，太大会非常慢")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # edge px: 与 mosaic_loop 结果不同的像素数，全部来自原始实现不处理的最后一行/列块
+    print(f"{'size':>6} {'loop(s)':>10} {'sample(s)':>10} {'area(s)':>10} {'speedup':>8} {'edge px':>8}")
+    for size in args.sizes:
+        img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+        loop_time = looped = None
+        if size <= args.loop_max:
+            start = time()
+            looped = mosaic_loop(img.copy(), args.block)
+            loop_time = time() - start
+
+        start = time()
+        sampled = mosaic(img.copy(), args.block, 'sample')
+        sample_time = time() - start
+
+        start = time()
+        mosaic(img.copy(), args.block, 'area')
+        area_time = time() - start
+
+        loop_str = f"{loop_time:10.4f}" if loop_time is not None else f"{'-':>10}"
+        speedup = f"{loop_time / sample_time:7.0f}x" if loop_time is not None else f"{'-':>8}"
+        edge = f"{int((looped != sampled).any(axis=-1).sum()):>8}" if looped is not None else f"{'-':>8}"
+        print(f"{size:>6} {loop_str} {sample_time:10.4f} {area_time:10.4f} {speedup} {edge}")
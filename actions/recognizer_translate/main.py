@@ -1,20 +1,220 @@
-from googletrans import Translator
 import os, json
 import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
 
-translator = Translator() #
+STORAGE_DIR = '/storage'
+CACHE_DIR = os.environ.get('TRANSLATE_CACHE_DIR', os.path.join(STORAGE_DIR, 'cache', 'translate')) # 共享卷上，所有 translate 容器共用
+LRU_SIZE = int(os.environ.get('TRANSLATE_LRU_SIZE', 10000))
+DEFAULT_DEST = 'en'
+
+def normalize(text):
+    # 缓存键只取决于规范化后的文本: NFKC + 合并空白
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+def cache_key(text, dest):
+    return hashlib.sha256(f"{dest}\0{text}".encode('utf-8')).hexdigest()
+
+class LRUCache():
+    def __init__(self, size=LRU_SIZE):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+class DiskCache():
+    """sqlite 翻译缓存，放在共享卷上；每个线程一个连接，WAL 模式允许多个容器并发读写。"""
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.path = None
+        self.local = threading.local()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.path = os.path.join(cache_dir, 'translations.db')
+            conn = self._conn()
+            conn.execute('CREATE TABLE IF NOT EXISTS translations '
+                         '(key TEXT PRIMARY KEY, dest TEXT, text TEXT, translated TEXT, created REAL)')
+            conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: translate disk cache disabled: {e}")
+            self.path = None
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        if self.path is None or not keys:
+            return {}
+        found = {}
+        try:
+            # 分块查询，避免超过 sqlite 的参数个数上限
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn().execute(f'SELECT key, translated FROM translations WHERE key IN ({placeholders})', chunk)
+                found.update(rows.fetchall())
+            return found
+        except sqlite3.Error as e:
+            print(f"Warning: translate disk cache read failed: {e}")
+            return {}
+
+    def put_many(self, entries):
+        # entries: [(key, dest, text, translated), ...]
+        if self.path is None or not entries:
+            return
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)',
+                             [entry + (now,) for entry in entries])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: translate disk cache write failed: {e}")
+
+# --- 翻译后端: translate_batch(texts, dest) 返回等长列表，失败时抛异常 ---
+
+class GoogleBackend():
+    def __init__(self):
+        from googletrans import Translator
+        self.translator = Translator() #
+
+    def translate_batch(self, texts, dest):
+        # 注意：googletrans 库可能需要访问外网
+        return [t.text for t in self.translator.translate(texts, dest=dest)] #
+
+class LocalBackend():
+    # 离线测试用的替身: 原样返回文本，可选模拟一次网络往返的延迟
+    def __init__(self, latency_ms=None):
+        if latency_ms is None:
+            latency_ms = float(os.environ.get('TRANSLATE_LOCAL_LATENCY_MS', 0))
+        self.latency = latency_ms / 1000.0
+
+    def translate_batch(self, texts, dest):
+        time.sleep(self.latency)
+        return list(texts)
+
+BACKENDS = {"google": GoogleBackend, "local": LocalBackend}
+
+class CachedTranslator():
+    """
+    LRU -> 共享 sqlite -> 后端；同一批里的重复文本只翻译一次，翻译失败的结果不写缓存。
+    规范化只用于缓存键；发给后端的是该键第一次出现时的原文 (保留 OCR 的换行和空白)。
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.lru = LRUCache()
+        self.disk = DiskCache()
+        self.stats = {"lru": 0, "disk": 0, "backend": 0, "errors": 0}
+
+    def translate(self, texts, dest=DEFAULT_DEST):
+        results = [None] * len(texts)
+        pending = OrderedDict() # key -> (第一次出现的原文, [下标, ...])
+        for i, text in enumerate(texts):
+            norm = normalize(text)
+            if not norm:
+                results[i] = ""
+                continue
+            key = cache_key(norm, dest)
+            hit = self.lru.get(key)
+            if hit is not None:
+                results[i] = hit
+                self.stats["lru"] += 1
+            else:
+                pending.setdefault(key, (text, []))[1].append(i)
+
+        for key, translated in self.disk.get_many(list(pending)).items():
+            self.lru.put(key, translated)
+            for i in pending.pop(key)[1]:
+                results[i] = translated
+                self.stats["disk"] += 1
+
+        if pending:
+            keys = list(pending)
+            try:
+                translated = self.backend.translate_batch([pending[key][0] for key in keys], dest)
+                self.stats["backend"] += len(keys)
+            except Exception as e:
+                print(f"Translate Error: {e}. Defaulting to original text.")
+                self.stats["errors"] += len(keys)
+                for key in keys:
+                    for i in pending[key][1]:
+                        results[i] = texts[i] #
+                return results
+
+            entries = []
+            for key, value in zip(keys, translated):
+                self.lru.put(key, value)
+                entries.append((key, dest, pending[key][0], value))
+                for i in pending[key][1]:
+                    results[i] = value
+            self.disk.put_many(entries)
+        return results
+
+_translators = {}
+_translators_lock = threading.Lock()
+
+def get_translator(backend_name):
+    # 每种后端一个常驻实例 (LRU 跨请求保留)
+    with _translators_lock:
+        translator = _translators.get(backend_name)
+        if translator is None:
+            translator = CachedTranslator(BACKENDS[backend_name]())
+            _translators[backend_name] = translator
+        return translator
 
 def main(event):
+    backend = event.get('backend', os.environ.get('TRANSLATE_BACKEND', 'google'))
+    dest = event.get('dest', DEFAULT_DEST)
+    translator = get_translator(backend)
+
+    # 批量模式: {"texts": [...]} -> {"translated_texts": [...]}
+    texts = event.get('texts')
+    if texts is not None:
+        return {"translated_texts": translator.translate(texts, dest)}
+
     extracted_text = event.get('text', '') #
-    
+
     if not extracted_text.strip():
         return {"translated_text": ""}
 
-    try:
-        # 注意：googletrans 库可能需要访问外网
-        translated_text = translator.translate(extracted_text, dest='en').text #
-    except Exception as e:
-        print(f"Translate Error: {e}. Defaulting to original text.")
-        translated_text = extracted_text #
+    translated_text = translator.translate([extracted_text], dest)[0]
+
+    return {"translated_text": translated_text}
+
+if __name__ == "__main__":
+    # 离线基准: python3 main.py --requests 1000 --unique 50 --latency-ms 200
+    import argparse
+    import random
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--unique", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    args = parser.parse_args()
 
-    return {"translated_text": translated_text}
\ No newline at end of file
+    translator = CachedTranslator(LocalBackend(args.latency_ms))
+    texts = [f"sample text {random.randrange(args.unique)}" for _ in range(args.requests)]
+    start = time.time()
+    for text in texts:
+        translator.translate([text])
+    elapsed = time.time() - start
+    print(f"{args.requests} requests in {elapsed:.2f}s ({elapsed / args.requests * 1e6:.0f} us/request), {translator.stats}")
@@ -15,4 +15,11 @@ def main(event):
         raise FileNotFoundError(f"File not found at {image_path}")
 
     # 返回 Action 可以使用的 *容器内共享路径*
-    return {"image_path": image_path}
\ No newline at end of file
+    result = {"image_path": image_path}
+
+    if event.get('decode_cache', False):
+        # 解码一次，派生数组按内容哈希存入 /storage/cache/images，下游 action 通过 mmap 读取
+        import image_cache # 位于 /proxy/
+        result["image_cache"] = image_cache.build(image_path)
+
+    return result
@@ -4,42 +4,177 @@ import json
 import os
 
 STORAGE_DIR = '/storage'
+BLOCK_BYTES = 64 * 1024 * 1024 # 按行块写结果时每块的大小上限
 
-def main(event):
-    # 从 controller 接收*一个*切片路径
-    slice_path = event.get('slice_path')
-    mat_index = int(event.get('mat_index')) # 索引 (0, 1, ...)
-    
-    if not slice_path or not os.path.exists(slice_path):
-        raise FileNotFoundError(f"SVD_COMPUTE: Slice file not found at {slice_path}")
+def _attempt_path(path, attempt_id=None):
+    # 每次尝试先写到自己的文件 (u_0.<attempt_id>.npy)，完成后原子重命名；编排器对慢任务发起的重复尝试不会互相覆盖出半个文件
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{attempt_id or os.urandom(4).hex()}{ext}"
+
+def _save_array(path, array, attempt=None):
+    # 结果通过 .npy memmap 写出，避免 np.save 额外的缓冲。
+    # attempt 不为空 (defer_commit) 时不重命名，返回专属文件，由编排器只提交先完成的一次
+    tmp_path = _attempt_path(path, attempt)
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=array.dtype, shape=array.shape)
+    out[...] = array
+    out.flush()
+    del out
+    if attempt:
+        return tmp_path
+    os.replace(tmp_path, path)
+    return path
 
-    print(f"SVD_COMPUTE: Loading slice {mat_index} from {slice_path}")
-    
-    # 1. 从 /storage 加载矩阵
-    mat_slice = np.load(slice_path)
-    
-    # 2. 执行 SVD 计算
+def _compute_exact(mat_slice, mat_index, output_dir, attempt=None):
+    # 执行 SVD 计算
     u, s, v = np.linalg.svd(mat_slice, full_matrices=False) #
-    
-    # 3. 确保输出目录存在
-    output_dir = os.path.join(STORAGE_DIR, 'output', 'svd_compute')
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 4. 将 u, s, v 结果保存到 /storage
+
+    # 将 u, s, v 结果保存到 /storage
     u_path = os.path.join(output_dir, f'u_{mat_index}.npy')
     s_path = os.path.join(output_dir, f's_{mat_index}.npy')
     v_path = os.path.join(output_dir, f'v_{mat_index}.npy')
-    
-    np.save(u_path, u)
-    np.save(s_path, s)
-    np.save(v_path, v)
-    
-    print(f"SVD_COMPUTE: Finished slice {mat_index}. Results saved.")
 
-    # 5. 返回指向*结果路径*的 JSON
+    u_path = _save_array(u_path, u, attempt)
+    s_path = _save_array(s_path, s, attempt)
+    v_path = _save_array(v_path, v, attempt)
+
     return {
         "mat_index": mat_index,
         "u_path": u_path,
         "s_path": s_path,
         "v_path": v_path
-    }
\ No newline at end of file
+    }
+
+def _compute_tsqr(mat_slice, mat_index, output_dir, attempt=None):
+    # TSQR 叶子节点：只做一次瘦 QR，R 很小 (k x col_num)，交给 merge 做树形归约
+    q, r = np.linalg.qr(mat_slice, mode='reduced')
+
+    q_path = os.path.join(output_dir, f'q_{mat_index}.npy')
+    r_path = os.path.join(output_dir, f'r_{mat_index}.npy')
+
+    q_path = _save_array(q_path, q, attempt)
+    r_path = _save_array(r_path, r, attempt)
+
+    return {
+        "mat_index": mat_index,
+        "q_path": q_path,
+        "r_path": r_path
+    }
+
+def _load_range_basis(event, col_num):
+    # 随机化 SVD 的当前子空间 Z (col_num x l)。第一轮没有 z_path，
+    # 用相同的 seed 在每个切片上独立生成同一个高斯矩阵，避免在 /storage 上传递 Omega。
+    z_path = event.get('z_path')
+    if z_path:
+        return np.load(z_path, mmap_mode='r')
+    sketch_size = int(event.get('sketch_size'))
+    rng = np.random.default_rng(int(event.get('seed', 0)))
+    return rng.standard_normal((col_num, sketch_size))
+
+def _compute_rsvd_power(event, mat_slice, mat_index, output_dir, attempt=None):
+    # 一次幂迭代在本切片上的部分和: W_i = A_i^T (A_i Z)
+    z = _load_range_basis(event, mat_slice.shape[1])
+    w = np.dot(mat_slice.T, np.dot(mat_slice, z))
+
+    power_iter = int(event.get('power_iter', 0))
+    w_path = os.path.join(output_dir, f'w_{power_iter}_{mat_index}.npy')
+    w_path = _save_array(w_path, w, attempt)
+
+    return {
+        "mat_index": mat_index,
+        "w_path": w_path
+    }
+
+def _compute_rsvd_project(event, mat_slice, mat_index, output_dir, attempt=None):
+    # 最后一遍: Y_i = A_i Z，只返回小矩阵 G_i = Y_i^T Y_i (l x l) 和 H_i = Y_i^T A_i (l x col_num)
+    z = _load_range_basis(event, mat_slice.shape[1])
+    y = np.dot(mat_slice, z)
+
+    g_path = os.path.join(output_dir, f'g_{mat_index}.npy')
+    h_path = os.path.join(output_dir, f'h_{mat_index}.npy')
+    g_path = _save_array(g_path, np.dot(y.T, y), attempt)
+    h_path = _save_array(h_path, np.dot(y.T, mat_slice), attempt)
+
+    return {
+        "mat_index": mat_index,
+        "g_path": g_path,
+        "h_path": h_path,
+        "frobenius_sq": float(np.vdot(mat_slice, mat_slice))
+    }
+
+def _apply_factor(event, mat_index, output_dir, attempt=None):
+    # 惰性重建最终 U 的一个切片: U_i = left_i @ factor_i (factor 很小)
+    left_path = event.get('left_path')
+    factor_path = event.get('factor_path')
+    if not left_path or not os.path.exists(left_path):
+        raise FileNotFoundError(f"SVD_COMPUTE: Left matrix not found at {left_path}")
+    if not factor_path or not os.path.exists(factor_path):
+        raise FileNotFoundError(f"SVD_COMPUTE: Factor not found at {factor_path}")
+
+    left = np.load(left_path, mmap_mode='r')
+    factor = np.load(factor_path)
+
+    # 按行块相乘并直接写入输出 memmap，峰值内存只有一个行块
+    u_path = os.path.join(output_dir, f'final_u_{mat_index}.npy')
+    tmp_path = _attempt_path(u_path, attempt)
+    u = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.result_type(left, factor),
+                                  shape=(left.shape[0], factor.shape[1]))
+    block_rows = max(1, BLOCK_BYTES // (max(left.shape[1], factor.shape[1]) * u.dtype.itemsize))
+    for start in range(0, left.shape[0], block_rows):
+        stop = min(start + block_rows, left.shape[0])
+        u[start:stop] = np.dot(left[start:stop], factor)
+    u.flush()
+    del u
+    if attempt:
+        u_path = tmp_path
+    else:
+        os.replace(tmp_path, u_path)
+
+    return {
+        "mat_index": mat_index,
+        "u_path": u_path
+    }
+
+def main(event):
+    # mode: "exact" (默认, 每个切片完整 SVD) / "tsqr" (每个切片 QR) / "apply" (重建 U 切片)
+    #       "rsvd_power" / "rsvd_project" (随机化低秩 SVD 的一遍扫描)
+    mode = event.get('mode', 'exact')
+    mat_index = int(event.get('mat_index')) # 索引 (0, 1, ...)
+    # 对冲的重复尝试 (defer_commit): 结果写到带 attempt_id 的专属文件，由编排器提交先完成的一次
+    attempt = event.get('attempt_id') if event.get('defer_commit') else None
+
+    # 1. 确保输出目录存在
+    output_dir = os.path.join(STORAGE_DIR, 'output', 'svd_compute')
+    os.makedirs(output_dir, exist_ok=True)
+
+    if mode == 'apply':
+        result = _apply_factor(event, mat_index, output_dir, attempt)
+        print(f"SVD_COMPUTE: Reconstructed U slice {mat_index} at {result['u_path']}.")
+        return result
+
+    # 从 controller 接收*一个*切片路径
+    slice_path = event.get('slice_path')
+
+    if not slice_path or not os.path.exists(slice_path):
+        raise FileNotFoundError(f"SVD_COMPUTE: Slice file not found at {slice_path}")
+
+    print(f"SVD_COMPUTE: Loading slice {mat_index} from {slice_path} (mode={mode})")
+
+    # 2. 从 /storage 以 memmap 方式打开矩阵 (按需换页，不额外复制)
+    mat_slice = np.load(slice_path, mmap_mode='r')
+
+    # 3. 按模式计算并将结果保存到 /storage
+    if mode == 'tsqr':
+        result = _compute_tsqr(mat_slice, mat_index, output_dir, attempt)
+    elif mode == 'rsvd_power':
+        result = _compute_rsvd_power(event, mat_slice, mat_index, output_dir, attempt)
+    elif mode == 'rsvd_project':
+        result = _compute_rsvd_project(event, mat_slice, mat_index, output_dir, attempt)
+    elif mode == 'exact':
+        result = _compute_exact(mat_slice, mat_index, output_dir, attempt)
+    else:
+        raise ValueError(f"SVD_COMPUTE: Unknown mode '{mode}'")
+
+    print(f"SVD_COMPUTE: Finished slice {mat_index}. Results saved.")
+
+    # 4. 返回指向*结果路径*的 JSON
+    return result
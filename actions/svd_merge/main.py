@@ -4,52 +4,232 @@ import json
 import os
 
 STORAGE_DIR = '/storage'
+BLOCK_BYTES = 64 * 1024 * 1024 # 按行块写结果时每块的大小上限
 
-def main(event):
+def _save_array(path, array):
+    # 结果通过 .npy memmap 写出，避免 np.save 额外的缓冲
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+    out[...] = array
+    out.flush()
+    del out
+
+def _merge_exact(event, output_dir):
     # 从 controller 接收所有 compute 任务的结果
     # event['results'] 应该是一个列表:
     # [ {"mat_index": 0, "u_path": "...", "s_path": "..."},
     #   {"mat_index": 1, "u_path": "...", "s_path": "..."} ]
     results = event.get('results', [])
-    
+
     if not results:
         raise ValueError("SVD_MERGE: No results to merge.")
-        
+
     print(f"SVD_MERGE: Merging {len(results)} partial results...")
 
     # 1. 排序并从 /storage 加载所有 u 和 s
     results.sort(key=lambda x: x['mat_index'])
-    
-    u_list = [np.load(r['u_path']) for r in results]
+
+    u_list = [np.load(r['u_path'], mmap_mode='r') for r in results]
     s_list = [np.load(r['s_path']) for r in results]
-    
-    # 2. 执行合并逻辑
-    U = np.hstack(u_list) #
+
+    # 2. 执行合并逻辑 (S 只有 sum(k_i) 维，U 不再整体 hstack)
     S = np.diag(np.hstack(s_list)) #
-    
+
     # 3. 执行最终的 SVD
     u_final, s_final, v_final = np.linalg.svd(S, full_matrices=False) #
-    
-    U_final = np.dot(U, u_final)
-    
-    # 4. 确保最终输出目录存在
-    output_dir = os.path.join(STORAGE_DIR, 'output', 'svd_merge')
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 5. 将最终结果保存到 /storage
+
+    # 4. 将最终结果保存到 /storage
     final_u_path = os.path.join(output_dir, 'final_U.npy')
     final_s_path = os.path.join(output_dir, 'final_S.npy')
     final_v_path = os.path.join(output_dir, 'final_V.npy')
-    
-    np.save(final_u_path, U_final)
-    np.save(final_s_path, s_final)
-    np.save(final_v_path, v_final)
+
+    # U_final = hstack(u_list) @ u_final = sum_j u_j @ u_final[块 j]，按行块写入 memmap
+    row_num = u_list[0].shape[0]
+    offsets = np.cumsum([0] + [u.shape[1] for u in u_list])
+    U_final = np.lib.format.open_memmap(final_u_path, mode='w+', dtype=u_final.dtype, shape=(row_num, u_final.shape[1]))
+    block_rows = max(1, BLOCK_BYTES // (int(offsets[-1]) * U_final.dtype.itemsize))
+    for start in range(0, row_num, block_rows):
+        stop = min(start + block_rows, row_num)
+        block = np.zeros((stop - start, u_final.shape[1]), dtype=U_final.dtype)
+        for u, lo, hi in zip(u_list, offsets[:-1], offsets[1:]):
+            block += np.dot(u[start:stop], u_final[lo:hi])
+        U_final[start:stop] = block
+    U_final.flush()
+    del U_final
+
+    _save_array(final_s_path, s_final)
+    _save_array(final_v_path, v_final)
 
     print(f"SVD_MERGE: Merge complete. Final results saved.")
 
-    # 6. 返回最终结果的路径
+    # 5. 返回最终结果的路径
     return {
         "final_u_path": final_u_path,
         "final_s_path": final_s_path,
         "final_v_path": final_v_path
-    }
\ No newline at end of file
+    }
+
+def _tsqr_reduce(event, output_dir):
+    # TSQR 树的一个内部节点: 把若干子节点的 R 纵向堆叠后再做一次 QR。
+    # Q 按子节点的行数切块保存，最终 U 通过这些小块逐层回乘得到。
+    node_id = event.get('node_id')
+    r_paths = event.get('r_paths', [])
+    if not r_paths:
+        raise ValueError("SVD_MERGE: No R factors to reduce.")
+
+    r_list = [np.load(p, mmap_mode='r') for p in r_paths]
+    q, r = np.linalg.qr(np.vstack(r_list), mode='reduced')
+
+    r_path = os.path.join(output_dir, f'r_node_{node_id}.npy')
+    _save_array(r_path, r)
+
+    q_block_paths = []
+    offset = 0
+    for child, r_child in enumerate(r_list):
+        rows = r_child.shape[0]
+        q_block_path = os.path.join(output_dir, f'q_node_{node_id}_{child}.npy')
+        _save_array(q_block_path, q[offset:offset + rows])
+        q_block_paths.append(q_block_path)
+        offset += rows
+
+    print(f"SVD_MERGE: Reduced {len(r_list)} R factors into node {node_id}.")
+    return {
+        "node_id": node_id,
+        "r_path": r_path,
+        "q_block_paths": q_block_paths
+    }
+
+def _tsqr_final(event, output_dir):
+    # 根节点: 对 (col_num x col_num) 的 R 做 SVD，然后沿树向下把 u_r 推到每个叶子，
+    # 得到每个切片的小因子 F_i，使得 U_i = Q_i @ F_i。这里不会生成完整的 U。
+    root_r_path = event.get('root_r_path')
+    tree = event.get('tree', []) # 自底向上的层: [[{"children": [...], "q_block_paths": [...]}, ...], ...]
+    leaf_num = int(event.get('leaf_num'))
+
+    if not root_r_path or not os.path.exists(root_r_path):
+        raise FileNotFoundError(f"SVD_MERGE: Root R not found at {root_r_path}")
+
+    u_r, s_final, v_final = np.linalg.svd(np.load(root_r_path), full_matrices=False)
+
+    factors = [u_r]
+    for level in reversed(tree):
+        child_num = max(child for node in level for child in node['children']) + 1
+        child_factors = [None] * child_num
+        for node, factor in zip(level, factors):
+            for child, q_block_path in zip(node['children'], node['q_block_paths']):
+                child_factors[child] = np.dot(np.load(q_block_path, mmap_mode='r'), factor)
+        factors = child_factors
+
+    if len(factors) != leaf_num:
+        raise ValueError(f"SVD_MERGE: TSQR tree yields {len(factors)} leaves, expected {leaf_num}.")
+
+    u_factor_paths = []
+    for i, factor in enumerate(factors):
+        u_factor_path = os.path.join(output_dir, f'u_factor_{i}.npy')
+        _save_array(u_factor_path, factor)
+        u_factor_paths.append(u_factor_path)
+
+    final_s_path = os.path.join(output_dir, 'final_S.npy')
+    final_v_path = os.path.join(output_dir, 'final_V.npy')
+    _save_array(final_s_path, s_final)
+    _save_array(final_v_path, v_final)
+
+    print(f"SVD_MERGE: TSQR merge complete. {leaf_num} U factors saved.")
+    return {
+        "final_s_path": final_s_path,
+        "final_v_path": final_v_path,
+        "u_factor_paths": u_factor_paths
+    }
+
+def _rsvd_power_reduce(event, output_dir):
+    # 汇总一次幂迭代: W = sum_i A_i^T A_i Z，再正交化得到下一轮的 Z
+    w_paths = event.get('w_paths', [])
+    if not w_paths:
+        raise ValueError("SVD_MERGE: No partial products to reduce.")
+    power_iter = int(event.get('power_iter', 0))
+
+    w = np.load(w_paths[0])
+    for w_path in w_paths[1:]:
+        w += np.load(w_path, mmap_mode='r')
+    z, _ = np.linalg.qr(w, mode='reduced')
+
+    z_path = os.path.join(output_dir, f'z_{power_iter}.npy')
+    _save_array(z_path, z)
+    return {"z_path": z_path}
+
+def _rsvd_final(event, output_dir):
+    # 由 G = Y^T Y 和 H = Y^T A 恢复 B = Q^T A (Q = Y G^{-1/2})，对小矩阵 B 做 SVD 并截断到 rank。
+    # U 不落地，只保存 F，使 U_i = A_i @ F。
+    results = event.get('results', [])
+    if not results:
+        raise ValueError("SVD_MERGE: No projections to merge.")
+    rank = int(event.get('rank'))
+    z_path = event.get('z_path')
+
+    g = np.load(results[0]['g_path'])
+    h = np.load(results[0]['h_path'])
+    for r in results[1:]:
+        g += np.load(r['g_path'], mmap_mode='r')
+        h += np.load(r['h_path'], mmap_mode='r')
+    frobenius_sq = sum(r['frobenius_sq'] for r in results)
+
+    # G 的特征分解代替 Y 的 QR；丢掉数值上为零的方向，避免 G^{-1/2} 放大噪声
+    eig_w, eig_v = np.linalg.eigh(g)
+    keep = eig_w > eig_w.max() * np.finfo(eig_w.dtype).eps * g.shape[0]
+    inv_sqrt = eig_v[:, keep] / np.sqrt(eig_w[keep])
+
+    b = np.dot(inv_sqrt.T, h)
+    u_b, s_all, v_final = np.linalg.svd(b, full_matrices=False)
+    rank = min(rank, len(s_all))
+    s_final = s_all[:rank]
+    v_final = v_final[:rank]
+
+    if z_path:
+        z = np.load(z_path, mmap_mode='r')
+    else:
+        rng = np.random.default_rng(int(event.get('seed', 0)))
+        z = rng.standard_normal((h.shape[1], int(event.get('sketch_size'))))
+    u_factor = np.dot(z, np.dot(inv_sqrt, u_b[:, :rank]))
+
+    # ||A - U S V^T||_F^2 = ||A||_F^2 - sum(s_k^2)；s_{k+1} 是谱范数误差的估计
+    residual_sq = max(frobenius_sq - float(np.sum(s_final ** 2)), 0.0)
+    approx_error = {
+        "frobenius": float(np.sqrt(residual_sq)),
+        "relative_frobenius": float(np.sqrt(residual_sq / frobenius_sq)) if frobenius_sq else 0.0,
+        "spectral_estimate": float(s_all[rank]) if rank < len(s_all) else 0.0
+    }
+
+    u_factor_path = os.path.join(output_dir, 'u_factor.npy')
+    final_s_path = os.path.join(output_dir, 'final_S.npy')
+    final_v_path = os.path.join(output_dir, 'final_V.npy')
+    _save_array(u_factor_path, u_factor)
+    _save_array(final_s_path, s_final)
+    _save_array(final_v_path, v_final)
+
+    print(f"SVD_MERGE: Randomized merge complete. rank={rank}, error={approx_error}")
+    return {
+        "final_s_path": final_s_path,
+        "final_v_path": final_v_path,
+        "u_factor_path": u_factor_path,
+        "approx_error": approx_error
+    }
+
+def main(event):
+    # mode: "exact" (默认) / "tsqr_reduce" (TSQR 内部节点) / "tsqr_final" (TSQR 根节点)
+    #       "rsvd_power_reduce" / "rsvd_final" (随机化低秩 SVD)
+    mode = event.get('mode', 'exact')
+
+    # 确保最终输出目录存在
+    output_dir = os.path.join(STORAGE_DIR, 'output', 'svd_merge')
+    os.makedirs(output_dir, exist_ok=True)
+
+    if mode == 'exact':
+        return _merge_exact(event, output_dir)
+    elif mode == 'tsqr_reduce':
+        return _tsqr_reduce(event, output_dir)
+    elif mode == 'tsqr_final':
+        return _tsqr_final(event, output_dir)
+    elif mode == 'rsvd_power_reduce':
+        return _rsvd_power_reduce(event, output_dir)
+    elif mode == 'rsvd_final':
+        return _rsvd_final(event, output_dir)
+    raise ValueError(f"SVD_MERGE: Unknown mode '{mode}'")
@@ -4,38 +4,47 @@ import json
 import os
 
 STORAGE_DIR = '/storage'
+BLOCK_BYTES = 64 * 1024 * 1024 # 每次生成/写入的行块大小上限，峰值内存与矩阵规模无关
 
 def main(event):
     # 从 controller 接收参数
     row_num = int(event.get('row_num', 1000))
     col_num = int(event.get('col_num', 100))
     slice_num = int(event.get('slice_num', 2)) #
-    
+    seed = event.get('seed') # 可选: 固定随机种子以便复现
+
     # 确保输出目录存在
     output_dir = os.path.join(STORAGE_DIR, 'output', 'svd_start')
     os.makedirs(output_dir, exist_ok=True)
-    
-    print(f"SVD_START: Generating matrix ({row_num}, {col_num}) and splitting into {slice_num} slices.")
-    
-    # 1. 生成大矩阵
-    mat = np.random.rand(row_num, col_num)
-    
-    # 2. 切片
-    mat_list = np.array_split(mat, slice_num) #
+
+    print(f"SVD_START: Generating matrix ({row_num}, {col_num}) as {slice_num} memory-mapped slices.")
+
+    # 1. 与 np.array_split 相同的切分方式，但不生成完整大矩阵
+    base_rows, extra_rows = divmod(row_num, slice_num)
+    slice_rows = [base_rows + (1 if i < extra_rows else 0) for i in range(slice_num)]
+    block_rows = max(1, BLOCK_BYTES // (col_num * 8))
+
+    # 2. 每个切片一个独立的随机流，按行块直接写入 .npy 的 memmap
+    seed_seq = np.random.SeedSequence(None if seed is None else int(seed))
     slice_paths = []
-    
-    # 3. 将切片保存到 /storage
-    for i, mat_slice in enumerate(mat_list):
+
+    for i, (rows, child_seed) in enumerate(zip(slice_rows, seed_seq.spawn(slice_num))):
         slice_filename = f'slice_{i}.npy'
         slice_filepath = os.path.join(output_dir, slice_filename)
-        
-        # 使用 numpy.save 保存
-        np.save(slice_filepath, mat_slice)
+
+        rng = np.random.default_rng(child_seed)
+        mat_slice = np.lib.format.open_memmap(slice_filepath, mode='w+', dtype=np.float64, shape=(rows, col_num))
+        for start in range(0, rows, block_rows):
+            stop = min(start + block_rows, rows)
+            mat_slice[start:stop] = rng.random((stop - start, col_num))
+        mat_slice.flush()
+        del mat_slice
+
         slice_paths.append(slice_filepath)
         print(f"SVD_START: Saved {slice_filepath}")
 
-    # 4. 返回包含所有切片*路径*的列表
+    # 3. 返回包含所有切片*路径*的列表
     return {
         "slice_paths": slice_paths,
         "slice_num": slice_num
-    }
\ No newline at end of file
+    }
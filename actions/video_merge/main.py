@@ -13,7 +13,7 @@ def get_fileNameExt(filename):
 # proxy.py 将调用这个函数
 def main(event):
     # 接收转码后的文件路径列表
-    transcoded_files = event['transcoded_files']
+    transcoded_files = event.get('transcoded_files', [])
     target_type = event['target_type'] #
     output_prefix = event['output_prefix'] #
     video_name = event['video_name'] # 原始视频名称
@@ -24,14 +24,17 @@ def main(event):
 
     fileDir1, filename1, shortname1, extension1 = get_fileNameExt(video_name) #
     
-    # 片段列表文件写入共享卷
-    segs_filename = f'segs_{shortname1}_{target_type}.txt' #
-    segs_filepath = os.path.join(merge_output_dir, segs_filename) #
-
-    # 写入文件的 *确切* 路径 (它们已经在 /storage 中)
-    with open(segs_filepath, 'w') as f: #
-        for filepath in sorted(transcoded_files): # 确保顺序
-            f.write(f"file '{filepath}'\n") #
+    # 流式模式下编排器已经边转码边写好了片段列表 (segs_path)，直接使用
+    segs_filepath = event.get('segs_path')
+    if not segs_filepath:
+        # 片段列表文件写入共享卷
+        segs_filename = f'segs_{shortname1}_{target_type}.txt' #
+        segs_filepath = os.path.join(merge_output_dir, segs_filename) #
+
+        # 写入文件的 *确切* 路径 (它们已经在 /storage 中)
+        with open(segs_filepath, 'w') as f: #
+            for filepath in sorted(transcoded_files): # 确保顺序
+                f.write(f"file '{filepath}'\n") #
 
     merged_filename = f'{output_prefix}_{shortname1}.{target_type}' #
     merged_filepath = os.path.join(merge_output_dir, merged_filename) #
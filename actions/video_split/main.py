@@ -3,7 +3,11 @@ import logging
 import os
 import math
 
-MAX_SPLIT_NUM = 4 #
+from segment_list import read_complete_lines # 位于 /proxy/，与 controller 的流式读取共用
+
+MAX_SPLIT_NUM = 4 # 非自适应模式 (以及自适应模式未指定上限时) 的分片数上限
+COLD_START_BREAK_EVEN = 60 # 每个暖容器分到的视频时长低于该秒数时，不为多出的分片冷启动新容器
+COLD_START_BUDGET = 1 # 不值得冷启动时最多使用的分片数 (没有暖容器时也至少切成 1 片)
 LOGGER = logging.getLogger()
 STORAGE_DIR = '/storage' # 我们共享的卷目录
 
@@ -20,10 +24,51 @@ def exec_FFmpeg_cmd(cmd_lst):
         LOGGER.error(f'FFmpeg Error: {exc.stderr}') #
         raise
 
+def getKeyframeTimes(input_video):
+    # 只读取视频流的包头 (不解码)，返回所有关键帧的时间戳
+    cmd = (
+        f'ffprobe -v quiet -select_streams v:0 -show_entries packet=pts_time,flags '
+        f'-of csv="p=0" {input_video}'
+    )
+    raw_result = subprocess.check_output(cmd, shell=True)
+    keyframes = []
+    for line in raw_result.decode().splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and 'K' in fields[1]:
+            try:
+                keyframes.append(float(fields[0]))
+            except ValueError:
+                continue
+    return sorted(keyframes)
+
+def chooseSplitNum(video_duration, target_segment_time, warm_workers, max_split_num, cold_start_break_even,
+                   cold_budget=COLD_START_BUDGET):
+    # 1. 按目标分片时长得到的分片数，并受上限约束
+    split_num = max(1, math.ceil(video_duration / target_segment_time))
+    split_num = min(split_num, max(1, max_split_num))
+    # 2. 多出暖容器数量的分片会触发冷启动；只有每个暖容器 (没有暖容器时按 1 个算) 分到的时长足够长时才值得，
+    #    否则只用暖容器，暖容器不足 cold_budget 个时按 cold_budget 切
+    if split_num > warm_workers:
+        if video_duration / max(warm_workers, 1) < cold_start_break_even:
+            split_num = min(split_num, max(warm_workers, cold_budget, 1))
+    return split_num
+
+def chooseSegmentTimes(video_duration, split_num, keyframes):
+    # 把等分切点吸附到最近的关键帧上 (-c copy 只能在关键帧处切)，避免分片长短悬殊
+    cut_times = []
+    for i in range(1, split_num):
+        ideal = video_duration * i / split_num
+        candidates = [t for t in keyframes if t > (cut_times[-1] if cut_times else 0.0) and t < video_duration]
+        cut = min(candidates, key=lambda t: abs(t - ideal)) if candidates else ideal
+        if not cut_times or cut > cut_times[-1]:
+            cut_times.append(cut)
+    return cut_times
+
 # proxy.py 将调用这个函数
 def main(event):
     video_name = event['video_name']
     segment_time_seconds = int(event['segment_time'])
+    adaptive = event.get('adaptive', False)
 
     input_filepath = os.path.join(STORAGE_DIR,'sources', video_name)
     
@@ -32,27 +77,46 @@ def main(event):
     os.makedirs(video_proc_dir, exist_ok=True) #
 
     video_duration = getVideoDuration(input_filepath) #
-    split_num = math.ceil(video_duration / segment_time_seconds) #
-    
-    if split_num > MAX_SPLIT_NUM: #
-        segment_time_seconds = int(math.ceil(video_duration / MAX_SPLIT_NUM)) + 1 #
+
+    if adaptive:
+        # 自适应: 综合视频时长、关键帧位置、可用暖 transcode 容器数和目标分片时长
+        split_num = chooseSplitNum(
+            video_duration,
+            float(event.get('target_segment_time', segment_time_seconds)),
+            int(event.get('warm_workers', 0)),
+            int(event.get('max_split_num', MAX_SPLIT_NUM)),
+            float(event.get('cold_start_break_even', COLD_START_BREAK_EVEN)),
+            int(event.get('cold_budget', COLD_START_BUDGET))
+        )
+        cut_times = chooseSegmentTimes(video_duration, split_num, getKeyframeTimes(input_filepath))
+        segment_option = f'-segment_times {",".join(f"{t:.3f}" for t in cut_times)} ' if cut_times else f'-segment_time {math.ceil(video_duration) + 1} '
+        print(f"VIDEO_SPLIT: duration={video_duration:.1f}s, split_num={split_num}, cuts={cut_times}")
+    else:
+        split_num = math.ceil(video_duration / segment_time_seconds) #
+
+        if split_num > MAX_SPLIT_NUM: #
+            segment_time_seconds = int(math.ceil(video_duration / MAX_SPLIT_NUM)) + 1 #
+        segment_option = f'-segment_time {segment_time_seconds} '
 
     shortname, extension = os.path.splitext(video_name) #
-    
+
+    # 分片列表: ffmpeg 每写完一个分片追加一行完整路径，编排器可以边切边读 (流式模式)
+    segment_list_path = event.get('segment_list') or os.path.join(video_proc_dir, f'segments_{shortname}.txt')
+    if os.path.exists(segment_list_path):
+        os.remove(segment_list_path)
+
     # FFmpeg 直接写入共享卷
     command = (
         f'ffmpeg -i {input_filepath} -c copy -f segment ' #
-        f'-segment_time {segment_time_seconds} -reset_timestamps 1 ' #
+        f'{segment_option}-reset_timestamps 1 ' #
+        f'-segment_list {segment_list_path} -segment_list_type flat ' #
+        f'-segment_list_entry_prefix {video_proc_dir}/ ' #
         f'{video_proc_dir}/split_{shortname}_piece_%02d{extension}' #
     )
     exec_FFmpeg_cmd([command]) #
 
-    # 收集在共享卷上创建的文件名
-    split_keys = []
-    for filename in os.listdir(video_proc_dir): #
-        if filename.startswith(f'split_{shortname}'): #
-            # 返回完整路径以供下一步使用
-            split_keys.append(os.path.join(video_proc_dir, filename)) #
+    # 按分片顺序返回本次生成的完整路径 (不会混入目录里的旧文件)
+    split_keys = read_complete_lines(segment_list_path)
 
     # 将文件列表返回给编排器
     return {'split_keys': split_keys}
\ No newline at end of file
@@ -13,6 +13,29 @@ def exec_FFmpeg_cmd(cmd_lst):
         LOGGER.error(f'FFmpeg Error: {exc.stderr}') #
         raise
 
+def get_cpu_quota():
+    # 容器可用的 CPU 数: cgroup 配额 (v2 的 cpu.max 或 v1 的 cfs_quota/period) 与 cpuset 取较小值
+    cpus = len(os.sched_getaffinity(0))
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+            if limit != 'max':
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, quota)
+    return max(1, int(cpus))
+
 def get_fileNameExt(filename):
     (fileDir, tempfilename) = os.path.split(filename) #
     (shortname, extension) = os.path.splitext(tempfilename) #
@@ -35,10 +58,27 @@ def main(event):
     transcoded_filename = f'transcoded_{shortname}.{target_type}' #
     transcoded_filepath = os.path.join(transcoded_output_dir, transcoded_filename)
 
+    # 线程数按容器的 CPU 配额确定，可通过 threads 显式覆盖
+    threads = int(event.get('threads') or get_cpu_quota())
+
+    # 先写到本次尝试专属的文件 (保留扩展名供 ffmpeg 推断格式)，完成后原子重命名；
+    # defer_commit (编排器对慢任务发起重复尝试时) 不重命名，返回专属文件，由编排器只提交先完成的一次，落后的一次不会覆盖已采用的结果
+    attempt_id = event.get('attempt_id') or os.urandom(4).hex()
+    attempt_filepath = os.path.join(transcoded_output_dir, f'transcoded_{shortname}.{attempt_id}.{target_type}')
+    defer_commit = bool(event.get('defer_commit'))
+
     # FFmpeg 从共享卷读取并写入共享卷
-    exec_FFmpeg_cmd([
-        f'ffmpeg -y -threads 1 -i {input_filepath} -threads 1 {transcoded_filepath}' #
-    ])
+    try:
+        exec_FFmpeg_cmd([
+            f'ffmpeg -y -threads {threads} -i {input_filepath} -threads {threads} {attempt_filepath}' #
+        ])
+        if defer_commit:
+            return {'transcoded_file': attempt_filepath}
+        os.replace(attempt_filepath, transcoded_filepath)
+    except BaseException:
+        if os.path.exists(attempt_filepath):
+            os.remove(attempt_filepath)
+        raise
 
     # 返回新的转码文件路径
     return {'transcoded_file': transcoded_filepath}
\ No newline at end of file
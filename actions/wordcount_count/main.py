@@ -36,8 +36,15 @@ def main(event):
     result_filename = f"count_{os.path.splitext(base_name)[0]}.json" # e.g., "count_chunk_0.json"
     result_filepath = os.path.join(output_dir, result_filename)
     
-    with open(result_filepath, 'w') as f:
+    # 先写到本次尝试专属的文件 (count_chunk_0.<attempt_id>.json) 再原子重命名: 编排器对慢任务发起重复尝试时，两次尝试互不干扰；
+    # defer_commit 时不重命名，返回专属文件，由编排器只提交先完成的一次
+    attempt_id = event.get('attempt_id') or os.urandom(4).hex()
+    tmp_filepath = os.path.join(output_dir, f"count_{os.path.splitext(base_name)[0]}.{attempt_id}.json")
+    with open(tmp_filepath, 'w') as f:
         json.dump(dic, f)
+    if event.get('defer_commit'):
+        return {"result_path": tmp_filepath}
+    os.replace(tmp_filepath, result_filepath)
 
     print(f"WORDCOUNT_COUNT: Finished chunk {chunk_path}. Result saved to {result_filepath}")
 
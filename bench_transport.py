@@ -0,0 +1,100 @@
+# bench_transport.py
+# 比较 controller -> proxy 各传输方式对小请求的延迟 (见 proxy_client.py):
+#   port          - 发布端口 127.0.0.1:<HostPort> (docker-proxy / DNAT)，持久连接
+#   port+requests - 同上，但和原来的 controller 一样每次请求用 requests 新建连接
+#   bridge        - 容器网桥 IP (仅 docker 后端)
+#   uds           - 共享目录中的 Unix 域套接字
+# 每种传输启动一个容器，先预热，然后顺序发送 --requests 次 /status (纯传输) 和小 payload 的 /run。
+# 用法: python3 bench_transport.py --backend docker --image video-proxy:latest --requests 2000
+import time
+import statistics
+
+import proxy_client
+from function_manager import FunctionManager
+
+
+def _percentile(samples, percentile):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percentile / 100.0))]
+
+
+def _measure(call, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench(transport, args):
+    client = 'requests' if transport == 'port+requests' else 'proxy_client'
+    manager = FunctionManager(
+        function_name=args.function,
+        image_name=args.image,
+        container_port=5000,
+        host_storage_path=None,
+        min_idle_containers=0,
+        backend=args.backend,
+        transport=transport.split('+')[0],
+    )
+    try:
+        endpoint, container_id = manager.get_container_for_request()
+        if not endpoint:
+            return None
+        startup = manager.containers[container_id]["startup"]
+        proxy_client.post(endpoint, "/init", {"action": args.function}, timeout=30)
+        payload = {"param": args.param}
+
+        if client == 'requests':
+            import requests
+            status = lambda: requests.get(f"{endpoint}/status", timeout=10).raise_for_status()
+            run = lambda: requests.post(f"{endpoint}/run", json=payload, timeout=30).raise_for_status()
+        else:
+            status = lambda: proxy_client.get(endpoint, "/status", timeout=10).raise_for_status()
+            run = lambda: proxy_client.post(endpoint, "/run", payload, timeout=30).raise_for_status()
+
+        _measure(status, args.warmup)
+        _measure(run, args.warmup)
+        results = {"address_s": startup.get("address_s"), "ready_s": startup.get("ready_s")}
+        for name, call in (("status", status), ("run", run)):
+            latencies = _measure(call, args.requests)
+            results[name] = {"mean": statistics.mean(latencies), "p50": _percentile(latencies, 50),
+                             "p99": _percentile(latencies, 99)}
+        manager.release_container(container_id)
+        return results
+    finally:
+        manager.stop_all_containers()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["docker", "local"], default="docker")
+    parser.add_argument("--image", default="video-proxy:latest")
+    parser.add_argument("--transports", nargs="+", default=["port+requests", "port", "bridge", "uds"],
+                        choices=["port+requests", "port", "bridge", "uds"])
+    parser.add_argument("--function", default="matmul", help="用于 /run 的 action (payload 为 {'param': --param})")
+    parser.add_argument("--param", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = []
+    for transport in args.transports:
+        if transport == 'bridge' and args.backend != 'docker':
+            print(f"Skipping bridge: requires the docker backend.")
+            continue
+        print(f"--- {transport} ({args.backend}) ---")
+        result = bench(transport, args)
+        if result is None:
+            print(f"Failed to start a container for {transport}.")
+            continue
+        rows.append((transport, result))
+
+    us = lambda seconds: f"{seconds * 1e6:.0f}"
+    print(f"\n{'transport':<14} {'address_ms':>10} {'ready_ms':>9} {'status p50/p99 us':>18} {'run p50/p99 us':>16} {'run mean us':>11}")
+    for transport, r in rows:
+        print(f"{transport:<14} {r['address_s'] * 1000:>10.1f} {r['ready_s'] * 1000:>9.1f} "
+              f"{us(r['status']['p50']) + '/' + us(r['status']['p99']):>18} {us(r['run']['p50']) + '/' + us(r['run']['p99']):>16} "
+              f"{us(r['run']['mean']):>11}")
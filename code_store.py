@@ -0,0 +1,121 @@
+# code_store.py
+# controller 端的 action 代码仓库，用于不重建镜像的热更新 (POST /deploy/<fn>):
+#   - 把 actions/<fn>/ 打包成确定性的 tar.gz (条目排序，mtime/uid 归零，忽略 __pycache__)，
+#     版本号是包内容的 sha256 前 16 位，同样的代码总是得到同样的版本；
+#   - 包保存在 CODE_STORE_DIR/<fn>/<版本>.tar.gz，当前版本记在 CODE_STORE_DIR/<fn>/CURRENT，controller 重启后仍然有效；
+#   - proxy 的 /init 带上 {"versions": {fn: 版本}}，容器里没有该版本时返回 409 和缺少的 action，
+#     controller 再把包以 base64 放进 "bundles" 重发 (见 controller._init_container)。
+# 没有 deploy 过的函数不带版本，proxy 仍然使用镜像里 /proxy/exec/actions 的代码。
+import io
+import os
+import gzip
+import base64
+import hashlib
+import tarfile
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ACTIONS_DIR = os.path.join(BASE_DIR, "actions")
+CODE_STORE_DIR = os.environ.get("CODE_STORE_DIR", os.path.join(BASE_DIR, "storage", "code"))
+VERSION_LENGTH = 16
+IGNORED_NAMES = ('__pycache__',)
+
+
+def _reset_info(info):
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    return info
+
+
+def build_bundle(source_dir):
+    """把 source_dir 打包成 tar.gz 字节串，返回 (版本, 字节串)；内容相同的目录得到相同的字节串。"""
+    buffer = io.BytesIO()
+    # gzip 头里的 mtime 也固定为 0
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode='w') as tar:
+            for root, dirs, files in os.walk(source_dir):
+                dirs[:] = sorted(d for d in dirs if d not in IGNORED_NAMES)
+                for name in sorted(files):
+                    if name.endswith('.pyc'):
+                        continue
+                    path = os.path.join(root, name)
+                    tar.add(path, arcname=os.path.relpath(path, source_dir), recursive=False, filter=_reset_info)
+    data = buffer.getvalue()
+    return hashlib.sha256(data).hexdigest()[:VERSION_LENGTH], data
+
+
+class CodeStore:
+    def __init__(self, root=CODE_STORE_DIR, actions_dir=ACTIONS_DIR):
+        self.root = root
+        self.actions_dir = actions_dir
+        self.current = {} # {action: 版本}，第一次查询时从 CURRENT 文件读取
+        self.encoded = {} # {(action, 版本): base64 字符串}，同一个包推给多个容器时只编码一次
+        self.lock = threading.Lock()
+
+    def _current_path(self, action):
+        return os.path.join(self.root, action, "CURRENT")
+
+    def _bundle_path(self, action, version):
+        return os.path.join(self.root, action, f"{version}.tar.gz")
+
+    def deploy(self, action):
+        """
+        打包 actions/<action>/ 并设为当前版本；返回 (版本, 是否与之前的版本不同)。
+        action 目录不存在时抛出 ValueError。
+        """
+        source_dir = os.path.join(self.actions_dir, action)
+        if not os.path.isfile(os.path.join(source_dir, 'main.py')):
+            raise ValueError(f"Unknown action: {action}")
+        version, data = build_bundle(source_dir)
+        os.makedirs(os.path.join(self.root, action), exist_ok=True)
+        path = self._bundle_path(action, version)
+        if not os.path.exists(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        with self.lock:
+            changed = self._version(action) != version
+            with open(self._current_path(action) + ".tmp", "w") as f:
+                f.write(version)
+            os.replace(self._current_path(action) + ".tmp", self._current_path(action))
+            self.current[action] = version
+        return version, changed
+
+    def _version(self, action):
+        # 调用方持有 self.lock
+        if action not in self.current:
+            try:
+                with open(self._current_path(action)) as f:
+                    self.current[action] = f.read().strip() or None
+            except OSError:
+                self.current[action] = None
+        return self.current[action]
+
+    def version(self, action):
+        """action 的当前版本；从没有 deploy 过时返回 None (使用镜像里的代码)。"""
+        with self.lock:
+            return self._version(action)
+
+    def bundle(self, action, version):
+        """版本对应的包，base64 编码 (proxy /init 的 "bundles" 字段)。"""
+        key = (action, version)
+        with self.lock:
+            if key not in self.encoded:
+                with open(self._bundle_path(action, version), "rb") as f:
+                    self.encoded = {k: v for k, v in self.encoded.items() if k[0] != action} # 每个 action 只缓存一个版本
+                    self.encoded[key] = base64.b64encode(f.read()).decode('ascii')
+            return self.encoded[key]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # 进程内唯一的代码仓库
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CodeStore()
+        return _store
@@ -0,0 +1,320 @@
+# colocation_experiment.py
+# 通用的共置干扰实验 (取代 compete_ht.sh / compete_iso.sh 里写死的 0,64 / 0,2、端口和 curl)。
+# 实验矩阵 = 函数组 x CPU 放置 x 输入规模:
+#   函数组     - 同时运行的一组函数，例如 matmul+matmul、matmul+linpack+float_operation (不限两个)
+#   CPU 放置   - same_core   所有任务在同一个硬件线程上 (分时)
+#                smt_sibling 任务依次落在同一物理核的兄弟线程上 (超线程竞争，对应 compete_ht.sh)
+#                same_socket 每个任务一个物理核，全部在同一个 NUMA 节点 (对应 compete_iso.sh)
+#                cross_numa  每个任务一个物理核，轮流分布在不同 NUMA 节点
+#   输入规模   - 写入 payload 的 size_key (默认 "param"，matmul / linpack / float_operation 都用它)
+# 每个任务通过 FunctionManager 启动绑定到指定 CPU 的容器 (pinned 放置)，先 init 再用屏障同时 run，
+# 期间对这些 CPU 做系统级、按 CPU 不聚合的 perf stat (-a -A -C)。每个 (函数, 规模, CPU) 还会单独运行一次作为基线，
+# 结果是一行一个任务的整洁表 (CSV)，包含延迟、单独运行延迟、slowdown 和计数器特征:
+#   ipc / l3_mpki / l3_stall_fraction          - 该任务所在 CPU 的计数器；cpu_shared=True 时 (same_core) 这个 CPU
+#                                                上还有组内其他任务，计数器无法再按任务拆开
+#   group_ipc / group_l3_mpki / group_l3_stall_fraction - 整组 CPU 的合计，组内每行相同
+#
+# 用法 (需要 docker 和 sudo perf；--backend local 时不需要 docker):
+#   python3 colocation_experiment.py --groups matmul+matmul matmul+linpack --sizes 4000 8000 --repeat 3
+#   python3 colocation_experiment.py --spec experiment.json      # 同名字段的 JSON
+#   python3 colocation_experiment.py --plan                     # 只打印每种放置选中的 CPU，不运行
+import os
+import csv
+import json
+import time
+import signal
+import statistics
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cpu_topology
+import interference
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(BASE_DIR, "storage/colocation")
+PARAMETERS_FILE = os.path.join(BASE_DIR, "actions/parameters.json")
+
+PLACEMENTS = ('same_core', 'smt_sibling', 'same_socket', 'cross_numa')
+DEFAULTS = {
+    "groups": [["matmul", "matmul"]],
+    "placements": list(PLACEMENTS),
+    "sizes": [20000],
+    "size_key": "param",
+    "repeat": 1,
+    "image_name": "video-proxy:latest",
+    "container_port": 5000,
+    "host_storage_path": None,
+    "backend": "docker",
+    "perf": True,
+}
+COLUMNS = ["group", "placement", "size", "task", "function", "cpu", "repeat",
+           "wall_s", "reported_s", "solo_s", "slowdown", "ipc", "l3_mpki", "l3_stall_fraction", "cpu_shared",
+           "group_ipc", "group_l3_mpki", "group_l3_stall_fraction"]
+
+
+def placement_cpus(topology, placement, count):
+    """为 count 个任务按放置方式选 CPU；本机拓扑无法满足时返回 None (例如没有 SMT 或只有一个 NUMA 节点)。"""
+    cores = sorted(topology.cores.items(), key=lambda item: (topology.node_of[item[1][0]], item[0]))
+    if placement == 'same_core':
+        return [topology.cpus[0]] * count
+    if placement == 'smt_sibling':
+        if max(len(threads) for _, threads in cores) < 2:
+            return None
+        cpus = [cpu for _, threads in cores for cpu in threads if len(threads) > 1]
+        return cpus[:count] if len(cpus) >= count else None
+    if placement == 'same_socket':
+        for node in sorted(topology.nodes):
+            first_threads = [threads[0] for _, threads in cores if topology.node_of[threads[0]] == node]
+            if len(first_threads) >= count:
+                return first_threads[:count]
+        return None
+    if placement == 'cross_numa':
+        if len(topology.nodes) < 2:
+            return None
+        per_node = {node: [threads[0] for _, threads in cores if topology.node_of[threads[0]] == node]
+                    for node in sorted(topology.nodes)}
+        cpus = []
+        while len(cpus) < count and any(per_node.values()):
+            for node in sorted(per_node):
+                if per_node[node] and len(cpus) < count:
+                    cpus.append(per_node[node].pop(0))
+        return cpus if len(cpus) == count else None
+    raise ValueError(f"Unknown co-location placement: {placement}")
+
+
+def _load_parameters():
+    try:
+        with open(PARAMETERS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class PerfSession:
+    """对一组 CPU 做系统级 perf stat (与 compete_*.sh 一样 -C，另加 -A 按 CPU 分开计数)，stop() 后解析计数器。"""
+    def __init__(self, cpus, output_file, enabled=True):
+        self.output_file = output_file
+        self.process = None
+        self.log_file = None
+        if not enabled:
+            return
+        try:
+            self.log_file = open(output_file, 'w')
+            self.process = subprocess.Popen(
+                ['sudo', 'perf', 'stat', '-a', '-A', '-C', cpu_topology.format_cpulist(set(cpus)),
+                 '-e', interference.PERF_EVENTS, 'sleep', '3000'],
+                stdout=subprocess.PIPE, stderr=self.log_file, preexec_fn=os.setsid)
+            time.sleep(0.5) # 给 perf 一点时间挂上计数器
+        except Exception as e:
+            print(f"Warning: failed to start perf (continuing without counters): {e}")
+            self.process = None
+
+    def stop(self):
+        """返回 ({cpu: 特征}, 整组特征)；整组特征由各 CPU 的计数器相加后计算。"""
+        if self.process is None:
+            return {}, {}
+        try:
+            os.killpg(os.getpgid(self.process.pid), signal.SIGINT)
+        except ProcessLookupError:
+            pass
+        try:
+            self.process.communicate(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log_file.close()
+        per_cpu = interference.parse_perf_log_per_cpu(self.output_file)
+        total = {}
+        for counters in per_cpu.values():
+            for event, value in counters.items():
+                total[event] = value if event == 'elapsed_ms' else total.get(event, 0.0) + value
+        return {cpu: interference.features(counters) for cpu, counters in per_cpu.items()}, interference.features(total)
+
+
+class ColocationExperiment:
+    def __init__(self, config):
+        self.config = dict(DEFAULTS, **config)
+        self.topology = cpu_topology.CpuTopology()
+        self.parameters = _load_parameters()
+        self.managers = {} # {(function, cpu): FunctionManager}，同一 CPU 上的同名任务共用 manager (忙时自动多开容器)
+        self.solo = {} # {(function, size, cpu): [wall_s, ...]}
+        self.rows = []
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    def plan(self):
+        """[(group, placement, cpus)]，拓扑无法满足的放置 cpus 为 None。"""
+        return [(group, placement, placement_cpus(self.topology, placement, len(group)))
+                for group in self.config["groups"] for placement in self.config["placements"]]
+
+    def _manager(self, function_name, cpu):
+        from function_manager import FunctionManager
+        key = (function_name, cpu)
+        if key not in self.managers:
+            self.managers[key] = FunctionManager(
+                function_name=function_name,
+                image_name=self.config["image_name"],
+                container_port=self.config["container_port"],
+                host_storage_path=self.config["host_storage_path"],
+                min_idle_containers=0,
+                idle_timeout=3600,
+                placement={"policy": "pinned", "cpu_list": str(cpu)},
+                backend=self.config["backend"],
+            )
+        return self.managers[key]
+
+    def _payload(self, function_name, size):
+        payload = dict(self.parameters.get(function_name, {}))
+        payload[self.config["size_key"]] = size
+        return payload
+
+    def run_tasks(self, tasks, tag):
+        """
+        tasks: [(function, cpu, payload)]。先为每个任务取得暖容器并 init (冷启动不计入)，
+        再在 perf 下同时发出 run。返回 ([(wall_s, reported_s)], ({cpu: 特征}, 整组特征))。
+        """
+        import proxy_client
+        acquired = []
+        try:
+            for function_name, cpu, _ in tasks:
+                manager = self._manager(function_name, cpu)
+                endpoint, container_id = manager.get_container_for_request()
+                if not endpoint:
+                    raise RuntimeError(f"failed to start {function_name} on cpu {cpu}")
+                acquired.append((manager, endpoint, container_id))
+                proxy_client.post(endpoint, "/init", {"action": function_name}, timeout=30)
+
+            barrier = threading.Barrier(len(tasks))
+
+            def run(index):
+                _, endpoint, _ = acquired[index]
+                barrier.wait()
+                start = time.time()
+                r = proxy_client.post(endpoint, "/run", tasks[index][2], timeout=3600)
+                wall = time.time() - start
+                r.raise_for_status()
+                result = (r.json() or {}).get("result") or {}
+                return wall, result.get("latency") if isinstance(result, dict) else None
+
+            perf = PerfSession([cpu for _, cpu, _ in tasks], os.path.join(OUTPUT_DIR, f"{tag}.txt"), self.config["perf"])
+            try:
+                with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+                    latencies = list(executor.map(run, range(len(tasks))))
+            finally:
+                counters = perf.stop()
+            return latencies, counters
+        finally:
+            for manager, _, container_id in acquired:
+                manager.release_container(container_id)
+
+    def solo_latency(self, function_name, size, cpu):
+        key = (function_name, size, cpu)
+        if key not in self.solo:
+            self.solo[key] = []
+            for i in range(self.config["repeat"]):
+                latencies, _ = self.run_tasks([(function_name, cpu, self._payload(function_name, size))],
+                                              f"solo_{function_name}_{size}_cpu{cpu}_{i}")
+                self.solo[key].append(latencies[0][0])
+        return statistics.median(self.solo[key])
+
+    def run(self):
+        for group, placement, cpus in self.plan():
+            name = '+'.join(group)
+            if cpus is None:
+                print(f"Skipping {name} / {placement}: not possible on this topology.")
+                continue
+            for size in self.config["sizes"]:
+                tasks = [(function_name, cpu, self._payload(function_name, size)) for function_name, cpu in zip(group, cpus)]
+                for i in range(self.config["repeat"]):
+                    print(f"Running {name} / {placement} (cpus {','.join(map(str, cpus))}) size={size} repeat={i}")
+                    latencies, (per_cpu, group_counters) = self.run_tasks(tasks, f"{name}_{placement}_{size}_{i}")
+                    for task, ((function_name, cpu, _), (wall, reported)) in enumerate(zip(tasks, latencies)):
+                        solo = self.solo_latency(function_name, size, cpu)
+                        counters = per_cpu.get(cpu, {})
+                        self.rows.append({
+                            "group": name, "placement": placement, "size": size, "task": task,
+                            "function": function_name, "cpu": cpu, "repeat": i,
+                            "wall_s": wall, "reported_s": reported, "solo_s": solo,
+                            "slowdown": wall / solo if solo else None,
+                            "ipc": counters.get("ipc"), "l3_mpki": counters.get("l3_mpki"),
+                            "l3_stall_fraction": counters.get("l3_stall_fraction"), "cpu_shared": cpus.count(cpu) > 1,
+                            "group_ipc": group_counters.get("ipc"), "group_l3_mpki": group_counters.get("l3_mpki"),
+                            "group_l3_stall_fraction": group_counters.get("l3_stall_fraction"),
+                        })
+        return self.rows
+
+    def stop(self):
+        for manager in self.managers.values():
+            manager.stop_all_containers()
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+def summarize(rows):
+    """按 (组, 放置, 规模, 任务) 取各次重复的中位数。"""
+    cells = {}
+    for row in rows:
+        cells.setdefault((row["group"], row["placement"], row["size"], row["task"], row["function"], row["cpu"]), []).append(row)
+    summary = []
+    for (group, placement, size, task, function_name, cpu), cell in cells.items():
+        median = lambda key: statistics.median([r[key] for r in cell if r[key] is not None]) if any(r[key] is not None for r in cell) else None
+        summary.append({"group": group, "placement": placement, "size": size, "task": task, "function": function_name,
+                        "cpu": cpu, "wall_s": median("wall_s"), "solo_s": median("solo_s"), "slowdown": median("slowdown"),
+                        "ipc": median("ipc"), "cpu_shared": cell[0]["cpu_shared"], "group_ipc": median("group_ipc")})
+    return summary
+
+
+def print_table(summary):
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    print(f"{'group':<28} {'placement':<12} {'size':>7} {'task':>4} {'function':<16} {'cpu':>4} "
+          f"{'wall_s':>8} {'solo_s':>8} {'slowdown':>8} {'ipc':>6} {'grp_ipc':>7}")
+    for row in summary:
+        print(f"{row['group']:<28} {row['placement']:<12} {row['size']:>7} {row['task']:>4} {row['function']:<16} {row['cpu']:>4} "
+              f"{fmt(row['wall_s'], '.3f'):>8} {fmt(row['solo_s'], '.3f'):>8} {fmt(row['slowdown'], '.2f'):>8} "
+              f"{fmt(row['ipc'], '.2f') + ('*' if row['cpu_shared'] else ' '):>6} {fmt(row['group_ipc'], '.2f'):>7}")
+    if any(row['cpu_shared'] for row in summary):
+        print("* the cpu is shared with other tasks of the group, so its ipc covers all of them")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spec", help="JSON 实验矩阵 (字段同下面的参数，groups 为函数名列表的列表)")
+    parser.add_argument("--groups", nargs="+", help="同时运行的函数组，例如 matmul+matmul matmul+linpack")
+    parser.add_argument("--placements", nargs="+", choices=PLACEMENTS)
+    parser.add_argument("--sizes", nargs="+", type=int)
+    parser.add_argument("--size-key", dest="size_key")
+    parser.add_argument("--repeat", type=int)
+    parser.add_argument("--image", dest="image_name")
+    parser.add_argument("--storage", dest="host_storage_path", help="需要 /storage 的函数所用的宿主机共享目录")
+    parser.add_argument("--backend", choices=["docker", "local"], help="容器后端 (见 container_backend.py)")
+    parser.add_argument("--no-perf", dest="perf", action="store_false", default=None)
+    parser.add_argument("--output", default=os.path.join(OUTPUT_DIR, "results.csv"))
+    parser.add_argument("--plan", action="store_true", help="只打印每种放置选中的 CPU")
+    args = parser.parse_args()
+
+    config = {}
+    if args.spec:
+        with open(args.spec) as f:
+            config.update(json.load(f))
+    for key in ("placements", "sizes", "size_key", "repeat", "image_name", "host_storage_path", "backend", "perf"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if args.groups:
+        config["groups"] = [group.split('+') for group in args.groups]
+
+    experiment = ColocationExperiment(config)
+    if args.plan:
+        for group, placement, cpus in experiment.plan():
+            print(f"{'+'.join(group):<28} {placement:<12} cpus={','.join(map(str, cpus)) if cpus else 'n/a'}")
+    else:
+        try:
+            experiment.run()
+        finally:
+            experiment.stop()
+        experiment.write_csv(args.output)
+        print_table(summarize(experiment.rows))
+        print(f"Results written to {args.output}")
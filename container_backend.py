@@ -0,0 +1,417 @@
+# container_backend.py
+# FunctionManager 使用的容器生命周期后端: 创建、等待就绪、地址查询、停止/删除、暂停、日志、PID。
+#   docker - 默认，docker run 镜像 (与原来的行为相同)
+#   local  - 不需要 Docker 守护进程: 直接以子进程启动本仓库的 proxy.py，绑定到一个空闲的本地端口。
+#            用于开发基准测试和 CI，也可以与 docker 对比冷启动中 Docker 本身占了多少。
+#            卷: 目标路径 (例如 /storage) 已经指向源目录时直接使用；namespace=True 时用 unshare 在独立的
+#            挂载命名空间里 bind mount (需要目标目录存在)；否则只打印警告，action 会看到宿主机自己的路径。
+#            CPU 放置用 taskset 前缀实现 cpuset_cpus；nano_cpus / cpuset_mems 被忽略。
+# 后端返回的容器句柄都有 id / name 属性，其他操作都通过后端方法完成。
+# 传输方式 (transport，见 proxy_client.py): port (发布端口) / bridge (容器网桥 IP，仅 docker) / uds (Unix 域套接字)。
+# address() 返回 proxy 端点字符串: http://host:port 或 unix:///path/to.sock。
+# 容器创建时带上 labels (函数名、配置摘要等，见 FunctionManager.labels)；persistent 的后端 (docker) 中容器
+# 可以在 controller 重启后按标签找回 (list_labeled) 并重新接管。
+import os
+import sys
+import time
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import threading
+from collections import deque
+
+import proxy_client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ('docker', 'local')
+# uds 传输的套接字目录 (宿主机)，docker 后端把它挂载到容器的 CONTAINER_SOCKET_DIR；路径总长不能超过 108 字节
+SOCKET_DIR = os.environ.get('PROXY_SOCKET_DIR', os.path.join(BASE_DIR, 'storage', 'sockets'))
+CONTAINER_SOCKET_DIR = '/proxy_sockets'
+
+
+def socket_path(name):
+    return os.path.join(SOCKET_DIR, f"{name}.sock")
+
+
+def _remove_socket(name):
+    try:
+        os.unlink(socket_path(name))
+    except OSError:
+        pass
+
+
+class ContainerBackendError(Exception):
+    """后端无法创建或操作容器 (例如镜像不存在)。"""
+
+
+class ContainerBackend:
+    name = None
+    persistent = False # 容器是否能在 controller 进程退出后继续运行并被重新接管
+
+    def create(self, image, name, container_port, environment=None, volumes=None, cpu_kwargs=None, transport='port',
+               labels=None):
+        raise NotImplementedError
+
+    def list_labeled(self, labels):
+        """返回带有全部 labels 的现存容器 (包括已停止和暂停的)；不支持接管的后端返回空列表。"""
+        return []
+
+    def labels(self, container):
+        return {}
+
+    def status(self, container):
+        """running / paused / exited 等。"""
+        return 'running' if self.is_running(container) else 'exited'
+
+    def cpu_kwargs(self, container):
+        """容器当前的 CPU 绑定 (与 CpuPlacer.run_kwargs 的键相同)，用于接管时恢复分配表。"""
+        return {}
+
+    def is_current(self, container, image):
+        """容器是否运行着 image 的当前版本 (镜像重建后旧容器不再接管)。"""
+        return True
+
+    def address(self, container, container_port, transport='port', timeout=30):
+        """返回可以访问容器 proxy 的端点 (http://host:port 或 unix://path)；超时返回 None。"""
+        raise NotImplementedError
+
+    def refresh(self, container):
+        pass
+
+    def is_running(self, container):
+        raise NotImplementedError
+
+    def has_exited(self, container):
+        # 能廉价判断容器已退出的后端覆盖它，让 wait_ready 提前失败
+        return False
+
+    def pid(self, container):
+        raise NotImplementedError
+
+    def logs(self, container, tail=50):
+        raise NotImplementedError
+
+    def pause(self, container):
+        raise NotImplementedError
+
+    def unpause(self, container):
+        raise NotImplementedError
+
+    def remove(self, container):
+        """停止并删除容器；已经不存在时静默返回。"""
+        raise NotImplementedError
+
+    def wait_ready(self, container, endpoint, timeout=30, check_interval=0.01):
+        """
+        轮询 proxy 的 /status 直到就绪。
+        timeout: 总超时时间(秒)
+        check_interval: 每次轮询前 sleep 的时间(秒)
+        """
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            try:
+                response = proxy_client.get(endpoint, "/status", timeout=check_interval)
+                if response.status_code == 200:
+                    try:
+                        data = response.json()
+                    except Exception:
+                        data = {}
+                    if data.get("status") in ["new", "ok", "ready"]:
+                        print(f"Container service on {endpoint} is ready.")
+                        return True
+            except proxy_client.ProxyConnectionError:
+                pass
+            if self.has_exited(container):
+                break # 进程已经退出，不必等到超时
+            time.sleep(check_interval)
+        print(f"Container service on {endpoint} did not become ready within {timeout} seconds.")
+        return False
+
+
+class DockerBackend(ContainerBackend):
+    name = 'docker'
+    persistent = True
+
+    def __init__(self):
+        import docker
+        self.docker = docker
+        self.client = docker.from_env()
+
+    def create(self, image, name, container_port, environment=None, volumes=None, cpu_kwargs=None, transport='port',
+               labels=None):
+        run_kwargs = {"detach": True, "name": name}
+        environment = dict(environment or {})
+        volumes = dict(volumes or {})
+        if transport == 'port':
+            # 使用 Docker 随机映射宿主端口，避免端口冲突
+            run_kwargs["ports"] = {f"{container_port}/tcp": None}
+        elif transport == 'uds':
+            # proxy 监听挂载进来的套接字目录里的 <容器名>.sock
+            os.makedirs(SOCKET_DIR, exist_ok=True)
+            _remove_socket(name)
+            volumes[SOCKET_DIR] = {'bind': CONTAINER_SOCKET_DIR, 'mode': 'rw'}
+            environment["PROXY_UNIX_SOCKET"] = f"{CONTAINER_SOCKET_DIR}/{name}.sock"
+        if environment:
+            run_kwargs["environment"] = environment
+        if volumes:
+            run_kwargs["volumes"] = volumes
+        if labels:
+            run_kwargs["labels"] = dict(labels)
+        run_kwargs.update(cpu_kwargs or {})
+        try:
+            return self.client.containers.run(image, **run_kwargs)
+        except self.docker.errors.ImageNotFound:
+            raise ContainerBackendError(f"Image '{image}' not found.")
+
+    def address(self, container, container_port, transport='port', timeout=30):
+        if transport == 'uds':
+            return f"unix://{socket_path(container.name)}" # 路径事先确定，不需要等待
+        # port: 等待 Docker 完成端口映射；bridge: 读取容器在网桥上的 IP (容器启动后立即可用)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                container.reload()
+                settings = container.attrs.get("NetworkSettings", {})
+                if transport == 'bridge':
+                    ips = [settings.get("IPAddress")] + [n.get("IPAddress") for n in (settings.get("Networks") or {}).values()]
+                    ip = next((ip for ip in ips if ip), None)
+                    if ip:
+                        return f"http://{ip}:{container_port}"
+                else:
+                    mapping = settings.get("Ports", {}).get(f"{container_port}/tcp")
+                    if mapping and mapping[0].get("HostPort"):
+                        return f"http://127.0.0.1:{int(mapping[0]['HostPort'])}"
+            except Exception as e:
+                print("container inspect exception:", e)
+            time.sleep(0.05 if transport == 'bridge' else 0.5)
+        print(f"Service address ({transport}) not available for container {container.id[:12]}; attrs={container.attrs}")
+        return None
+
+    def list_labeled(self, labels):
+        filters = {"label": [f"{key}={value}" for key, value in labels.items()]}
+        return self.client.containers.list(all=True, filters=filters)
+
+    def labels(self, container):
+        return container.labels or {}
+
+    def status(self, container):
+        return container.status
+
+    def cpu_kwargs(self, container):
+        host_config = container.attrs.get("HostConfig", {})
+        kwargs = {}
+        if host_config.get("CpusetCpus"):
+            kwargs["cpuset_cpus"] = host_config["CpusetCpus"]
+        if host_config.get("CpusetMems"):
+            kwargs["cpuset_mems"] = host_config["CpusetMems"]
+        return kwargs
+
+    def is_current(self, container, image):
+        try:
+            return container.attrs.get("Image") == self.client.images.get(image).id
+        except self.docker.errors.ImageNotFound:
+            return False
+
+    def refresh(self, container):
+        try:
+            container.reload()
+        except Exception:
+            pass
+
+    def is_running(self, container):
+        return container.status == 'running'
+
+    def pid(self, container):
+        container.reload()
+        return container.attrs['State']['Pid']
+
+    def logs(self, container, tail=50):
+        return container.logs(tail=tail).decode('utf-8', errors='ignore')
+
+    def pause(self, container):
+        container.pause()
+
+    def unpause(self, container):
+        container.unpause()
+
+    def remove(self, container):
+        try:
+            # 尝试停止容器，给定一个短的超时；再强制删除，即使它仍在运行或停止失败
+            container.stop(timeout=5)
+            container.remove(force=True)
+        except self.docker.errors.NotFound:
+            print(f"Container {container.id[:12]} not found, likely already removed.")
+        finally:
+            _remove_socket(container.name)
+
+
+class LocalProcess:
+    """local 后端的容器句柄: 一个 proxy.py 子进程 (wrapped 时是包着 proxy.py 的 unshare 进程)。"""
+    def __init__(self, name, process, endpoint, labels=None, wrapped=False):
+        self.id = f"local{os.urandom(8).hex()}" # 与 docker id 一样取前 12 位显示
+        self.name = name
+        self.process = process
+        self.endpoint = endpoint
+        self.labels = dict(labels or {})
+        self.wrapped = wrapped
+        self.proxy_pid = None # proxy.py 进程的 pid，第一次查询时确定
+        self.output = deque(maxlen=1000) # 最近的 stdout/stderr 行
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        for line in iter(self.process.stdout.readline, b''):
+            self.output.append(line.decode('utf-8', errors='ignore'))
+
+
+def _children(pid):
+    # pid 的直接子进程；内核不提供 children 文件时扫描 /proc/<pid>/stat 的 ppid
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # comm 字段可能含空格和括号，从最后一个 ')' 之后解析: state ppid ...
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalProcessBackend(ContainerBackend):
+    name = 'local'
+
+    def __init__(self, proxy_path=None, exec_path=None, namespace=False):
+        self.proxy_path = proxy_path or os.path.join(BASE_DIR, 'proxy.py')
+        self.exec_path = exec_path or os.path.join(BASE_DIR, 'actions')
+        self.namespace = namespace and shutil.which('unshare') is not None
+
+    def _command(self, volumes):
+        command = [sys.executable, self.proxy_path]
+        mounts = []
+        for source, spec in (volumes or {}).items():
+            target = spec['bind']
+            if os.path.realpath(target) == os.path.realpath(source):
+                continue
+            if self.namespace and os.path.isdir(target):
+                mounts.append(f"mount --bind {shlex.quote(source)} {shlex.quote(target)}" +
+                              (f" && mount -o remount,bind,ro {shlex.quote(target)}" if spec.get('mode') == 'ro' else ""))
+            else:
+                print(f"  > Warning: local backend cannot mount {source} -> {target}; actions will see the host's {target}.")
+        if mounts:
+            script = ' && '.join(mounts + ['exec ' + ' '.join(shlex.quote(arg) for arg in command)])
+            command = ['unshare', '--mount', '--map-root-user', '--fork', 'sh', '-c', script]
+        return command
+
+    def create(self, image, name, container_port, environment=None, volumes=None, cpu_kwargs=None, transport='port',
+               labels=None):
+        # image / container_port 对本地进程没有意义: 总是运行本仓库的 proxy.py，端口在宿主机上分配
+        if transport == 'bridge':
+            raise ContainerBackendError("bridge transport requires the docker backend")
+        env = dict(os.environ, **(environment or {}))
+        env.update({"PROXY_EXEC_PATH": self.exec_path, "PYTHONUNBUFFERED": "1"})
+        if transport == 'uds':
+            os.makedirs(SOCKET_DIR, exist_ok=True)
+            _remove_socket(name)
+            endpoint = f"unix://{socket_path(name)}"
+            env["PROXY_UNIX_SOCKET"] = socket_path(name)
+        else:
+            host_port = _free_port()
+            endpoint = f"http://127.0.0.1:{host_port}"
+            env.update({"PROXY_PORT": str(host_port), "PROXY_HOST": "127.0.0.1"})
+        command = self._command(volumes)
+        if cpu_kwargs and cpu_kwargs.get("cpuset_cpus"):
+            # controller 是多线程的，不能用 preexec_fn (子进程可能死锁)；CPU 绑定交给 taskset，在 exec proxy 之前生效
+            if not shutil.which('taskset'):
+                raise ContainerBackendError("CPU placement with the local backend requires taskset")
+            command = ['taskset', '-c', cpu_kwargs["cpuset_cpus"]] + command
+
+        try:
+            # start_new_session: 独立进程组，删除时连同子进程一起结束
+            process = subprocess.Popen(command, env=env, cwd=BASE_DIR, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+        except OSError as e:
+            raise ContainerBackendError(f"failed to start local proxy: {e}")
+        return LocalProcess(name, process, endpoint, labels=labels, wrapped='unshare' in command)
+
+    def address(self, container, container_port, transport='port', timeout=30):
+        return container.endpoint
+
+    def labels(self, container):
+        return container.labels
+
+    def is_running(self, container):
+        return container.process.poll() is None
+
+    def has_exited(self, container):
+        return container.process.poll() is not None
+
+    def pid(self, container):
+        # unshare --fork 包装时 Popen 得到的是 unshare，proxy 是它唯一的子进程 (sh -c 最后 exec 成 python，pid 不变)；
+        # perf 要附加到这个子进程上。还没 fork 出来或已经退出时返回 None
+        if container.proxy_pid is None:
+            if not container.wrapped:
+                container.proxy_pid = container.process.pid
+            else:
+                children = _children(container.process.pid)
+                if len(children) == 1:
+                    container.proxy_pid = children[0]
+        return container.proxy_pid
+
+    def logs(self, container, tail=50):
+        return ''.join(list(container.output)[-tail:])
+
+    def _signal(self, container, sig):
+        try:
+            os.killpg(container.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def pause(self, container):
+        self._signal(container, signal.SIGSTOP)
+
+    def unpause(self, container):
+        self._signal(container, signal.SIGCONT)
+
+    def remove(self, container):
+        if self.is_running(container):
+            self._signal(container, signal.SIGCONT) # 暂停中的进程收不到 SIGTERM
+            self._signal(container, signal.SIGTERM)
+            try:
+                container.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._signal(container, signal.SIGKILL)
+                container.process.wait()
+        _remove_socket(container.name)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name='docker'):
+    """每种后端在进程内共用一个实例 (docker 客户端连接复用)。"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown container backend: {name}")
+    with _backends_lock:
+        if name not in _backends:
+            if name == 'docker':
+                _backends[name] = DockerBackend()
+            else:
+                _backends[name] = LocalProcessBackend(namespace=os.environ.get('LOCAL_BACKEND_NAMESPACE') == '1')
+        return _backends[name]
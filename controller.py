@@ -1,67 +1,495 @@
 # controller.py
 from flask import Flask, json, request, jsonify
 import threading
-from function_manager import FunctionManager #
+from function_manager import FunctionManager, ACQUIRE_TIMEOUT #
+from inline_runner import InlineManager, INLINE_MEMORY_MB
+import cpu_topology
+import interference
 import atexit
 import time
-import requests  # <-- 需要导入 requests
-from concurrent.futures import ThreadPoolExecutor # <-- 新增导入
+import proxy_client # 访问 proxy 的客户端 (port / bridge / uds 传输，持久连接)
+import code_store
+from segment_list import read_complete_lines # 与 video_split 共用 (容器里位于 /proxy/)
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED # <-- 新增导入
+from collections import deque
+from urllib.parse import quote
 import subprocess
 import os
 import signal
+import math
 
 app = Flask(__name__) #
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PERF_LOG_DIR = os.path.join(BASE_DIR, "storage/perf_logs")
 
+CONTAINER_STORAGE_DIR = "/storage" # 容器内共享卷的挂载点
+MAX_STREAMING_TRANSCODES = 32 # 流式视频工作流中同时进行的转码数上限
+
 function_managers = {} #
+manager_configs = {} # 每个 manager 的 create_manager 请求体，持久化到 MANAGER_STATE_PATH，重启时据此恢复
 manager_lock = threading.Lock() #
+MANAGER_STATE_PATH = os.environ.get("MANAGER_STATE_PATH", os.path.join(BASE_DIR, "storage/managers.json"))
+KEEP_CONTAINERS_ON_EXIT = os.environ.get("KEEP_CONTAINERS_ON_EXIT", "0") == "1" # 退出时保留容器，下次启动时接管
+
+def _count_idle_containers(function_name):
+    """返回某函数当前空闲的暖容器数；manager 不存在时为 0。"""
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    return manager.count_idle() if manager else 0
+
+def _pool_parallelism(function_name):
+    """函数的池最多能同时执行的请求数 (见 max_parallelism)；manager 不存在或未限制时为 None。"""
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    return manager.max_parallelism() if manager else None
+
+def _to_host_path(function_name, container_path):
+    """把容器内 /storage 下的路径换算成该函数 manager 挂载的宿主机路径；没有挂载时返回 None。"""
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    if manager is None or not manager.host_storage_path:
+        return None
+    rel_path = os.path.relpath(container_path, CONTAINER_STORAGE_DIR)
+    return os.path.join(manager.host_storage_path, rel_path)
+
+class NoWarmContainer(Exception):
+    """create_container=False 时没有可用的暖容器。"""
+
+# --- 条件分支的投机执行 ---
+SPECULATION_HISTORY = 50 # 每个 (工作流, 分支) 保留的最近结果数
+SPECULATION_THRESHOLD = 0.5 # 历史上分支被执行的比例达到该值时才投机
+MAX_SPECULATIVE_INFLIGHT = 4 # 同时进行的投机/对冲任务上限 (成本上限之一；另一个是只使用空闲暖容器)
+
+branch_history = {} # {(workflow, branch): deque([True/False, ...])}
+speculative_inflight = 0
+speculation_lock = threading.Lock()
+
+def _record_branch(workflow, branch, taken):
+    with speculation_lock:
+        branch_history.setdefault((workflow, branch), deque(maxlen=SPECULATION_HISTORY)).append(bool(taken))
+
+def _branch_probability(workflow, branch):
+    """历史上该分支被执行的比例；没有历史时返回 None。"""
+    with speculation_lock:
+        history = branch_history.get((workflow, branch))
+        return (sum(history) / len(history)) if history else None
+
+def _should_speculate(workflow, branch, hint="auto", threshold=SPECULATION_THRESHOLD):
+    # hint: True/False 显式指定；"auto" 按历史概率决定 (没有历史时不投机)
+    if hint is True or hint is False:
+        return hint
+    probability = _branch_probability(workflow, branch)
+    return probability is not None and probability >= threshold
+
+def _start_speculative(executor, function_name, payload, attempt=None):
+    """
+    在空闲暖容器上提前执行一个可能需要的分支；超出投机上限或没有暖容器时返回 None。
+    返回的 future 结果为 _dispatch_request 的 (result, container_id)，失败时为异常。
+    attempt 见 _new_attempt。
+    """
+    global speculative_inflight
+    with speculation_lock:
+        if speculative_inflight >= MAX_SPECULATIVE_INFLIGHT:
+            return None
+        speculative_inflight += 1
+    if _count_idle_containers(function_name) == 0:
+        with speculation_lock:
+            speculative_inflight -= 1
+        return None
+
+    def run():
+        global speculative_inflight
+        try:
+            return _dispatch_request(function_name, payload, create_container=False, attempt=attempt)
+        finally:
+            with speculation_lock:
+                speculative_inflight -= 1
+    return executor.submit(run)
+
+# --- 扇出阶段的对冲请求 (hedged requests) ---
+LATENCY_HISTORY = 100 # 每个函数保留的最近成功调用耗时数
+HEDGE_PERCENTILE = 95 # 任务耗时超过历史该百分位时发起重复请求
+HEDGE_MIN_SAMPLES = 5 # 历史样本少于该数时不对冲
+
+latency_history = {} # {function_name: deque([seconds, ...])}
+latency_lock = threading.Lock()
+
+def _record_latency(function_name, seconds):
+    with latency_lock:
+        latency_history.setdefault(function_name, deque(maxlen=LATENCY_HISTORY)).append(seconds)
+
+def _latency_percentile(function_name, percentile):
+    """最近成功调用耗时的百分位 (秒)；样本不足时返回 None。"""
+    with latency_lock:
+        samples = sorted(latency_history.get(function_name, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    index = min(len(samples) - 1, max(0, math.ceil(percentile / 100.0 * len(samples)) - 1))
+    return samples[index]
+
+def _new_attempt(attempt_id):
+    """
+    一次可被中止的调用的状态，由 _dispatch_request 填写: acquired 在取得 (或未能取得) 容器时置位，
+    container_id 是执行它的容器，done 在释放容器前 (持有 manager.lock) 置为 True。
+    """
+    return {"id": attempt_id, "acquired": threading.Event(), "container_id": None, "done": False}
+
+def _attempt_files(function_name, attempt_id):
+    # 某次尝试在 output/<fn>/ 下写出的专属文件 (<name>.<attempt_id><ext>)，包括被中止时写了一半的
+    output_dir = _to_host_path(function_name, f"{CONTAINER_STORAGE_DIR}/output/{function_name}")
+    if not output_dir or not os.path.isdir(output_dir):
+        return []
+    marker = f".{attempt_id}."
+    return [os.path.join(output_dir, name) for name in os.listdir(output_dir) if marker in name]
+
+def _abandon_attempt(function_name, future, attempt):
+    """放弃落后的尝试: 还在执行时删除它的容器 (proxy 无法取消 main)，结束后删除它的专属输出。"""
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    if attempt["container_id"] and isinstance(manager, FunctionManager):
+        if manager.abort(attempt["container_id"], still_running=lambda: not attempt["done"]):
+            print(f"[hedge] 已中止 {function_name} 的落后尝试 {attempt['id']} (容器 {attempt['container_id'][:12]})。")
+
+    def discard(_):
+        for path in _attempt_files(function_name, attempt["id"]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    future.add_done_callback(discard)
+
+def _hedged_dispatch(function_name, payload, percentile=HEDGE_PERCENTILE):
+    """
+    与 _dispatch_request 相同，但任务在容器上执行的时间超过历史百分位时，在另一个空闲暖容器上发起一次重复请求，
+    采用先成功完成的结果。每次尝试带自己的 attempt_id 和 defer_commit: action 把结果写到专属文件 (<name>.<attempt_id><ext>)，
+    只有胜出的一次由这里原子重命名为正式路径；落后的一次被中止 (删除其容器) 并删除专属文件，不会覆盖已经采用的结果。
+    """
+    threshold = _latency_percentile(function_name, percentile)
+    if threshold is None:
+        return _dispatch_request(function_name, payload)
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        primary = _new_attempt(f"a{os.urandom(4).hex()}")
+        attempts = {executor.submit(_dispatch_request, function_name,
+                                    dict(payload, attempt_id=primary["id"], defer_commit=True), attempt=primary): primary}
+        (first,) = attempts
+        # 历史耗时从取得容器后开始计 (见 _dispatch_request)，这里同样等主请求拿到容器 (可能冷启动) 后再计时
+        while not primary["acquired"].wait(0.05) and not first.done():
+            pass
+        done, _ = wait(attempts, timeout=threshold)
+        if not done:
+            backup = _new_attempt(f"h{os.urandom(4).hex()}")
+            future = _start_speculative(executor, function_name,
+                                        dict(payload, attempt_id=backup["id"], defer_commit=True), attempt=backup)
+            if future is not None:
+                print(f"[hedge] {function_name} 超过 p{percentile}={threshold:.2f}s，已在另一个暖容器上发起重复请求。")
+                attempts[future] = backup
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = attempts[future]
+                    for other, attempt in attempts.items():
+                        if other is not future:
+                            _abandon_attempt(function_name, other, attempt)
+                    result, container_id = future.result()
+                    return _commit_attempt_result(function_name, result, winner["id"]), container_id
+                error = future.exception()
+                _abandon_attempt(function_name, future, attempts[future]) # 失败的尝试可能留下写了一半的文件
+        raise error
+    finally:
+        executor.shutdown(wait=False)
+
+def _fanout_dispatcher(payload):
+    """扇出阶段使用的调度函数: payload 中 hedge=true 时启用对冲 (hedge_percentile 默认 HEDGE_PERCENTILE)。"""
+    if not payload.get("hedge", False):
+        return _dispatch_request
+    percentile = float(payload.get("hedge_percentile", HEDGE_PERCENTILE))
+    return lambda function_name, task_payload: _hedged_dispatch(function_name, task_payload, percentile)
+
+# --- 函数融合: 在一次容器调用里依次执行多个阶段，结果在 proxy 进程内存中传递 ---
+FUSION_MIN_SAMPLES = 5 # 自动决策需要的最少样本数 (每个阶段的执行时间和调度开销)
+
+stage_history = {} # {function_name: deque([容器内执行秒数, ...])}
+hop_overhead = deque(maxlen=LATENCY_HISTORY) # 每次调度的开销: 取得容器后 init + run 往返 (含 perf) 减去容器内执行时间
+
+def _record_stage(function_name, duration):
+    with latency_lock:
+        stage_history.setdefault(function_name, deque(maxlen=LATENCY_HISTORY)).append(duration)
+
+def _median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] if samples else None
+
+def _should_fuse(stages, hint="auto"):
+    """
+    hint 为 true / false 时按声明决定；"auto" 时，只要某个阶段的执行时间中位数小于一次调度开销的中位数
+    (这一跳比阶段本身还贵) 就融合。样本不足时不融合，由普通调度积累样本。
+    """
+    with manager_lock:
+        if any(isinstance(function_managers.get(stage), InlineManager) for stage in stages):
+            return False # 内联函数本身没有调度开销，也不能作为融合的宿主容器
+    if hint != "auto":
+        return bool(hint)
+    with latency_lock:
+        overheads = list(hop_overhead)
+        durations = [list(stage_history.get(stage, ())) for stage in stages]
+    if len(overheads) < FUSION_MIN_SAMPLES or any(len(d) < FUSION_MIN_SAMPLES for d in durations):
+        return False
+    overhead = _median(overheads)
+    return any(_median(d) < overhead for d in durations)
+
+def _dispatch_fused(stages, payload, run_perf=True):
+    """
+    在 stages[0] 的 manager 的一个容器里依次执行所有阶段 (镜像里包含全部 action)，
+    每个阶段的输入是 {**payload, **上一阶段结果}。返回 ([各阶段结果], container_id)。
+    """
+    result, container_id = _dispatch_request(stages[0], payload, run_perf=run_perf, stages=list(stages))
+    return result["stages"], container_id
+
+def _dispatch_chain(stages, payload, hint="auto"):
+    """按 _should_fuse 的决定融合执行，或逐个调度 (同样把上一阶段结果合并进下一阶段输入)。返回 ([各阶段结果], 是否融合)。"""
+    if len(stages) > 1 and _should_fuse(stages, hint):
+        return _dispatch_fused(stages, payload)[0], True
+    results, data = [], dict(payload)
+    for stage in stages:
+        result, _ = _dispatch_request(stage, data)
+        results.append(result)
+        if isinstance(result, dict):
+            data = {**data, **result}
+    return results, False
+
+def _dispatch_inline(manager, function_name, payload):
+    """内联函数: 直接在工作进程池中执行，记录与容器调用相同的耗时指标；没有 perf (不是独立进程树)。"""
+    start = time.time()
+    result, duration = manager.run(payload)
+    _record_latency(function_name, time.time() - start)
+    _record_stage(function_name, duration)
+    return result, "inline"
+
+def _commit_attempt_output(function_name, attempt_path):
+    """把某次尝试专属的输出 (<name>.<attempt_id><ext>) 原子重命名为正式路径；无法换算宿主机路径时原样返回。"""
+    stem, ext = os.path.splitext(attempt_path)
+    final_path = os.path.splitext(stem)[0] + ext
+    host_attempt, host_final = _to_host_path(function_name, attempt_path), _to_host_path(function_name, final_path)
+    if not host_attempt or not os.path.exists(host_attempt):
+        return attempt_path
+    os.replace(host_attempt, host_final)
+    return final_path
+
+def _commit_attempt_result(function_name, result, attempt_id):
+    """把胜出尝试结果中的专属文件路径 (文件名含 .<attempt_id>.) 逐个提交为正式路径。"""
+    if not isinstance(result, dict):
+        return result
+    marker = f".{attempt_id}."
+    return {key: _commit_attempt_output(function_name, value)
+            if isinstance(value, str) and marker in os.path.basename(value) else value
+            for key, value in result.items()}
+
+def _discard_attempt_output(function_name, future, key):
+    # 被放弃的尝试: 删除它写出的文件 (失败的尝试没有输出)
+    try:
+        result, _ = future.result()
+        host_path = _to_host_path(function_name, result[key])
+        if host_path and os.path.exists(host_path):
+            os.remove(host_path)
+            print(f"[speculation] 已丢弃 {function_name} 的输出 {result[key]}")
+    except Exception as e:
+        print(f"[speculation] 丢弃 {function_name} 的结果: {e}")
 
 # --- create_manager 接口 (保持不变) ---
+def _build_manager(function_name, body, adopt=False):
+    """按 create_manager 的请求体创建 manager；adopt=True 时接管上次留下的带标签容器。参数无效时抛出 ValueError。"""
+    image_name = body.get("image_name", "myimage:latest") #
+    container_port = int(body.get("container_port", 5000)) #
+
+    # --- 确保这部分代码存在 (来自我们上次的修改) ---
+    host_storage_path = body.get("host_storage_path", None)
+    # --- 结束 ---
+
+    host_port_start = int(body.get("host_port_start", 8000)) #
+    idle_timeout = int(body.get("idle_timeout", 300)) #
+    min_idle = int(body.get("min_idle_containers", 0)) #
+    max_containers = body.get("max_containers", None) #
+    if max_containers is not None:
+        max_containers = int(max_containers)
+    max_concurrency = int(body.get("max_concurrency", 1)) # 每个容器的并发请求数 (>1 用于动态批处理)
+    environment = body.get("environment", None) # 传给容器的环境变量, 例如 {"BATCHING": "1"}
+    host_model_path = body.get("host_model_path", None) # 共享的扁平模型目录 (见 model_store.py)
+    placement = body.get("placement", None) # CPU 放置策略 (见 cpu_topology.py), 例如 {"policy": "exclusive_core", "cpus": 1}
+    backend = body.get("backend", os.environ.get("CONTAINER_BACKEND", "docker")) # 容器后端 (见 container_backend.py): docker / local
+    transport = body.get("transport", os.environ.get("PROXY_TRANSPORT", "port")) # 访问 proxy 的方式 (见 proxy_client.py): port / bridge / uds
+
+    if body.get("inline", False):
+        # 受信任的简单函数: 在 controller 的工作进程池里执行 (见 inline_runner.py)，不创建容器
+        return InlineManager(
+            function_name=function_name,
+            host_storage_path=host_storage_path,
+            workers=int(body.get("inline_workers", 2)),
+            timeout=float(body.get("inline_timeout", 30)),
+            memory_mb=int(body.get("inline_memory_mb", INLINE_MEMORY_MB)), # 0 = 不限制地址空间
+        )
+
+    return FunctionManager( #
+        function_name=function_name,
+        image_name=image_name,
+        container_port=container_port,
+        host_storage_path=host_storage_path, # <-- 确保传入
+        host_port_start=host_port_start,
+        idle_timeout=idle_timeout,
+        min_idle_containers=min_idle,
+        max_concurrency=max_concurrency,
+        environment=environment,
+        host_model_path=host_model_path,
+        placement=placement,
+        backend=backend,
+        transport=transport,
+        adopt=adopt,
+        max_containers=max_containers,
+        acquire_timeout=float(body.get("acquire_timeout", ACQUIRE_TIMEOUT)) # 达到 max_containers 时等待容器的秒数
+    )
+
+def _save_manager_configs():
+    # 调用方持有 manager_lock。先写临时文件再替换，controller 中途退出也不会留下半个文件
+    os.makedirs(os.path.dirname(MANAGER_STATE_PATH), exist_ok=True)
+    tmp_path = MANAGER_STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"managers": manager_configs}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANAGER_STATE_PATH)
+
+def restore_managers():
+    """
+    启动时按 MANAGER_STATE_PATH 重新创建上次登记的 manager，并接管仍在运行的带标签容器 (见 FunctionManager.adopt_containers)。
+    """
+    try:
+        with open(MANAGER_STATE_PATH) as f:
+            configs = json.load(f).get("managers", {})
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Warning: cannot read {MANAGER_STATE_PATH}: {e}")
+        return 0
+    restored = 0
+    with manager_lock:
+        for function_name, body in configs.items():
+            if function_name in function_managers:
+                continue
+            try:
+                manager = _build_manager(function_name, body, adopt=True)
+            except Exception as e:
+                print(f"Failed to restore manager {function_name}: {e}")
+                continue
+            function_managers[function_name] = manager
+            manager_configs[function_name] = body
+            restored += 1
+    return restored
+
+def _register_manager(body):
+    """登记一个 manager (FunctionManager 构造后 cleaner 线程立即开始预热)；返回 (响应体, 状态码)。"""
+    function_name = body.get("function_name") #
+    if not function_name:
+        return {"error": "function_name required"}, 400
+
+    with manager_lock:
+        if function_name in function_managers:
+            return {"status": "exists", "message": f"Manager {function_name} already exists."}, 200
+        try:
+            manager = _build_manager(function_name, body)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        function_managers[function_name] = manager #
+        manager_configs[function_name] = body
+        try:
+            _save_manager_configs()
+        except OSError as e:
+            print(f"Warning: cannot persist manager configs: {e}")
+        if isinstance(manager, InlineManager):
+            return {"status": "created", "function": function_name, "inline": True}, 201
+        return {"status": "created", "function": function_name}, 201 #
+
 @app.route('/create_manager', methods=['POST']) #
 def create_manager():
     # ... 您的 create_manager 函数代码保持不变 ...
     # (确保它能接收 host_storage_path)
     body = request.get_json(silent=True) or {} #
-    function_name = body.get("function_name") #
-    if not function_name:
-        return jsonify({"error": "function_name required"}), 400
+    result, status = _register_manager(body)
+    return jsonify(result), status
+
+@app.route('/create_managers', methods=['POST'])
+def create_managers():
+    """
+    一次登记一个工作流的所有函数: {"managers": [<create_manager 请求体>, ...]}。
+    每个 manager 登记后立即开始预热，各函数的预热互相并行；用 /ready 等待预热完成。
+    任一登记失败时返回 400 (其余的仍然登记)。
+    """
+    body = request.get_json(silent=True) or {}
+    bodies = body.get("managers")
+    if not isinstance(bodies, list):
+        return jsonify({"error": "managers (list) required"}), 400
+    results = {}
+    failed = False
+    for item in bodies:
+        result, status = _register_manager(item or {})
+        results[(item or {}).get("function_name") or f"#{len(results)}"] = result
+        failed = failed or status >= 400
+    return jsonify({"managers": results}), 400 if failed else 201
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    阻塞直到 functions (逗号分隔，缺省为全部) 的空闲容器都达到 min_idle_containers，或者 timeout 秒后返回。
+    全部就绪返回 200，超时返回 503；响应中给出每个函数的 idle / min_idle。
+    """
+    timeout = float(request.args.get("timeout", 60))
     with manager_lock:
-        if function_name in function_managers:
-            return jsonify({"status": "exists", "message": f"Manager {function_name} already exists."}), 200
+        names = request.args.get("functions")
+        names = [name for name in names.split(",") if name] if names else list(function_managers)
+        unknown = [name for name in names if name not in function_managers]
+        if unknown:
+            return jsonify({"error": f"unknown functions: {', '.join(unknown)}"}), 404
+        managers = {name: function_managers[name] for name in names}
 
-        image_name = body.get("image_name", "myimage:latest") #
-        container_port = int(body.get("container_port", 5000)) #
-        
-        # --- 确保这部分代码存在 (来自我们上次的修改) ---
-        host_storage_path = body.get("host_storage_path", None)
-        # --- 结束 ---
-        
-        host_port_start = int(body.get("host_port_start", 8000)) #
-        idle_timeout = int(body.get("idle_timeout", 300)) #
-        min_idle = int(body.get("min_idle_containers", 0)) #
-        max_containers = body.get("max_containers", None) #
-        if max_containers is not None:
-            max_containers = int(max_containers)
-
-        manager = FunctionManager( #
-            function_name=function_name,
-            image_name=image_name,
-            container_port=container_port,
-            host_storage_path=host_storage_path, # <-- 确保传入
-            host_port_start=host_port_start,
-            idle_timeout=idle_timeout,
-            min_idle_containers=min_idle
-        )
-        function_managers[function_name] = manager #
-        return jsonify({"status": "created", "function": function_name}), 201 #
+    # 各函数并行预热，依次等待即可: 总等待时间是最慢的那个，而不是它们之和
+    deadline = time.time() + timeout
+    status = {}
+    for name, manager in managers.items():
+        warm = manager.wait_until_warm(timeout=max(0.0, deadline - time.time()))
+        status[name] = {"ready": warm, "idle": manager.count_idle(),
+                        "min_idle": getattr(manager, "min_idle_containers", 0)}
+    all_ready = all(item["ready"] for item in status.values())
+    return jsonify({"ready": all_ready, "functions": status}), 200 if all_ready else 503
+
+def _init_container(endpoint, function_name, stages=None, timeout=10):
+    """
+    调用容器的 /init。deploy 过的 action 带上当前代码版本 (见 code_store.py)；
+    容器里还没有该版本时 proxy 返回 409，这里再附上 base64 代码包重发一次。
+    """
+    store = code_store.get_store()
+    names = stages or [function_name]
+    init_data = {"action": '+'.join(stages), "stages": stages} if stages else {"action": function_name}
+    versions = {name: store.version(name) for name in names if store.version(name)}
+    if versions:
+        init_data["versions"] = versions
+    r = proxy_client.post(endpoint, "/init", init_data, timeout=timeout)
+    if r.status_code == 409:
+        missing = r.json().get("missing", [])
+        init_data["bundles"] = {name: store.bundle(name, versions[name]) for name in missing}
+        r = proxy_client.post(endpoint, "/init", init_data, timeout=max(timeout, 60))
+    r.raise_for_status()
+    return r
 
 # --- 替换旧的 _dispatch_request 函数 ---
-def _dispatch_request(function_name, payload, run_perf=True):
+def _dispatch_request(function_name, payload, run_perf=True, create_container=True, stages=None, attempt=None):
     """
     内部共享逻辑：为函数获取、初始化、运行(带perf)并释放一个容器。
+    create_container=False 时只使用已有的暖容器，没有时抛出 NoWarmContainer。
+    stages 不为空时是融合调用 (见 _dispatch_fused)：在 function_name 的容器里依次执行这些 action。
+    attempt (见 _new_attempt) 不为空时记录执行它的容器，供对冲时中止落后的一次。
     返回: (result_payload, container_id)
     会抛出异常如果失败。
     """
@@ -72,24 +500,37 @@ def _dispatch_request(function_name, payload, run_perf=True):
             raise Exception(f"未知的函数: {function_name}")
         manager = function_managers[function_name]
 
+    if isinstance(manager, InlineManager):
+        if attempt is not None:
+            attempt["acquired"].set()
+        return _dispatch_inline(manager, function_name, payload)
+
     print(f"[_dispatch_request] 正在为 '{function_name}' 获取容器...")
-    host_port, container_id = manager.get_container_for_request()
-    if not host_port:
+    endpoint, container_id = manager.get_container_for_request(create=create_container)
+    if attempt is not None:
+        attempt["container_id"] = container_id
+        attempt["acquired"].set()
+    if not endpoint and not create_container:
+        raise NoWarmContainer(f"没有空闲的暖容器 {function_name}")
+    if not endpoint:
         print(f"[_dispatch_request] 错误: 无法获取容器 {function_name}")
         raise Exception(f"无法获取容器 {function_name}")
 
     perf_process = None
     output_file = ""
     pid = None
+    label = '+'.join(stages) if stages else function_name # 融合调用的 perf 日志和耗时记在 "a+b" 名下
+    hop_start = time.time()
 
     try:
         # --- 1. 运行 INIT (现在是第一步，没有 perf) ---
         try:
-            init_data = {"action": function_name}
-            manager_url = f"http://127.0.0.1:{host_port}"
-            print(f"[_dispatch_request] 正在为 {container_id[:12]} 调用 {manager_url}/init")
-            requests.post(f"{manager_url}/init", json=init_data, timeout=10)
+            print(f"[_dispatch_request] 正在为 {container_id[:12]} 调用 {endpoint}/init")
+            _init_container(endpoint, function_name, stages=stages, timeout=10)
         except Exception as e:
+            if stages:
+                # 融合调用没有可以退回的上下文: /run 会因为 action 没有 init 过而失败，这里直接报错
+                raise
             # init 失败仍然是非致命的
             print(f"[_dispatch_request] init 错误 (非致命): {e}")
 
@@ -99,23 +540,16 @@ def _dispatch_request(function_name, payload, run_perf=True):
             try:
                 # 2a. 获取 PID
                 with manager.lock:
-                    container_obj = manager.containers[container_id]["container_obj"]
-                    container_obj.reload()
-                    pid = container_obj.attrs['State']['Pid']
+                    pid = manager.backend.pid(manager.containers[container_id]["container_obj"])
                 
                 if pid:
                     os.makedirs(PERF_LOG_DIR, exist_ok=True)
-                    output_file = os.path.join(PERF_LOG_DIR, f"{function_name}_{container_id[:12]}.txt")
+                    # 每次调用一个日志 (同一容器的多次调用不互相覆盖)，interference.load_dir 重启时全部回放
+                    invocation = f"{time.strftime('%Y%m%d%H%M%S')}_{os.urandom(3).hex()}"
+                    output_file = os.path.join(PERF_LOG_DIR, f"{label}_{container_id[:12]}_{invocation}.txt")
                     
-                    # 使用您验证过的事件列表
-                    events = (
-                        'cycles,instructions,cache-misses,cycle_activity.stalls_total,'
-                        'idq_uops_not_delivered.core,cpu-clock,mem_load_retired.l3_hit,'
-                        'mem_load_retired.l3_miss,cycle_activity.stalls_l3_miss,'
-                        'memory_activity.stalls_l2_miss,mem_load_retired.l1_miss,'
-                        'mem_load_retired.l2_miss,mem_inst_retired.stlb_miss_loads,'
-                        'mem_load_l3_miss_retired.local_dram,mem_load_l3_hit_retired.xsnp_fwd'
-                    )
+                    # 使用您验证过的事件列表 (与 compete_*.sh、colocation_experiment.py 相同)
+                    events = interference.PERF_EVENTS
                     
                     perf_cmd = [
                         'sudo', 'perf', 'stat',
@@ -139,15 +573,27 @@ def _dispatch_request(function_name, payload, run_perf=True):
                     perf_log_file.close()
 
         # --- 3. 运行 RUN (现在 perf 正在运行) ---
-        print(f"[_dispatch_request] 正在转发 run 到 http://127.0.0.1:{host_port}/run")
-        r = requests.post(f"http://127.0.0.1:{host_port}/run", json=payload, timeout=300)
+        print(f"[_dispatch_request] 正在转发 run 到 {endpoint}/run")
+        # 指明 action: 同一容器并发处理请求时，/init 和 /run 之间可能插入别的 action (或融合) 的 /init
+        r = proxy_client.post(endpoint, f"/run?action={quote(label, safe='')}", payload, timeout=300)
         r.raise_for_status()
         
         try:
             data = r.json()
         except Exception:
             data = {"raw": r.text}
-        
+
+        # 对冲阈值用的耗时从取得容器后开始计 (init + run)，不含取容器/冷启动，否则阈值被冷启动抬高
+        _record_latency(label, time.time() - hop_start)
+        if "duration" in data:
+            with latency_lock:
+                hop_overhead.append(max(0.0, time.time() - hop_start - data["duration"]))
+            result = data.get("result")
+            if stages:
+                for stage, duration in zip(stages, (result or {}).get("durations", [])):
+                    _record_stage(stage, duration)
+            else:
+                _record_stage(function_name, data["duration"])
         return data.get("result"), container_id
     
     except Exception as e:
@@ -157,7 +603,7 @@ def _dispatch_request(function_name, payload, run_perf=True):
             print(f"--- 正在抓取容器 {container_id[:12]} 的日志 ---")
             with manager.lock:
                 if container_id in manager.containers:
-                    logs = manager.containers[container_id]["container_obj"].logs(tail=50).decode('utf-8', errors='ignore')
+                    logs = manager.backend.logs(manager.containers[container_id]["container_obj"], tail=50)
                     print(logs)
             print(f"--- 容器日志结束 ---")
         except Exception as log_e:
@@ -183,8 +629,15 @@ def _dispatch_request(function_name, payload, run_perf=True):
             
             if 'perf_log_file' in locals() and perf_log_file:
                 perf_log_file.close()
+            # 计数器画像交给干扰感知调度 (用于函数分类和后续的 CPU/容器选择)
+            interference.get_scheduler().record(label, interference.parse_perf_log(output_file))
+            # 每次调用都写一个新日志，只保留每个函数最近的 PERF_LOG_KEEP 个，目录和启动回放都不会无限增长
+            interference.prune_logs(PERF_LOG_DIR, label)
         
         # --- 5. 释放容器 (不变) ---
+        if attempt is not None:
+            with manager.lock:
+                attempt["done"] = True # 之后容器可能分给别的请求，不能再被 abort
         print(f"[_dispatch_request] 正在释放容器 {container_id[:12]}")
         manager.release_container(container_id)
         
@@ -215,6 +668,31 @@ def dispatch(function_name):
         return jsonify(data), status_code
 
 
+@app.route('/dispatch_fused', methods=['POST'])
+def dispatch_fused():
+    """
+    依次执行多个阶段: {"stages": ["a", "b"], "payload": {...}, "fuse": true / false / "auto"}。
+    融合时在一个容器里执行并在内存中传递结果，否则逐个调度；返回每个阶段的结果。
+    """
+    body = request.get_json(silent=True) or {}
+    stages = body.get("stages") or []
+    if not stages:
+        return jsonify({"error": "stages required"}), 400
+    try:
+        results, fused = _dispatch_chain(stages, body.get("payload", {}), body.get("fuse", "auto"))
+        return jsonify({"status": "success", "fused": fused, "results": results}), 200
+    except Exception as e:
+        print(f"[dispatch_fused] 调度时出错: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 502
+
+@app.route('/fusion', methods=['GET'])
+def fusion_status():
+    # 自动融合决策依据: 每个阶段的执行时间中位数和调度开销中位数
+    with latency_lock:
+        stages = {name: {"median_duration": _median(samples), "samples": len(samples)} for name, samples in stage_history.items()}
+        overhead = _median(hop_overhead)
+    return jsonify({"hop_overhead": overhead, "stages": stages})
+
 # --- 新增：硬编码的 Video 工作流逻辑 ---
 def _run_video_workflow(payload):
     """
@@ -233,28 +711,54 @@ def _run_video_workflow(payload):
             print("[video_workflow] 错误: payload 中缺少 video_name。")
             return
 
-        # --- 2. 调度 Split ---
-        print("[video_workflow] 正在调度 SPLIT...")
-        split_payload = {"video_name": video_name, "segment_time": segment_time}
-        split_result, _ = _dispatch_request("video_split", split_payload)
-        split_keys = split_result['split_keys']
-        print(f"[video_workflow] SPLIT 完成。创建了 {len(split_keys)} 个分片。")
-
-        # --- 3. 调度 Transcode (并行) ---
-        print("[video_workflow] 正在调度 TRANSCODE (并行)...")
+        # hedge: 慢分片超过历史百分位时在另一个暖容器上发起重复请求
+        dispatch_task = _fanout_dispatcher(payload)
 
         def _transcode_task(split_file):
             # 这是在线程池中运行的函数
             print(f"[video_workflow]  > 开始转码: {split_file}")
             task_payload = {'split_file': split_file, 'target_type': target_type}
-            result, _ = _dispatch_request("video_transcode", task_payload)
+            result, _ = dispatch_task("video_transcode", task_payload)
             print(f"[video_workflow]  > 完成转码: {split_file}")
             return result['transcoded_file']
 
-        transcoded_files = []
-        with ThreadPoolExecutor(max_workers=len(split_keys)) as executor: #
-            transcoded_files = list(executor.map(_transcode_task, split_keys)) #
-        
+        split_payload = {"video_name": video_name, "segment_time": segment_time}
+        if payload.get("adaptive", False):
+            # 自适应分片: 由 split 结合时长/关键帧/暖容器数/目标分片时长决定分片数
+            split_payload.update({
+                "adaptive": True,
+                "target_segment_time": payload.get("target_segment_time", segment_time),
+                "warm_workers": _count_idle_containers("video_transcode")
+            })
+            # 分片数上限: 请求指定的值，否则是 transcode 池能同时执行的请求数 (未限制容器数时由 split 使用默认上限)
+            max_split_num = payload.get("max_split_num", _pool_parallelism("video_transcode"))
+            if max_split_num is not None:
+                split_payload["max_split_num"] = int(max_split_num)
+            for key in ("cold_start_break_even", "cold_budget"):
+                if key in payload:
+                    split_payload[key] = payload[key]
+
+        segs_path = None
+        if payload.get("streaming", False):
+            # --- 2+3. 流式: 边切分边转码，边转码边写 concat 列表 ---
+            transcoded_files, segs_path = _run_video_streaming(
+                video_name, split_payload, target_type, _transcode_task,
+                poll_interval=float(payload.get("poll_interval", 0.2))
+            )
+        else:
+            # --- 2. 调度 Split ---
+            print("[video_workflow] 正在调度 SPLIT...")
+            split_result, _ = _dispatch_request("video_split", split_payload)
+            split_keys = split_result['split_keys']
+            print(f"[video_workflow] SPLIT 完成。创建了 {len(split_keys)} 个分片。")
+
+            # --- 3. 调度 Transcode (并行) ---
+            print("[video_workflow] 正在调度 TRANSCODE (并行)...")
+
+            transcoded_files = []
+            with ThreadPoolExecutor(max_workers=len(split_keys)) as executor: #
+                transcoded_files = list(executor.map(_transcode_task, split_keys)) #
+
         print("[video_workflow] TRANSCODE 完成。")
 
         # --- 4. 调度 Merge ---
@@ -263,7 +767,8 @@ def _run_video_workflow(payload):
             'transcoded_files': transcoded_files,
             'target_type': target_type,
             'output_prefix': output_prefix,
-            'video_name': video_name
+            'video_name': video_name,
+            'segs_path': segs_path
         }
         merge_result, _ = _dispatch_request("video_merge", merge_payload)
         final_video = merge_result['final_video']
@@ -276,6 +781,62 @@ def _run_video_workflow(payload):
         print(f"\n[video_workflow] --- 失败! ---")
         print(f"[video_workflow] 工作流执行出错: {e}\n")
 
+def _run_video_streaming(video_name, split_payload, target_type, transcode_task, poll_interval=0.2):
+    """
+    流式视频流水线: split 在后台运行，控制器轮询 ffmpeg 的分片列表 (共享卷上)，
+    每出现一个已关闭的分片就立即派发 transcode；转码结果按分片顺序增量写入 merge 的 concat 列表。
+    返回: (transcoded_files, segs_path 容器内路径)
+    """
+    shortname = os.path.splitext(video_name)[0]
+    segment_list = f"{CONTAINER_STORAGE_DIR}/output/video_split/segments_{shortname}.txt"
+    segs_path = f"{CONTAINER_STORAGE_DIR}/output/video_merge/segs_{shortname}_{target_type}.txt"
+    host_segment_list = _to_host_path("video_split", segment_list)
+    host_segs_path = _to_host_path("video_merge", segs_path)
+    if host_segment_list is None or host_segs_path is None:
+        raise Exception("流式模式需要 video_split/video_merge 的 manager 挂载 host_storage_path")
+
+    # 删除上一次运行的列表，避免把旧分片当成新分片
+    if os.path.exists(host_segment_list):
+        os.remove(host_segment_list)
+
+    print("[video_workflow] 正在调度 SPLIT (流式)...")
+    split_payload = dict(split_payload, segment_list=segment_list)
+    split_executor = ThreadPoolExecutor(max_workers=1)
+    transcode_executor = ThreadPoolExecutor(max_workers=MAX_STREAMING_TRANSCODES)
+    try:
+        split_future = split_executor.submit(_dispatch_request, "video_split", split_payload)
+
+        transcode_futures = []
+        while True:
+            split_done = split_future.done()
+            entries = read_complete_lines(host_segment_list)
+            for split_file in entries[len(transcode_futures):]:
+                print(f"[video_workflow] 分片已关闭，立即转码: {split_file}")
+                transcode_futures.append(transcode_executor.submit(transcode_task, split_file))
+            if split_done:
+                break
+            time.sleep(poll_interval)
+
+        # split 失败时这里会抛出异常；列表里漏掉的分片 (例如轮询间隙) 以返回值为准补齐
+        split_result, _ = split_future.result()
+        for split_file in split_result['split_keys'][len(transcode_futures):]:
+            transcode_futures.append(transcode_executor.submit(transcode_task, split_file))
+        print(f"[video_workflow] SPLIT 完成。创建了 {len(transcode_futures)} 个分片。")
+
+        # 按分片顺序等待，完成一个就追加一行 concat 列表
+        os.makedirs(os.path.dirname(host_segs_path), exist_ok=True)
+        transcoded_files = []
+        with open(host_segs_path, 'w') as f:
+            for future in transcode_futures:
+                transcoded_file = future.result()
+                transcoded_files.append(transcoded_file)
+                f.write(f"file '{transcoded_file}'\n")
+                f.flush()
+        return transcoded_files, segs_path
+    finally:
+        split_executor.shutdown(wait=False)
+        transcode_executor.shutdown(wait=False)
+
 # --- 新增：硬编码的 Recognizer 工作流逻辑 ---
 def _run_recognizer_workflow(payload):
     """
@@ -292,79 +853,127 @@ def _run_recognizer_workflow(payload):
 
         # --- 2. 触发 "upload" (它只返回路径) ---
         print("[recognizer_workflow] 正在调度 UPLOAD (获取路径)...")
-        upload_payload = {"image_filename": image_filename}
+        # decode_cache: upload 解码一次并缓存派生数组，下游 action 通过 image_cache 直接 mmap 读取
+        upload_payload = {"image_filename": image_filename, "decode_cache": payload.get("decode_cache", False)}
         upload_result, _ = _dispatch_request("recognizer_upload", upload_payload)
         image_path = upload_result['image_path']
+        image_input = {"image_path": image_path}
+        if upload_result.get("image_cache"):
+            image_input["image_cache"] = upload_result["image_cache"]
+
+        # mosaic 的输入不依赖分析结果，可以在分析阶段投机执行 (speculate: true / false / "auto")
+        mosaic_payload = dict(payload.get("mosaic_options", {}), **image_input)
+        speculation = {"probability": _branch_probability("recognizer", "mosaic"), "launched": False, "used": False}
+        speculative_executor = ThreadPoolExecutor(max_workers=1)
+        speculative_future = None
+        if _should_speculate("recognizer", "mosaic", payload.get("speculate", "auto"),
+                             float(payload.get("speculation_threshold", SPECULATION_THRESHOLD))):
+            speculative_payload = dict(mosaic_payload, attempt_id=f"spec{os.urandom(4).hex()}")
+            speculative_future = _start_speculative(speculative_executor, "recognizer_mosaic", speculative_payload)
+            speculation["launched"] = speculative_future is not None
+            print(f"[recognizer_workflow] 投机执行 MOSAIC: {'已启动' if speculative_future else '没有空闲暖容器或超出上限，跳过'}")
         print(f"[recognizer_workflow] UPLOAD 完成。图像位于 {image_path}")
+        # 启动投机任务之后的任何失败 (分析、文本、mosaic) 都要经过 finally: 没有采用的投机输出在任务完成后删除，执行器关闭
+        try:
 
-        # --- 3. 并行分析 (图像 + 提取) ---
-        print("[recognizer_workflow] 正在调度并行分析 (Adult, Violence, Extract)...")
+            # --- 3. 并行分析 (图像 + 提取) ---
+            print("[recognizer_workflow] 正在调度并行分析 (Adult, Violence, Extract)...")
         
-        # 我们需要使用线程池来并行执行 _dispatch_request
-        # 我们将同时运行 adult, violence, 和 extract
+            # 我们需要使用线程池来并行执行 _dispatch_request
+            # 我们将同时运行 adult, violence, 和 extract
         
-        analysis_results = {}
-        text_from_extract = ""
+            analysis_results = {}
+            text_from_extract = ""
+
+            # combined_classify: 由 recognizer_classify 在一个暖进程里同时跑 adult 和 violence (容器内动态批处理)
+            combined_classify = payload.get("combined_classify", False)
 
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            # 提交任务
-            future_adult = executor.submit(_dispatch_request, "recognizer_adult", {"image_path": image_path})
-            future_violence = executor.submit(_dispatch_request, "recognizer_violence", {"image_path": image_path})
-            future_extract = executor.submit(_dispatch_request, "recognizer_extract", {"image_path": image_path})
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                # 提交任务
+                if combined_classify:
+                    future_classify = executor.submit(_dispatch_request, "recognizer_classify", dict(image_input))
+                else:
+                    future_adult = executor.submit(_dispatch_request, "recognizer_adult", dict(image_input))
+                    future_violence = executor.submit(_dispatch_request, "recognizer_violence", dict(image_input))
+                future_extract = executor.submit(_dispatch_request, "recognizer_extract", dict(image_input))
 
-            # 获取结果
-            # .result() 会阻塞，直到该任务完成
+                # 获取结果
+                # .result() 会阻塞，直到该任务完成
             
-            # (注意: _dispatch_request 返回 (result_payload, container_id))
-            analysis_results["adult"] = future_adult.result()[0]
-            analysis_results["violence"] = future_violence.result()[0]
+                # (注意: _dispatch_request 返回 (result_payload, container_id))
+                if combined_classify:
+                    classify_result = future_classify.result()[0]
+                    analysis_results["adult"] = classify_result["adult"]
+                    analysis_results["violence"] = classify_result["violence"]
+                else:
+                    analysis_results["adult"] = future_adult.result()[0]
+                    analysis_results["violence"] = future_violence.result()[0]
             
-            extract_result = future_extract.result()[0]
-            analysis_results["extract"] = extract_result
-            text_from_extract = extract_result.get("text", "")
-
-        print(f"[recognizer_workflow] 图像分析完成。")
-        print(f"[recognizer_workflow] > Adult: {analysis_results['adult']}")
-        print(f"[recognizer_workflow] > Violence: {analysis_results['violence']}")
-
-        # --- 4. 并行文本分析 (Censor + Translate) ---
-        print("[recognizer_workflow] 正在调度并行文本分析 (Censor, Translate)...")
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_censor = executor.submit(_dispatch_request, "recognizer_censor", {"text": text_from_extract})
-            future_translate = executor.submit(_dispatch_request, "recognizer_translate", {"text": text_from_extract})
-
-            analysis_results["censor"] = future_censor.result()[0]
-            analysis_results["translate"] = future_translate.result()[0]
-
-        print(f"[recognizer_workflow] 文本分析完成。")
-        print(f"[recognizer_workflow] > Censor: {analysis_results['censor']}")
-        print(f"[recognizer_workflow] > Translate: {analysis_results['translate']['translated_text']}")
-
-        # --- 5. 决策 (在 Controller 中) ---
-        is_illegal_adult = analysis_results["adult"].get("illegal", False)
-        is_illegal_violence = analysis_results["violence"].get("illegal", False)
-        is_illegal_censor = analysis_results["censor"].get("illegal", False)
+                extract_result = future_extract.result()[0]
+                analysis_results["extract"] = extract_result
+                text_from_extract = extract_result.get("text", "")
+
+            print(f"[recognizer_workflow] 图像分析完成。")
+            print(f"[recognizer_workflow] > Adult: {analysis_results['adult']}")
+            print(f"[recognizer_workflow] > Violence: {analysis_results['violence']}")
+
+            # --- 4. 文本分析 (Censor + Translate) ---
+            # censor 和 translate 都只依赖 extract 的文本，互不依赖: 并行调度，不融合 (融合只用于生产者 -> 消费者的线性链)
+            print("[recognizer_workflow] 正在调度并行文本分析 (Censor, Translate)...")
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                future_censor = executor.submit(_dispatch_request, "recognizer_censor", {"text": text_from_extract})
+                future_translate = executor.submit(_dispatch_request, "recognizer_translate", {"text": text_from_extract})
+
+                analysis_results["censor"] = future_censor.result()[0]
+                analysis_results["translate"] = future_translate.result()[0]
+
+            print(f"[recognizer_workflow] 文本分析完成。")
+            print(f"[recognizer_workflow] > Censor: {analysis_results['censor']}")
+            print(f"[recognizer_workflow] > Translate: {analysis_results['translate']['translated_text']}")
+
+            # --- 5. 决策 (在 Controller 中) ---
+            is_illegal_adult = analysis_results["adult"].get("illegal", False)
+            is_illegal_violence = analysis_results["violence"].get("illegal", False)
+            is_illegal_censor = analysis_results["censor"].get("illegal", False)
         
-        final_illegal_flag = is_illegal_adult or is_illegal_violence or is_illegal_censor
+            final_illegal_flag = is_illegal_adult or is_illegal_violence or is_illegal_censor
         
-        print(f"[recognizer_workflow] 决策: Adult={is_illegal_adult}, Violence={is_illegal_violence}, Censor={is_illegal_censor} -> FinalDecision={final_illegal_flag}")
+            print(f"[recognizer_workflow] 决策: Adult={is_illegal_adult}, Violence={is_illegal_violence}, Censor={is_illegal_censor} -> FinalDecision={final_illegal_flag}")
 
-        final_image_path = image_path # 默认是原始图像
+            final_image_path = image_path # 默认是原始图像
 
-        # --- 6. 处理 (如果需要) ---
-        if final_illegal_flag:
-            print("[recognizer_workflow] 图像非法。正在调度 MOSAIC...")
-            mosaic_result, _ = _dispatch_request("recognizer_mosaic", {"image_path": image_path})
-            final_image_path = mosaic_result.get("mosaic_image_path")
-            print(f"[recognizer_workflow] MOSAIC 完成。处理后的图像位于 {final_image_path}")
-        else:
-            print("[recognizer_workflow] 图像安全。跳过 MOSAIC。")
+            # --- 6. 处理 (如果需要) ---
+            _record_branch("recognizer", "mosaic", final_illegal_flag)
+            if final_illegal_flag:
+                mosaic_result = None
+                if speculative_future is not None:
+                    try:
+                        speculative_result, _ = speculative_future.result()
+                        mosaic_result = {"mosaic_image_path": _commit_attempt_output("recognizer_mosaic", speculative_result["mosaic_image_path"])}
+                        speculation["used"] = True
+                        print("[recognizer_workflow] 图像非法。采用投机执行的 MOSAIC 结果。")
+                    except Exception as e:
+                        print(f"[recognizer_workflow] 投机执行的 MOSAIC 失败 ({e})，改为正常调度。")
+                if mosaic_result is None:
+                    print("[recognizer_workflow] 图像非法。正在调度 MOSAIC...")
+                    # mosaic_options 可指定 block_size / scale / mode / regions
+                    mosaic_result, _ = _dispatch_request("recognizer_mosaic", mosaic_payload)
+                final_image_path = mosaic_result.get("mosaic_image_path")
+                print(f"[recognizer_workflow] MOSAIC 完成。处理后的图像位于 {final_image_path}")
+            else:
+                print("[recognizer_workflow] 图像安全。跳过 MOSAIC。")
+        finally:
+            if speculative_future is not None and not speculation["used"]:
+                # 没有采用 (条件不成立或工作流失败): 不等待投机任务，完成后删除它的输出
+                speculative_future.add_done_callback(lambda f: _discard_attempt_output("recognizer_mosaic", f, "mosaic_image_path"))
+            speculative_executor.shutdown(wait=False)
 
         # --- 7. 最终输出 ---
         final_result = {
             "illegal": final_illegal_flag,
             "final_image_path": final_image_path,
             "translated_text": analysis_results["translate"].get("translated_text"),
+            "speculation": speculation,
             "details": {
                 "adult_check": analysis_results["adult"],
                 "violence_check": analysis_results["violence"],
@@ -388,24 +997,57 @@ def _run_svd_workflow(payload):
     try:
         # --- 1. 获取工作流输入 ---
         # payload 示例: {"row_num": 2000, "col_num": 100, "slice_num": 2}
+        # 可选: "mode": "exact" (默认) / "tsqr" / "randomized"; "tree_fanin": TSQR 归约树的扇入;
+        #       "rank"/"oversample"/"power_iters"/"seed": 随机化低秩 SVD 参数 (给出 rank 即启用);
+        #       "materialize_u": 是否把最终 U 按切片显式写出
         row_num = payload.get("row_num", 2000)
         col_num = payload.get("col_num", 100)
         slice_num = payload.get("slice_num", 2)
+        mode = payload.get("mode", "randomized" if payload.get("rank") else "exact")
         
         # --- 2. 调度 SVD Start (分割) ---
         print("[svd_workflow] 正在调度 SVD_START (分割)...")
         start_payload = {
             "row_num": row_num,
             "col_num": col_num,
-            "slice_num": slice_num
+            "slice_num": slice_num,
+            "seed": payload.get("matrix_seed") # 可选: 固定生成矩阵的随机种子
         }
         start_result, _ = _dispatch_request("svd_start", start_payload)
         slice_paths = start_result['slice_paths'] # [ {"slice_paths": ["/storage/...", ...]} ]
         print(f"[svd_workflow] SVD_START 完成。创建了 {len(slice_paths)} 个切片。")
 
+        if mode == "tsqr":
+            final_paths = _run_svd_tsqr(
+                slice_paths,
+                tree_fanin=int(payload.get("tree_fanin", 4)),
+                materialize_u=bool(payload.get("materialize_u", False))
+            )
+            print(f"\n[svd_workflow] --- 成功! ---")
+            print(f"[svd_workflow] TSQR 结果: S={final_paths.get('final_s_path')}, U 因子数={len(final_paths.get('u_factor_paths', []))}")
+            return
+
+        if mode == "randomized":
+            rank = int(payload.get("rank", 10))
+            final_paths = _run_svd_randomized(
+                slice_paths,
+                col_num=col_num,
+                rank=rank,
+                oversample=int(payload.get("oversample", 10)),
+                power_iters=int(payload.get("power_iters", 1)),
+                seed=int(payload.get("seed", 0)),
+                materialize_u=bool(payload.get("materialize_u", False))
+            )
+            print(f"\n[svd_workflow] --- 成功! ---")
+            print(f"[svd_workflow] 随机化 SVD (rank={rank}) 结果: S={final_paths.get('final_s_path')}")
+            print(f"[svd_workflow] 近似误差: {final_paths.get('approx_error')}")
+            return
+
         # --- 3. 调度 SVD Compute (并行) ---
         print("[svd_workflow] 正在调度 SVD_COMPUTE (并行)...")
         
+        dispatch_task = _fanout_dispatcher(payload)
+
         def _compute_task(task_input):
             # task_input 是一个 (index, path) 元组
             mat_index, slice_path = task_input
@@ -415,7 +1057,7 @@ def _run_svd_workflow(payload):
                 'mat_index': mat_index
             }
             # _dispatch_request 返回 (result_payload, container_id)
-            result, _ = _dispatch_request("svd_compute", task_payload)
+            result, _ = dispatch_task("svd_compute", task_payload)
             print(f"[svd_workflow]  > 完成计算: {slice_path}")
             return result # 返回包含 {u_path, s_path, ...} 的 dict
 
@@ -445,6 +1087,134 @@ def _run_svd_workflow(payload):
         print(f"\n[svd_workflow] --- 失败! ---")
         print(f"[svd_workflow] 工作流执行出错: {e}")
 
+def _run_svd_tsqr(slice_paths, tree_fanin=4, materialize_u=False):
+    """
+    TSQR 模式: 每个切片只做 QR，R 因子按 tree_fanin 分组做树形归约，
+    根节点对 (col_num x col_num) 的 R 做 SVD。最终 U 以 U_i = Q_i @ F_i 的形式按切片保存，
+    merge 的内存只和 col_num 有关，和 row_num、slice_num 无关。
+    """
+    tree_fanin = max(2, tree_fanin)
+
+    # --- 1. 叶子: 并行 QR ---
+    print("[svd_workflow] 正在调度 SVD_COMPUTE (TSQR 叶子, 并行)...")
+
+    def _qr_task(task_input):
+        mat_index, slice_path = task_input
+        task_payload = {'mode': 'tsqr', 'slice_path': slice_path, 'mat_index': mat_index}
+        result, _ = _dispatch_request("svd_compute", task_payload)
+        return result
+
+    compute_tasks = list(enumerate(slice_paths))
+    with ThreadPoolExecutor(max_workers=len(compute_tasks)) as executor:
+        leaves = list(executor.map(_qr_task, compute_tasks))
+    leaves.sort(key=lambda r: r['mat_index'])
+
+    # --- 2. 树形归约 R (每一层的节点并行) ---
+    tree = []
+    level_nodes = leaves
+    level = 1
+    while len(level_nodes) > 1:
+        groups = [list(range(i, min(i + tree_fanin, len(level_nodes))))
+                  for i in range(0, len(level_nodes), tree_fanin)]
+        print(f"[svd_workflow] 正在调度 SVD_MERGE (TSQR 第 {level} 层, {len(groups)} 个节点)...")
+
+        def _reduce_task(task_input, level=level, level_nodes=level_nodes):
+            node_index, children = task_input
+            task_payload = {
+                'mode': 'tsqr_reduce',
+                'node_id': f"{level}_{node_index}",
+                'r_paths': [level_nodes[c]['r_path'] for c in children]
+            }
+            result, _ = _dispatch_request("svd_merge", task_payload)
+            return result
+
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            reduced = list(executor.map(_reduce_task, enumerate(groups)))
+
+        tree.append([
+            {"children": children, "q_block_paths": node['q_block_paths']}
+            for children, node in zip(groups, reduced)
+        ])
+        level_nodes = reduced
+        level += 1
+
+    # --- 3. 根节点 SVD，并把 U 因子推回每个叶子 ---
+    print("[svd_workflow] 正在调度 SVD_MERGE (TSQR 根节点)...")
+    final_payload = {
+        'mode': 'tsqr_final',
+        'root_r_path': level_nodes[0]['r_path'],
+        'tree': tree,
+        'leaf_num': len(leaves)
+    }
+    final_paths, _ = _dispatch_request("svd_merge", final_payload)
+    final_paths['q_paths'] = [leaf['q_path'] for leaf in leaves]
+
+    # --- 4. (可选) 按切片并行重建 U_i = Q_i @ F_i ---
+    if materialize_u:
+        final_paths['u_paths'] = _materialize_svd_u(final_paths['q_paths'], final_paths['u_factor_paths'])
+
+    return final_paths
+
+def _materialize_svd_u(left_paths, factor_paths):
+    """并行调度 svd_compute 的 apply 模式，按切片写出 U_i = left_i @ factor_i。"""
+    print("[svd_workflow] 正在调度 SVD_COMPUTE (重建 U 切片, 并行)...")
+
+    def _apply_task(task_input):
+        mat_index, (left_path, factor_path) = task_input
+        task_payload = {'mode': 'apply', 'mat_index': mat_index, 'left_path': left_path, 'factor_path': factor_path}
+        result, _ = _dispatch_request("svd_compute", task_payload)
+        return result['u_path']
+
+    apply_tasks = list(enumerate(zip(left_paths, factor_paths)))
+    with ThreadPoolExecutor(max_workers=len(apply_tasks)) as executor:
+        return list(executor.map(_apply_task, apply_tasks))
+
+def _run_svd_randomized(slice_paths, col_num, rank, oversample=10, power_iters=1, seed=0, materialize_u=False):
+    """
+    随机化低秩 SVD (Halko 等的 range finder)，在切片上分布式执行:
+    每次幂迭代一遍扫描 (W = sum_i A_i^T A_i Z)，最后一遍投影得到小矩阵 G、H，
+    merge 只处理 (rank + oversample) 大小的矩阵，并报告截断误差。
+    """
+    sketch_size = min(rank + oversample, col_num)
+    compute_tasks = list(enumerate(slice_paths))
+
+    def _scan(mode, extra):
+        def _scan_task(task_input):
+            mat_index, slice_path = task_input
+            task_payload = dict(extra, mode=mode, slice_path=slice_path, mat_index=mat_index)
+            result, _ = _dispatch_request("svd_compute", task_payload)
+            return result
+        with ThreadPoolExecutor(max_workers=len(compute_tasks)) as executor:
+            return list(executor.map(_scan_task, compute_tasks))
+
+    # z_path 为 None 时由各切片用 seed 生成同一个高斯初始矩阵
+    basis = {'z_path': None, 'sketch_size': sketch_size, 'seed': seed}
+
+    # --- 1. 幂迭代: 每轮一遍扫描 + 一次小规模 QR ---
+    for power_iter in range(power_iters):
+        print(f"[svd_workflow] 正在调度 SVD_COMPUTE (幂迭代 {power_iter + 1}/{power_iters}, 并行)...")
+        partials = _scan('rsvd_power', dict(basis, power_iter=power_iter))
+        reduce_payload = {
+            'mode': 'rsvd_power_reduce',
+            'power_iter': power_iter,
+            'w_paths': [r['w_path'] for r in partials]
+        }
+        reduced, _ = _dispatch_request("svd_merge", reduce_payload)
+        basis['z_path'] = reduced['z_path']
+
+    # --- 2. 投影 + 合并 ---
+    print("[svd_workflow] 正在调度 SVD_COMPUTE (投影, 并行)...")
+    projections = _scan('rsvd_project', basis)
+    final_payload = dict(basis, mode='rsvd_final', rank=rank, results=projections)
+    final_paths, _ = _dispatch_request("svd_merge", final_payload)
+
+    # --- 3. (可选) 按切片并行重建 U_i = A_i @ F ---
+    if materialize_u:
+        factor_paths = [final_paths['u_factor_path']] * len(slice_paths)
+        final_paths['u_paths'] = _materialize_svd_u(slice_paths, factor_paths)
+
+    return final_paths
+
 # --- 新增：硬编码的 WordCount 工作流逻辑 ---
 def _run_wordcount_workflow(payload):
     """
@@ -474,10 +1244,12 @@ def _run_wordcount_workflow(payload):
         # --- 3. 调度 WordCount Count (并行 Map) ---
         print("[wordcount_workflow] 正在调度 WORDCOUNT_COUNT (并行)...")
         
+        dispatch_task = _fanout_dispatcher(payload)
+
         def _count_task(chunk_path):
             print(f"[wordcount_workflow]  > 开始计数: {chunk_path}")
             task_payload = {'chunk_path': chunk_path}
-            result, _ = _dispatch_request("wordcount_count", task_payload)
+            result, _ = dispatch_task("wordcount_count", task_payload)
             print(f"[wordcount_workflow]  > 完成计数: {chunk_path}")
             return result['result_path'] # 返回部分结果JSON文件的路径
 
@@ -590,26 +1362,85 @@ def manager_status(function_name):
 
     with m.lock:
         total = len(m.containers)
-        idle = sum(1 for d in m.containers.values() if d["status"] == "idle")
+        idle = m.count_idle(running_only=False)
         busy = sum(1 for d in m.containers.values() if d["status"] == "busy")
-        ports = [ {"id": cid[:12], "host_port": d.get("host_port")} for cid,d in m.containers.items() ]
-    return jsonify({"function": function_name, "total": total, "idle": idle, "busy": busy, "containers": ports})
+        ports = [ {"id": cid[:12], "endpoint": d.get("endpoint"), "inflight": d.get("inflight", 0),
+                   "cpus": d.get("cpus"), "mems": d.get("mems"), "startup": d.get("startup")} for cid,d in m.containers.items() ]
+    return jsonify({"function": function_name, "total": total, "idle": idle, "busy": busy,
+                    "placement": m.placement, "inline": isinstance(m, InlineManager),
+                    "backend": getattr(getattr(m, "backend", None), "name", None),
+                    "transport": getattr(m, "transport", None),
+                    "code_version": code_store.get_store().version(function_name), "containers": ports})
+
+@app.route('/deploy/<function_name>', methods=['POST'])
+def deploy(function_name):
+    """
+    热更新: 把 controller 上的 actions/<fn>/ 打包为新的代码版本，后台推送到该函数的空闲容器，不重建镜像、不冷启动。
+    忙的容器处理完当前请求后，在下一次调度的 /init 时换到新版本；内联函数换一个新的工作进程池。
+    代码没有变化时版本相同，不做任何推送。
+    """
+    try:
+        version, changed = code_store.get_store().deploy(function_name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    rollout = None
+    if changed and isinstance(manager, InlineManager):
+        manager.reload()
+        rollout = "inline"
+    elif changed and manager is not None:
+        manager.rollout(lambda endpoint: _init_container(endpoint, function_name))
+        rollout = "background"
+    print(f"[deploy] {function_name} -> {version} ({'changed' if changed else 'unchanged'}).")
+    return jsonify({"function": function_name, "version": version, "changed": changed, "rollout": rollout}), 200
+
+@app.route('/interference', methods=['GET'])
+def interference_status():
+    # 每个函数的计数器画像和干扰类别，以及当前放置的总干扰代价
+    return jsonify({"functions": interference.get_scheduler().snapshot(),
+                    "conflict_cost": cpu_topology.get_placer().conflict_cost()})
+
+@app.route('/placement', methods=['GET'])
+def placement_status():
+    # 全局 CPU 拓扑和当前分配表 (所有 manager)
+    placer = cpu_topology.get_placer()
+    return jsonify({"topology": placer.topology.summary(), "allocations": placer.snapshot()})
 
 
 # --- Global cleanup (保持不变) ---
 def clean_up_all_containers_on_exit(): #
-    # ... 您的 clean_up_all_containers_on_exit 函数代码保持不变 ...
-    print("Application exiting. Stopping all function containers...")
-    with manager_lock:
-        for manager in function_managers.values():
-            try:
+    # KEEP_CONTAINERS_ON_EXIT=1: 容器留给下一个 controller 进程接管 (见 restore_managers)，部署时不必全部冷启动
+    if KEEP_CONTAINERS_ON_EXIT:
+        print("Application exiting. Leaving function containers running for the next controller.")
+    else:
+        print("Application exiting. Stopping all function containers...")
+    def _clean(manager):
+        try:
+            if KEEP_CONTAINERS_ON_EXIT and isinstance(manager, FunctionManager):
+                manager.detach()
+            else:
                 manager.stop_all_containers()
-            except Exception as e:
-                print("Error cleaning manager:", e)
-    print("All containers stopped on exit.")
+        except Exception as e:
+            print("Error cleaning manager:", e)
+
+    with manager_lock:
+        managers = list(function_managers.values())
+    # 各 manager 并行拆除 (每个 manager 内部也并行删除容器)；atexit 中不能再用 ThreadPoolExecutor，用普通线程
+    threads = [threading.Thread(target=_clean, args=(manager,)) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("Controller cleanup finished.")
 
 atexit.register(clean_up_all_containers_on_exit) #
 
 if __name__ == '__main__':
     # ... 您的 __main__ 代码保持不变 ...
+    # 用已有的 perf 日志初始化函数的干扰画像 (先清理每个函数最近 PERF_LOG_KEEP 个之外的旧日志)
+    interference.prune_logs(PERF_LOG_DIR)
+    print(f"Loaded {interference.get_scheduler().load_dir(PERF_LOG_DIR)} perf logs for interference-aware scheduling.")
+    # 恢复上次登记的 manager，并接管仍在运行的容器
+    print(f"Restored {restore_managers()} managers from {MANAGER_STATE_PATH}.")
     app.run(host='0.0.0.0', port=5000, threaded=True) #
\ No newline at end of file
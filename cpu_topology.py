@@ -0,0 +1,311 @@
+# cpu_topology.py
+# 宿主机 CPU 拓扑 (物理核 / SMT 兄弟线程 / NUMA 节点) 和容器的 CPU 放置。
+# compete_ht.sh / compete_iso.sh 的实验表明: 两个 matmul 容器落在同一物理核的兄弟线程 (0,64) 上时
+# 互相干扰严重，落在不同物理核 (0,2) 上则好得多。FunctionManager 在创建容器时向全局 CpuPlacer
+# 申请 CPU，按函数的放置策略设置 cpuset_cpus / cpuset_mems / nano_cpus，容器删除时归还。
+#
+# 放置策略 (manager 的 placement 配置: {"policy": ..., "cpus": n, "cpu_quota": x, "node": k, "cpu_list": "0,2", "fallback": "shared"}):
+#   exclusive_core - 独占 n 个物理核 (核上的所有兄弟线程都分给该容器，其他容器不会再落到这些核上)
+#   smt_shared     - n 个硬件线程，可以与其他 smt_shared 容器共享物理核 (优先选负载最低的线程)
+#   numa_local     - n 个硬件线程，全部来自同一个 NUMA 节点 (node 指定或自动选空闲最多的)，内存也绑定到该节点
+#   pinned         - 使用 cpu_list 指定的 CPU (其中被其他容器独占的核除外)
+#   interference_aware - n 个硬件线程，选择与兄弟线程上已有容器冲突代价最小的线程 (类别和代价见 interference.py)
+# 所有策略都不会选到被 exclusive_core 容器独占的核。策略无法满足时 fallback 决定怎么做:
+#   shared (默认) - 绑定到所有未被独占的线程 (与其他非独占容器共享)；refuse - 不分配，FunctionManager 不创建容器。
+#   未被独占的线程也没有时总是不分配；容器绝不会不绑定 CPU 运行 (那样会落到独占核上)。
+# 多 NUMA 节点的主机上 (以及 numa_local 策略) 会把 cpuset_mems 设为所选 CPU 所在的节点；cpu_quota 额外用 nano_cpus 限制 CPU 时间。
+import os
+import threading
+
+SYS_CPU_DIR = '/sys/devices/system/cpu'
+SYS_NODE_DIR = '/sys/devices/system/node'
+POLICIES = ('exclusive_core', 'smt_shared', 'numa_local', 'pinned', 'interference_aware')
+
+
+def parse_cpulist(text):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+class CpuTopology:
+    """在线 CPU 的拓扑: cpu -> (物理核, NUMA 节点)，以及核 -> 兄弟线程、节点 -> CPU 的反向索引。"""
+    def __init__(self, cpu_dir=SYS_CPU_DIR, node_dir=SYS_NODE_DIR):
+        online = _read(os.path.join(cpu_dir, 'online'))
+        cpus = parse_cpulist(online) if online else list(range(os.cpu_count() or 1))
+
+        self.node_of = {}
+        for entry in (os.listdir(node_dir) if os.path.isdir(node_dir) else []):
+            if entry.startswith('node') and entry[4:].isdigit():
+                for cpu in parse_cpulist(_read(os.path.join(node_dir, entry, 'cpulist'), '')):
+                    self.node_of[cpu] = int(entry[4:])
+
+        self.core_of = {}
+        for cpu in cpus:
+            topo_dir = os.path.join(cpu_dir, f'cpu{cpu}', 'topology')
+            package = int(_read(os.path.join(topo_dir, 'physical_package_id'), 0))
+            core_id = int(_read(os.path.join(topo_dir, 'core_id'), cpu))
+            self.core_of[cpu] = (package, core_id)
+            self.node_of.setdefault(cpu, 0)
+
+        self.cpus = sorted(self.core_of)
+        self.cores = {}
+        for cpu in self.cpus:
+            self.cores.setdefault(self.core_of[cpu], []).append(cpu)
+        self.nodes = {}
+        for cpu in self.cpus:
+            self.nodes.setdefault(self.node_of[cpu], []).append(cpu)
+
+    def siblings(self, cpu):
+        return self.cores[self.core_of[cpu]]
+
+    def summary(self):
+        return {
+            "cpus": len(self.cpus),
+            "cores": len(self.cores),
+            "threads_per_core": max(len(threads) for threads in self.cores.values()),
+            "nodes": {node: format_cpulist(cpus) for node, cpus in self.nodes.items()},
+        }
+
+
+class CpuPlacer:
+    """
+    全局 CPU 分配表 (所有 FunctionManager 共用一个)。
+    exclusive 记录被独占的物理核；load 记录每个硬件线程上放置的非独占容器数。
+    """
+    def __init__(self, topology=None):
+        self.topology = topology or CpuTopology()
+        self.allocations = {} # {owner: {"policy", "cpus", "mems", "cores", "class"}}
+        self.exclusive = {} # {core_key: owner}
+        self.load = {cpu: 0 for cpu in self.topology.cpus}
+        self.occupants = {cpu: [] for cpu in self.topology.cpus} # 每个线程上的容器 (用于干扰代价)
+        self.active = {} # {owner: 正在处理的请求数}
+        self.lock = threading.Lock()
+
+    def _class_of(self, owner):
+        return self.allocations.get(owner, {}).get("class") or 'unknown'
+
+    def _cost(self, cpu, cls, exclude=None, active_only=False):
+        # 把 cls 类的容器放到 cpu 上的代价: 同一物理核上其他容器与它的冲突之和；同一线程上的容器再加 1 (分时)
+        import interference
+        cost = 0.0
+        for sibling in self.topology.siblings(cpu):
+            for owner in self.occupants[sibling]:
+                if owner == exclude or (active_only and not self.active.get(owner)):
+                    continue
+                cost += interference.conflict(cls, self._class_of(owner)) + (1.0 if sibling == cpu else 0.0)
+        return cost
+
+    def _free_cores(self, node=None):
+        # 完全空闲的物理核 (没有被独占，也没有共享容器)，按 (节点, 核) 排序
+        cores = []
+        for core, threads in self.topology.cores.items():
+            if core in self.exclusive or any(self.load[cpu] for cpu in threads):
+                continue
+            if node is not None and self.topology.node_of[threads[0]] != node:
+                continue
+            cores.append(core)
+        return sorted(cores, key=lambda core: (self.topology.node_of[self.topology.cores[core][0]], core))
+
+    def _shareable_cpus(self, node=None):
+        # 不在独占核上的线程，按负载从低到高 (同负载时兄弟线程相邻，便于共享容器聚在一起)
+        cpus = [cpu for cpu in self.topology.cpus
+                if self.topology.core_of[cpu] not in self.exclusive
+                and (node is None or self.topology.node_of[cpu] == node)]
+        return sorted(cpus, key=lambda cpu: (self.load[cpu], self.topology.core_of[cpu], cpu))
+
+    def _pick_node(self, count):
+        # 空闲线程最多的节点
+        free = {node: sum(1 for cpu in self._shareable_cpus(node) if self.load[cpu] == 0)
+                for node in self.topology.nodes}
+        return max(free, key=lambda node: (free[node] >= count, free[node], -node))
+
+    def allocate(self, owner, spec):
+        """
+        按 spec 为 owner (容器名) 分配 CPU；返回 {"cpus": [...], "mems": [...], ...}。
+        策略无法满足时按 spec 的 fallback 退回到所有未独占的线程 (assignment["fallback"] 为 True)，否则返回 None。
+        """
+        policy = spec.get("policy", "smt_shared")
+        count = max(1, int(spec.get("cpus", 1)))
+        with self.lock:
+            cores = []
+            if policy == "exclusive_core":
+                free = self._free_cores(spec.get("node"))
+                cores = free[:count] if len(free) >= count else []
+                cpus = [cpu for core in cores for cpu in self.topology.cores[core]]
+            elif policy == "smt_shared":
+                cpus = self._shareable_cpus(spec.get("node"))[:count]
+            elif policy == "numa_local":
+                node = spec.get("node")
+                if node is None:
+                    node = self._pick_node(count)
+                cpus = self._shareable_cpus(node)[:count]
+            elif policy == "interference_aware":
+                cls = spec.get("class") or 'unknown'
+                cpus = sorted(self._shareable_cpus(spec.get("node")),
+                              key=lambda cpu: (self._cost(cpu, cls), self.load[cpu], self.topology.core_of[cpu], cpu))[:count]
+            elif policy == "pinned":
+                cpus = [cpu for cpu in parse_cpulist(str(spec.get("cpu_list", "")))
+                        if cpu in self.load and self.topology.core_of[cpu] not in self.exclusive]
+            else:
+                raise ValueError(f"Unknown placement policy: {policy}")
+            fallback = len(cpus) < (1 if policy == "pinned" else count)
+            if fallback:
+                if spec.get("fallback", "shared") != "shared":
+                    return None
+                cores = []
+                cpus = self._shareable_cpus()
+                if not cpus:
+                    return None
+
+            for core in cores:
+                self.exclusive[core] = owner
+            if not cores:
+                for cpu in cpus:
+                    self.load[cpu] += 1
+            for cpu in cpus:
+                self.occupants[cpu].append(owner)
+            assignment = {
+                "policy": policy,
+                "cpus": sorted(cpus),
+                "mems": sorted({self.topology.node_of[cpu] for cpu in cpus}),
+                "cores": cores,
+                "class": spec.get("class"),
+                "fallback": fallback,
+            }
+            self.allocations[owner] = assignment
+            return assignment
+
+    def adopt(self, owner, cpus, spec):
+        """
+        登记一个已经绑定到 cpus 的容器 (controller 重启后接管的容器)，不重新挑选 CPU。
+        exclusive_core 策略下整核都在 cpus 里且没有被占用的核重新记为独占；其余按共享计入负载。
+        """
+        policy = spec.get("policy", "smt_shared")
+        with self.lock:
+            cpus = sorted(cpu for cpu in cpus if cpu in self.load)
+            if not cpus or owner in self.allocations:
+                return None
+            cores = []
+            if policy == "exclusive_core":
+                cores = sorted({self.topology.core_of[cpu] for cpu in cpus})
+                if any(core in self.exclusive or not set(self.topology.cores[core]) <= set(cpus) or
+                       any(self.load[cpu] for cpu in self.topology.cores[core]) for core in cores):
+                    cores = []
+            for core in cores:
+                self.exclusive[core] = owner
+            if not cores:
+                for cpu in cpus:
+                    self.load[cpu] += 1
+            for cpu in cpus:
+                self.occupants[cpu].append(owner)
+            assignment = {
+                "policy": policy,
+                "cpus": cpus,
+                "mems": sorted({self.topology.node_of[cpu] for cpu in cpus}),
+                "cores": cores,
+                "class": spec.get("class"),
+            }
+            self.allocations[owner] = assignment
+            return assignment
+
+    def release(self, owner):
+        with self.lock:
+            assignment = self.allocations.pop(owner, None)
+            if assignment is None:
+                return
+            for core in assignment["cores"]:
+                self.exclusive.pop(core, None)
+            if not assignment["cores"]:
+                for cpu in assignment["cpus"]:
+                    self.load[cpu] = max(0, self.load[cpu] - 1)
+            for cpu in assignment["cpus"]:
+                if owner in self.occupants[cpu]:
+                    self.occupants[cpu].remove(owner)
+            self.active.pop(owner, None)
+
+    def set_active(self, owner, delta):
+        # FunctionManager 在容器开始/结束处理请求时调用，用于按当前实际负载估计干扰
+        with self.lock:
+            if owner in self.allocations:
+                self.active[owner] = max(0, self.active.get(owner, 0) + delta)
+
+    def contention(self, owner):
+        """owner 的 CPU 上当前正在运行的其他容器带来的干扰代价。"""
+        with self.lock:
+            assignment = self.allocations.get(owner)
+            if assignment is None:
+                return 0.0
+            cls = self._class_of(owner)
+            return sum(self._cost(cpu, cls, exclude=owner, active_only=True) for cpu in assignment["cpus"])
+
+    def conflict_cost(self):
+        """当前放置的总干扰代价: 同一物理核上每对不同容器的冲突之和 (同一线程再加 1)。"""
+        import interference
+        with self.lock:
+            total = 0.0
+            for threads in self.topology.cores.values():
+                placed = [(owner, cpu) for cpu in threads for owner in self.occupants[cpu]]
+                for i, (owner_a, cpu_a) in enumerate(placed):
+                    for owner_b, cpu_b in placed[i + 1:]:
+                        if owner_a != owner_b:
+                            total += interference.conflict(self._class_of(owner_a), self._class_of(owner_b)) + \
+                                (1.0 if cpu_a == cpu_b else 0.0)
+            return total
+
+    def run_kwargs(self, assignment, spec):
+        """把分配结果换算成 docker containers.run 的参数。"""
+        kwargs = {"cpuset_cpus": format_cpulist(assignment["cpus"])}
+        if len(self.topology.nodes) > 1 or assignment["policy"] == "numa_local":
+            kwargs["cpuset_mems"] = format_cpulist(assignment["mems"])
+        if spec.get("cpu_quota"):
+            kwargs["nano_cpus"] = int(float(spec["cpu_quota"]) * 1e9)
+        return kwargs
+
+    def snapshot(self):
+        with self.lock:
+            return {owner: {"policy": a["policy"], "cpus": format_cpulist(a["cpus"]), "mems": format_cpulist(a["mems"]),
+                            "class": a.get("class"), "active": self.active.get(owner, 0)}
+                    for owner, a in self.allocations.items()}
+
+
+_placer = None
+_placer_lock = threading.Lock()
+
+
+def get_placer():
+    # 进程内唯一的分配表，第一次使用时读取拓扑
+    global _placer
+    with _placer_lock:
+        if _placer is None:
+            _placer = CpuPlacer()
+        return _placer
+
+
+if __name__ == '__main__':
+    # 打印本机拓扑: python3 cpu_topology.py
+    import json
+    topology = CpuTopology()
+    print(json.dumps(topology.summary(), indent=2))
+    for core, threads in sorted(topology.cores.items()):
+        print(f"core {core}: cpus {format_cpulist(threads)} node {topology.node_of[threads[0]]}")
@@ -1,28 +1,179 @@
-import docker
 import time
+import json
+import hashlib
 import threading
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import container_backend
+import cpu_topology
+import proxy_client
+import interference
+
+# 容器标签 (见 container_backend.py)。controller 重启后按 函数 + controller 找回容器，配置摘要不同的容器不接管
+LABEL_FUNCTION = "faas.function"
+LABEL_CONTROLLER = "faas.controller"
+LABEL_CONFIG = "faas.config"
+CONTROLLER_ID = os.environ.get("CONTROLLER_ID", "default") # 同一台宿主机上有多个 controller 时用来区分各自的容器
+PREWARM_PARALLELISM = 8 # 预热时同时创建的容器数上限
+STOP_PARALLELISM = 16 # stop_all_containers 同时删除的容器数上限
+ACQUIRE_TIMEOUT = 60 # 达到 max_containers 时请求等待容器空出的最长秒数，超时后放弃 (调用方收到 (None, None))
+DRAIN_TIMEOUT = 300 # 接管时仍在执行请求的容器最多等待这么久 (与 /run 的超时相同)，之后删除
 
 class FunctionManager:
-    def __init__(self, function_name, image_name, container_port, host_storage_path, host_port_start=8000, idle_timeout=300, min_idle_containers=1):
+    def __init__(self, function_name, image_name, container_port, host_storage_path, host_port_start=8000, idle_timeout=300, min_idle_containers=1,
+                 max_concurrency=1, environment=None, host_model_path=None, placement=None, backend='docker',
+                 transport='port', adopt=False, max_containers=None, acquire_timeout=ACQUIRE_TIMEOUT):
         self.function_name = function_name
         self.image_name = image_name
         self.container_port = container_port
         self.host_port_start = host_port_start
         self.host_storage_path = host_storage_path
+        self.host_model_path = host_model_path # 宿主机上的扁平模型目录，只读挂载到 /models，多个容器共享同一份权重
         self.idle_timeout = idle_timeout
         self.min_idle_containers = min_idle_containers
-        self.docker_client = docker.from_env()
-        self.containers = {}  # {container_id: {"container_obj": ..., "status": "idle/busy", "last_active": timestamp, "host_port": ...}}
+        self.max_concurrency = max(1, max_concurrency) # 每个容器允许同时处理的请求数 (>1 时用于容器内动态批处理)
+        # 容器数上限 (包括正在创建的)，None 表示不限制；达到上限后新请求等待已有容器空出，预热也不超过上限
+        self.max_containers = max(1, max_containers) if max_containers is not None else None
+        self.creating = 0 # 正在创建 (尚未登记) 的容器数
+        self.acquire_timeout = acquire_timeout
+        self.environment = dict(environment or {})
+        if self.max_concurrency > 1:
+            self.environment.setdefault("PROXY_THREADS", str(self.max_concurrency))
+        # CPU 放置策略 (见 cpu_topology.py)，例如 {"policy": "exclusive_core", "cpus": 1}；None 表示不绑定 CPU
+        self.placement = placement
+        if placement and placement.get("policy") not in cpu_topology.POLICIES:
+            raise ValueError(f"Unknown placement policy: {placement.get('policy')}")
+        # 容器生命周期后端 (见 container_backend.py): docker (默认) 或 local (本地 proxy.py 子进程)
+        self.backend = container_backend.get_backend(backend)
+        # controller 访问 proxy 的方式 (见 proxy_client.py): port (发布端口) / bridge (容器 IP) / uds (Unix 域套接字)
+        if transport not in proxy_client.TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
+        self.transport = transport
+        self.labels = {LABEL_FUNCTION: function_name, LABEL_CONTROLLER: CONTROLLER_ID, LABEL_CONFIG: self._config_digest()}
+        self.containers = {}  # {container_id: {"container_obj": ..., "status": "idle/busy", "inflight": n, "last_active": timestamp, "endpoint": ..., "startup": {...}}}
         self.lock = threading.Lock()
+        self.idle_changed = threading.Condition(self.lock) # 空闲容器可能增加时通知 (新容器就绪、请求结束、接管)，见 wait_until_warm
         self.next_host_port = host_port_start
         self._cleaner_stop_event = threading.Event()
+        if adopt:
+            self.adopt_containers()
 
         self.cleaner_thread = threading.Thread(target=self._run_cleaner, daemon=True)
         self.cleaner_thread.start()
         print(f"FunctionManager for {self.function_name} initialized.")
 
+    def _config_digest(self):
+        # 影响容器内行为的配置；任何一项改变后，旧配置创建的容器在重启时不再被接管
+        config = {"image": self.image_name, "port": self.container_port, "storage": self.host_storage_path,
+                  "models": self.host_model_path, "environment": self.environment, "placement": self.placement,
+                  "backend": self.backend.name, "transport": self.transport}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def adopt_containers(self, timeout=5):
+        """
+        接管上一个 controller 进程留下的本函数容器 (按标签查找)，空闲的登记为 idle；
+        还在执行上一个进程发出的请求 (或正忙得无法响应 /status) 的登记为 busy 并在后台排空 (见 _drain)，
+        请求结束后才变为 idle。配置或镜像已经改变、已退出或拿不到端点的容器被删除。返回接管的数量。
+        """
+        if not self.backend.persistent:
+            return 0
+        query = {LABEL_FUNCTION: self.function_name, LABEL_CONTROLLER: CONTROLLER_ID}
+        try:
+            found = self.backend.list_labeled(query)
+        except Exception as e:
+            print(f"Error listing containers to adopt for {self.function_name}: {e}")
+            return 0
+
+        adopted = 0
+        for container in found:
+            reason = None
+            status = self.backend.status(container)
+            if self.backend.labels(container).get(LABEL_CONFIG) != self.labels[LABEL_CONFIG]:
+                reason = "config changed"
+            elif not self.backend.is_current(container, self.image_name):
+                reason = "image rebuilt"
+            elif status not in ("running", "paused"):
+                reason = f"status {status}"
+            endpoint = None
+            inflight = None
+            if reason is None:
+                if status == "paused":
+                    self.backend.unpause(container)
+                    self.backend.refresh(container)
+                endpoint = self.backend.address(container, self.container_port, transport=self.transport, timeout=timeout)
+                if not endpoint:
+                    reason = "no endpoint"
+                else:
+                    inflight = self._proxy_inflight(endpoint, timeout=timeout)
+            if reason:
+                print(f"Not adopting container {container.name} for {self.function_name} ({reason}), removing it.")
+                try:
+                    self.backend.remove(container)
+                except Exception as e:
+                    print("cleanup error:", e)
+                continue
+
+            cpu_kwargs = self.backend.cpu_kwargs(container)
+            if self.placement and cpu_kwargs.get("cpuset_cpus"):
+                spec = dict(self.placement)
+                spec.setdefault("class", interference.get_scheduler().function_class(self.function_name))
+                cpu_topology.get_placer().adopt(container.name, cpu_topology.parse_cpulist(cpu_kwargs["cpuset_cpus"]), spec)
+            busy = inflight != 0 # None: /status 没有响应，可能 main 正在阻塞 proxy (PROXY_THREADS=0)
+            with self.lock:
+                self.containers[container.id] = {
+                    "container_obj": container,
+                    # 忙的容器占满并发槽位，排空前不会分给新请求
+                    "status": "busy" if busy else "idle",
+                    "inflight": self.max_concurrency if busy else 0,
+                    "draining": busy,
+                    "last_active": time.time(),
+                    "endpoint": endpoint,
+                    "cpus": cpu_kwargs.get("cpuset_cpus"),
+                    "mems": cpu_kwargs.get("cpuset_mems"),
+                    "startup": {"backend": self.backend.name, "transport": self.transport, "adopted": True}
+                }
+                if not busy:
+                    self.idle_changed.notify_all()
+            if busy:
+                threading.Thread(target=self._drain, args=(container.id,), daemon=True).start()
+            adopted += 1
+            state = "busy, draining" if busy else "idle"
+            print(f"Adopted container {container.name} id={container.id[:12]} endpoint={endpoint} ({state}) for {self.function_name}.")
+        return adopted
+
+    def _proxy_inflight(self, endpoint, timeout=5):
+        # proxy 正在执行的 run 请求数；/status 没有响应时返回 None (旧版 proxy 没有 inflight 字段时按状态判断)
+        try:
+            data = proxy_client.get(endpoint, "/status", timeout=timeout).json()
+        except Exception:
+            return None
+        return int(data.get("inflight", 1 if data.get("status") == "run" else 0))
+
+    def _drain(self, container_id, timeout=DRAIN_TIMEOUT, interval=1.0):
+        """等待接管时仍忙的容器执行完上一个 controller 发出的请求后再设为 idle；超时仍不空闲时删除。"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and not self._cleaner_stop_event.is_set():
+            with self.lock:
+                data = self.containers.get(container_id)
+                if data is None or not data.get("draining"):
+                    return
+                endpoint = data["endpoint"]
+            if self._proxy_inflight(endpoint, timeout=interval) == 0:
+                with self.lock:
+                    data = self.containers.get(container_id)
+                    if data is None:
+                        return
+                    data.update({"status": "idle", "inflight": 0, "draining": False, "last_active": time.time()})
+                    self.idle_changed.notify_all()
+                print(f"Adopted container {container_id[:12]} for {self.function_name} drained, now idle.")
+                return
+            self._cleaner_stop_event.wait(interval)
+        with self.lock:
+            data = self.containers.pop(container_id, None)
+        if data is not None:
+            print(f"Adopted container {container_id[:12]} for {self.function_name} did not become idle, removing it.")
+            self._remove_container(container_id, data["container_obj"])
+
     def _get_next_host_port(self):
         with self.lock:
             port = self.next_host_port
@@ -30,162 +181,293 @@ class FunctionManager:
             # TODO: Add logic to check if port is actually free
             return port
 
-    def _wait_for_container_service(self, host_port, timeout=30, check_interval=0.01):
+    def _wait_for_container_service(self, container, endpoint, timeout=30, check_interval=0.01):
         """
         timeout: 总超时时间(秒)
         check_interval: 每次轮询前 sleep 的时间(秒), 此处设置为10ms
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"http://127.0.0.1:{host_port}/status", timeout=check_interval)
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                    except Exception:
-                        data = {}
-                    if data.get("status") in ["new", "ok", "ready"]:
-                        print(f"Container service on port {host_port} is ready.")
-                        return True
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                # 只记录少量调试信息以免太噪
-                # print(f"status check: {e}")  # 可按需打开
-                pass
-            time.sleep(check_interval)
-        print(f"Container service on port {host_port} did not become ready within {timeout} seconds.")
-        return False
+        return self.backend.wait_ready(container, endpoint, timeout=timeout, check_interval=check_interval)
 
     def _create_new_container(self):
-        # 使用 Docker 随机映射宿主端口，避免端口冲突
         container_name = f"{self.function_name}-{os.urandom(4).hex()}"
+        startup = {"backend": self.backend.name, "transport": self.transport}
+        create_start = time.time()
         try:
-            print(f"Creating new container '{container_name}' ...")
-
-            # --- 准备 docker run 的参数 ---
-            run_kwargs = {
-                "detach": True,
-                "ports": {f"{self.container_port}/tcp": None}, #
-                "name": container_name
-            }
+            print(f"Creating new container '{container_name}' ({self.backend.name}) ...")
 
             # --- 仅在 host_storage_path 存在时才添加 volumes ---
+            volumes = {}
             if self.host_storage_path:
                 print(f"  > Mounting volume: {self.host_storage_path} -> /storage")
-                run_kwargs["volumes"] = {self.host_storage_path: {'bind': '/storage', 'mode': 'rw'}}
+                volumes[self.host_storage_path] = {'bind': '/storage', 'mode': 'rw'}
             else:
                 print("  > No host_storage_path provided. Running without volume.")
+            if self.host_model_path:
+                print(f"  > Mounting models (read-only): {self.host_model_path} -> /models")
+                volumes[self.host_model_path] = {'bind': '/models', 'mode': 'ro'}
+            cpu_kwargs = {}
             
-            # --- 使用 **kwargs 运行容器 ---
-            container = self.docker_client.containers.run( #
-                self.image_name,
-                **run_kwargs
-            )
+            # --- 按放置策略分配 CPU (分配表按容器名记录，容器删除或创建失败时归还) ---
+            assignment = None
+            if self.placement:
+                placer = cpu_topology.get_placer()
+                # 带上函数当前的干扰类别 (由 perf 计数器画像得出)，interference_aware 策略据此避开冲突的兄弟线程
+                spec = dict(self.placement)
+                spec.setdefault("class", interference.get_scheduler().function_class(self.function_name))
+                assignment = placer.allocate(container_name, spec)
+                if not assignment:
+                    # 不绑定 CPU 运行会落到其他容器独占的核上，所以不创建
+                    print(f"  > CPU placement ({self.placement.get('policy')}): no CPUs available, not creating the container.")
+                    return None
+                cpu_kwargs = placer.run_kwargs(assignment, spec)
+                fallback = " (fallback to shared CPUs)" if assignment.get("fallback") else ""
+                print(f"  > CPU placement ({assignment['policy']}){fallback}: cpus={cpu_kwargs['cpuset_cpus']} mems={cpu_kwargs.get('cpuset_mems', '-')}")
+
+            container = self.backend.create(self.image_name, container_name, self.container_port,
+                                            environment=self.environment, volumes=volumes, cpu_kwargs=cpu_kwargs,
+                                            transport=self.transport, labels=self.labels)
             print(f"Created container id={container.id[:12]}")
-        except docker.errors.ImageNotFound:
-            print(f"Error: Image '{self.image_name}' not found.")
+        except container_backend.ContainerBackendError as e:
+            print(f"Error: {e}")
+            self._release_cpus(container_name)
             return None
         except Exception as e:
             print(f"Error creating container '{container_name}': {e}")
+            self._release_cpus(container_name)
             return None
+        startup["create_s"] = time.time() - create_start
 
-        # 等待 Docker 完成端口映射
-        host_port = None
-        for _ in range(60):  # 最多等待约 30s（60*0.5）
-            try:
-                container.reload()
-                mapping = container.attrs.get("NetworkSettings", {}).get("Ports", {}).get(f"{self.container_port}/tcp")
-                if mapping and mapping[0].get("HostPort"):
-                    host_port = int(mapping[0]["HostPort"])
-                    break
-            except Exception as e:
-                print("container inspect exception:", e)
-            time.sleep(0.5)
-
-        if not host_port:
-            print(f"Service mapping not available for container {container.id[:12]}; attrs={container.attrs}")
+        # 等待后端给出 proxy 端点 (docker port: 端口映射；bridge: 容器 IP；uds: 套接字路径，无需等待)
+        endpoint = self.backend.address(container, self.container_port, transport=self.transport, timeout=30)
+        startup["address_s"] = time.time() - create_start
+        if not endpoint:
             try:
                 print("Container logs (tail 50):")
-                print(container.logs(tail=50).decode(errors='ignore'))
+                print(self.backend.logs(container, tail=50))
             except Exception:
                 pass
+            self._release_cpus(container_name)
             try:
-                container.stop(timeout=1)
-                container.remove(force=True)
+                self.backend.remove(container)
             except Exception as e:
                 print("cleanup error:", e)
             return None
 
         # 健康检查
-        if not self._wait_for_container_service(host_port, timeout=30, check_interval=0.1):
-            print(f"Service for newly created container {container.id[:12]} on port {host_port} not ready, removing it.")
+        if not self._wait_for_container_service(container, endpoint, timeout=30, check_interval=0.1):
+            print(f"Service for newly created container {container.id[:12]} on {endpoint} not ready, removing it.")
             try:
                 print("Container logs (tail 80):")
-                print(container.logs(tail=80).decode(errors='ignore'))
+                print(self.backend.logs(container, tail=80))
             except Exception:
                 pass
+            self._release_cpus(container_name)
             try:
-                container.stop(timeout=1)
-                container.remove(force=True)
+                self.backend.remove(container)
             except Exception as e:
                 print("Error cleaning up failed new container:", e)
             return None
+        startup["ready_s"] = time.time() - create_start # 冷启动各阶段的累计耗时，可对比 docker 与 local 后端
 
         with self.lock:
-            self.containers[container.id] = {
-                "container_obj": container,
-                "status": "idle",
-                "last_active": time.time(),
-                "host_port": host_port
-            }
-        print(f"Container '{container_name}' created id={container.id[:12]} host_port={host_port}. Service ready.")
+            stopped = self._cleaner_stop_event.is_set()
+            if not stopped:
+                self.containers[container.id] = {
+                    "container_obj": container,
+                    "status": "idle",
+                    "inflight": 0,
+                    "last_active": time.time(),
+                    "endpoint": endpoint,
+                    "cpus": cpu_kwargs.get("cpuset_cpus"),
+                    "mems": cpu_kwargs.get("cpuset_mems"),
+                    "startup": startup
+                }
+                self.idle_changed.notify_all()
+        if stopped:
+            # stop_all_containers 已经执行 (例如预热还没完成就拆除环境)，不再登记，直接删除
+            print(f"Manager for {self.function_name} stopped while creating {container_name}, removing it.")
+            self._remove_container(container.id, container)
+            return None
+        print(f"Container '{container_name}' created id={container.id[:12]} endpoint={endpoint}. Service ready.")
         return container.id
 
 
-    def get_container_for_request(self):
+    def get_container_for_request(self, create=True):
+        # create=False: 只使用已有的暖容器，没有余量时返回 (None, None) 而不是冷启动 (用于投机执行等可选工作)
         with self.lock:
-            # 寻找空闲容器
-            for container_id, data in self.containers.items():
-                if data["status"] == "idle" and data["container_obj"].status == 'running':
-                    data["status"] = "busy"
-                    data["last_active"] = time.time()
-                    print(f"Assigned existing idle container {container_id[:12]} for {self.function_name}.")
-                    return data["host_port"], container_id
-
-        # 如果没有空闲容器，则创建一个新容器
-        new_container_id = self._create_new_container()
+            # 寻找还有并发余量的容器；max_concurrency > 1 时优先填满已在处理请求的容器，让请求能被合并成批
+            candidates = [
+                (container_id, data) for container_id, data in self.containers.items()
+                if data["inflight"] < self.max_concurrency and self.backend.is_running(data["container_obj"])
+            ]
+            deadline = time.time() + self.acquire_timeout
+            while not candidates and create and not self._reserve_slot():
+                # 已达容器数上限: 等待请求结束或容器被删除后重新查找，最多等到 deadline
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    print(f"No container freed up for {self.function_name} within {self.acquire_timeout}s "
+                          f"(max_containers={self.max_containers}).")
+                    return None, None
+                self.idle_changed.wait(timeout=min(1, remaining))
+                candidates = [
+                    (container_id, data) for container_id, data in self.containers.items()
+                    if data["inflight"] < self.max_concurrency and self.backend.is_running(data["container_obj"])
+                ]
+            if candidates:
+                if self.placement:
+                    # 绑定了 CPU 时先选兄弟线程上正在运行的冲突容器最少的，再按 inflight 填满
+                    placer = cpu_topology.get_placer()
+                    container_id, data = min(candidates, key=lambda item: (
+                        placer.contention(item[1]["container_obj"].name), -item[1]["inflight"]))
+                    placer.set_active(data["container_obj"].name, 1)
+                else:
+                    container_id, data = max(candidates, key=lambda item: item[1]["inflight"])
+                data["inflight"] += 1
+                data["status"] = "busy"
+                data["last_active"] = time.time()
+                print(f"Assigned existing container {container_id[:12]} for {self.function_name} (inflight={data['inflight']}).")
+                return data["endpoint"], container_id
+
+        if not create:
+            return None, None
+
+        # 如果没有空闲容器，则创建一个新容器 (名额已由 _reserve_slot 预留)
+        try:
+            new_container_id = self._create_new_container()
+        finally:
+            self._release_slot()
         if new_container_id:
             with self.lock:
                 # 确保新创建的容器也设置为busy并返回其端口
                 container_data = self.containers[new_container_id]
                 container_data["status"] = "busy" # 新创建的容器直接用于请求，所以是busy
+                container_data["inflight"] += 1
                 container_data["last_active"] = time.time()
+                if self.placement:
+                    cpu_topology.get_placer().set_active(container_data["container_obj"].name, 1)
                 print(f"Assigned newly created container {new_container_id[:12]} for {self.function_name}.")
-                return container_data["host_port"], new_container_id
+                return container_data["endpoint"], new_container_id
         return None, None
 
+    def _reserve_slot(self):
+        # 调用方持有 self.lock。为一个将要创建的容器预留名额，已达 max_containers 时返回 False
+        if self.max_containers is not None and len(self.containers) + self.creating >= self.max_containers:
+            return False
+        self.creating += 1
+        return True
+
+    def _release_slot(self):
+        # 创建结束 (成功时容器已登记在 self.containers 中)
+        with self.lock:
+            self.creating -= 1
+            self.idle_changed.notify_all()
+
+    def max_parallelism(self):
+        """池最多能同时执行的请求数 (max_containers * max_concurrency)；不限制容器数时返回 None。"""
+        if self.max_containers is None:
+            return None
+        return self.max_containers * self.max_concurrency
+
+    def count_idle(self, running_only=True):
+        # 调用方可能已经持有 self.lock，这里不加锁，只做一次只读遍历
+        return sum(
+            1 for data in list(self.containers.values())
+            if data["status"] == "idle" and (not running_only or self.backend.is_running(data["container_obj"]))
+        )
+
+    def wait_until_warm(self, timeout=60):
+        """阻塞直到空闲的运行中容器数达到 min_idle_containers；超时或 manager 已停止时返回 False。"""
+        deadline = time.time() + timeout
+        with self.idle_changed:
+            while self.count_idle() < self.min_idle_containers:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._cleaner_stop_event.is_set():
+                    return False
+                self.idle_changed.wait(remaining)
+            return True
+
     def release_container(self, container_id):
         with self.lock:
             if container_id in self.containers:
-                self.containers[container_id]["status"] = "idle"
-                self.containers[container_id]["last_active"] = time.time()
-                print(f"Container {container_id[:12]} for {self.function_name} released and set to idle.")
+                data = self.containers[container_id]
+                data["inflight"] = max(0, data["inflight"] - 1)
+                if self.placement:
+                    cpu_topology.get_placer().set_active(data["container_obj"].name, -1)
+                data["last_active"] = time.time()
+                if data["inflight"] == 0:
+                    data["status"] = "idle"
+                    self.idle_changed.notify_all()
+                    print(f"Container {container_id[:12]} for {self.function_name} released and set to idle.")
+
+    def abort(self, container_id, still_running=lambda: True):
+        """
+        中止容器上正在执行的唯一一个请求 (proxy 无法中途取消 main): 从登记表中移除并删除容器，由预热补充新的。
+        still_running() 在锁内调用，请求已经结束 (容器可能已分给别的请求) 时返回 False，此时不删除。
+        容器同时处理多个请求 (max_concurrency > 1) 时也不删除。返回是否删除了容器。
+        删除在后台线程中进行 (正在执行的 main 结束前进程可能不响应 SIGTERM，要等到强制结束)，调用方不必等待。
+        """
+        with self.lock:
+            data = self.containers.get(container_id)
+            if data is None or data["inflight"] != 1 or not still_running():
+                return False
+            del self.containers[container_id]
+        print(f"Aborting container {container_id[:12]} for {self.function_name}.")
+        threading.Thread(target=self._remove_container, args=(container_id, data["container_obj"]), daemon=True).start()
+        return True
+
+    def _reserve_idle(self, container_id):
+        # 占用一个空闲容器 (不分配给请求)；它已经在处理请求或已被删除时返回 None
+        with self.lock:
+            data = self.containers.get(container_id)
+            if data is None or data["inflight"] > 0 or not self.backend.is_running(data["container_obj"]):
+                return None
+            data["inflight"] += 1
+            data["status"] = "busy"
+            if self.placement:
+                cpu_topology.get_placer().set_active(data["container_obj"].name, 1)
+            return data["endpoint"]
+
+    def rollout(self, init):
+        """
+        在后台把新代码推到当前空闲的容器: 逐个占用 -> init(endpoint) -> 释放，其余容器照常服务。
+        正在处理请求的容器不打断，旧版本的请求正常结束，下一次调度时的 /init 再换到新版本。
+        """
+        def run():
+            with self.lock:
+                container_ids = [cid for cid, data in self.containers.items() if data["inflight"] == 0]
+            updated = 0
+            for container_id in container_ids:
+                endpoint = self._reserve_idle(container_id)
+                if endpoint is None:
+                    continue
+                try:
+                    init(endpoint)
+                    updated += 1
+                except Exception as e:
+                    print(f"[Rollout] Error updating container {container_id[:12]} for {self.function_name}: {e}")
+                finally:
+                    self.release_container(container_id)
+            print(f"[Rollout] Updated {updated}/{len(container_ids)} idle containers for {self.function_name}.")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _release_cpus(self, container_name):
+        if self.placement:
+            cpu_topology.get_placer().release(container_name)
 
     def _remove_container(self, container_id, container_obj):
+        self._release_cpus(container_obj.name)
         try:
             print(f"Stopping and removing container {container_id[:12]} (name: {container_obj.name}) for {self.function_name}...")
-            # 尝试停止容器，给定一个短的超时
-            container_obj.stop(timeout=5)
-            # 强制删除容器，即使它仍在运行或停止失败
-            container_obj.remove(force=True)
+            # 停止并删除容器 (已经不存在时后端静默返回)
+            self.backend.remove(container_obj)
             with self.lock:
                 if container_id in self.containers:
                     del self.containers[container_id]
+                self.idle_changed.notify_all() # 有 max_containers 时空出了名额
             print(f"Container {container_id[:12]} removed.")
-        except docker.errors.NotFound:
-            print(f"Container {container_id[:12]} not found, likely already removed.")
-            with self.lock:
-                if container_id in self.containers:
-                    del self.containers[container_id]
         except Exception as e:
             print(f"Error removing container {container_id[:12]}: {e}. Forcing internal cleanup.")
             # 即使移除失败，也要尝试从 internal 列表中删除，避免重复尝试
@@ -193,7 +475,41 @@ class FunctionManager:
                 if container_id in self.containers:
                     del self.containers[container_id]
 
+    def _prewarm(self):
+        """把空闲容器补足到 min_idle_containers，缺的容器并行创建 (每个创建完成后由 _create_new_container 登记)。"""
+        with self.lock:
+            to_create = self.min_idle_containers - self.count_idle()
+            reserved = 0
+            while reserved < to_create and self._reserve_slot():
+                reserved += 1
+        if reserved < to_create:
+            print(f"[Cleaner] {self.function_name} is at max_containers={self.max_containers}, pre-warming {reserved} of {to_create}.")
+            to_create = reserved
+        if to_create <= 0:
+            return 0
+        print(f"Need to create {to_create} new idle containers for pre-warming.")
+
+        def create(_):
+            try:
+                return self._create_new_container()
+            finally:
+                self._release_slot()
+
+        with ThreadPoolExecutor(max_workers=min(to_create, PREWARM_PARALLELISM)) as pool:
+            new_ids = list(pool.map(create, range(to_create)))
+        created = sum(1 for new_id in new_ids if new_id)
+        if created < to_create:
+            print(f"[Cleaner] Failed to create {to_create - created} pre-warm containers for {self.function_name} (check logs).")
+        if created:
+            print(f"[Cleaner] Created {created} pre-warm containers for {self.function_name}.")
+        return created
+
     def _run_cleaner(self):
+        # 注册后立即预热，不等 cleaner 的第一个周期
+        try:
+            self._prewarm()
+        except Exception as e:
+            print(f"[Cleaner] Exception while pre-warming {self.function_name}: {e}")
         while not self._cleaner_stop_event.is_set():
             # 使用 wait，使线程可被快速唤醒停止
             self._cleaner_stop_event.wait(timeout=30)
@@ -209,11 +525,8 @@ class FunctionManager:
                 idle_running = []
                 for cid, data in list(self.containers.items()):
                     # 刷新 container 状态 (非阻塞式)
-                    try:
-                        data["container_obj"].reload()
-                    except Exception:
-                        pass
-                    if data["status"] == "idle" and data["container_obj"].status == 'running':
+                    self.backend.refresh(data["container_obj"])
+                    if data["status"] == "idle" and self.backend.is_running(data["container_obj"]):
                         idle_running.append((cid, data))
                 idle_running.sort(key=lambda item: item[1]["last_active"])
 
@@ -237,37 +550,11 @@ class FunctionManager:
                 except Exception as e:
                     print(f"[Cleaner] Error removing {container_id[:12]}: {e}")
 
-            # 3) 检查是否需要预热新容器；计算需要创建的数量（在锁内做最小工作）
-            to_create = 0
-            with self.lock:
-                current_idle_count = sum(
-                    1 for data in self.containers.values()
-                    if data["status"] == "idle" and data["container_obj"].status == 'running'
-                )
-                if current_idle_count < self.min_idle_containers:
-                    to_create = self.min_idle_containers - current_idle_count
-                    print(f"Need to create {to_create} new idle containers for pre-warming.")
-
-            # 4) 在锁外循环创建新的预热容器（避免死锁），每次创建后依赖 _create_new_container 自己把容器加入 self.containers
-            created = 0
-            for _ in range(to_create):
-                try:
-                    new_id = self._create_new_container()
-                    if new_id:
-                        created += 1
-                        print(f"[Cleaner] Pre-warmed container {new_id[:12]} created.")
-                    else:
-                        print("[Cleaner] Failed to create pre-warm container (check logs).")
-                    # 小睡以防速率过高并给 docker 一点缓冲
-                    time.sleep(0.5)
-                except Exception as e:
-                    print(f"[Cleaner] Exception while creating pre-warm container: {e}")
-                    # 如果创建失败，继续尝试下一个（或根据策略 break）
-                    continue
-
-            # （可选）再次检查、限制创建数量或记录指标
-            if created:
-                print(f"[Cleaner] Created {created} pre-warm containers for {self.function_name}.")
+            # 3) 补足预热容器
+            try:
+                self._prewarm()
+            except Exception as e:
+                print(f"[Cleaner] Exception while creating pre-warm containers: {e}")
 
     def stop_all_containers(self):
         # 立即设置停止事件，并尝试等待 cleaner 线程短时间，但不要无限等待
@@ -280,7 +567,34 @@ class FunctionManager:
             # 复制一份，因为在迭代时可能会修改 self.containers
             containers_to_stop = list(self.containers.items()) 
             self.containers.clear() # 清空内部记录，避免再次操作
+            self.idle_changed.notify_all() # 唤醒 wait_until_warm
 
-        for container_id, data in containers_to_stop:
-            self._remove_container(container_id, data["container_obj"])
-        print(f"All containers for {self.function_name} stopped and removed.")
\ No newline at end of file
+        # 并行删除: 每个容器的 stop/remove 主要是等待 Docker，逐个删除时总时间随容器数线性增长。
+        # 用普通线程而不是 ThreadPoolExecutor: controller 的 atexit 清理时解释器已在关闭，executor 不再接受任务
+        slots = threading.Semaphore(STOP_PARALLELISM)
+
+        def remove(container_id, container_obj):
+            with slots:
+                self._remove_container(container_id, container_obj)
+
+        threads = [threading.Thread(target=remove, args=(container_id, data["container_obj"]))
+                   for container_id, data in containers_to_stop]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"All containers for {self.function_name} stopped and removed.")
+
+    def detach(self):
+        """
+        停止 cleaner，但让容器继续运行 (controller 退出时保留容器，下次启动由 adopt_containers 接管)。
+        不支持接管的后端 (local) 照常删除容器。
+        """
+        if not self.backend.persistent:
+            self.stop_all_containers()
+            return
+        self._cleaner_stop_event.set()
+        with self.lock:
+            count = len(self.containers)
+            self.containers.clear()
+        print(f"Left {count} containers for {self.function_name} running.")
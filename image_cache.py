@@ -0,0 +1,68 @@
+# image_cache.py
+# recognizer 工作流的解码缓存 (复制到 /proxy/，action 通过 import image_cache 使用)。
+# recognizer_upload 把源图片解码一次，生成下游需要的派生数组并按内容 sha256 存到共享存储:
+#   rgb    - 完整分辨率的 RGB uint8 (mosaic 使用)
+#   cls224 - 224x224 的 float32 分类器输入 (adult / violence / classify 使用)，与 model_server.load_input 完全一致
+#   gray   - 灰度 uint8 (extract 的 OCR 输入)
+# 下游 action 用 mmap 只读加载 .npy，不再各自解码；缓存缺失或损坏时返回 None，由 action 回退到自己解码。
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_ROOT = '/storage/cache/images'
+ARTIFACTS = ('rgb', 'cls224', 'gray')
+CLS_SIZE = (224, 224) # 与 model_server.SIZE 相同
+
+
+def content_key(image_path):
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path) # 原子替换，并发的 upload 不会让下游读到半个文件
+
+
+def build(image_path, cache_root=None):
+    """解码一次并写出全部派生数组；同一内容已缓存时直接返回。返回 {"key": ..., "<artifact>": path, ...}。"""
+    from PIL import Image, ImageOps
+
+    key = content_key(image_path)
+    cache_dir = os.path.join(cache_root or CACHE_ROOT, key) # 调用时读取 CACHE_ROOT (内联执行时会重映射到宿主机路径)
+    paths = {name: os.path.join(cache_dir, name + '.npy') for name in ARTIFACTS}
+    if all(os.path.exists(path) for path in paths.values()):
+        return dict(paths, key=key)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with Image.open(image_path) as img:
+        img.load()
+        # 分类器输入保持与 keras load_img 相同 (不做 EXIF 旋转，RGB + 最近邻缩放)
+        rgb_img = img if img.mode == 'RGB' else img.convert('RGB')
+        cls224 = np.asarray(rgb_img.resize((CLS_SIZE[1], CLS_SIZE[0]), Image.NEAREST), dtype=np.float32)
+        # cv2.imread 会按 EXIF 方向旋转，rgb / gray 与之保持一致
+        rgb = np.asarray(ImageOps.exif_transpose(rgb_img))
+
+    import cv2
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+    _save(paths['rgb'], rgb)
+    _save(paths['cls224'], cls224)
+    _save(paths['gray'], gray)
+    return dict(paths, key=key)
+
+
+def load(image_cache, name):
+    """按 image_cache (upload 的返回) 以只读 mmap 加载一个派生数组；没有缓存时返回 None。"""
+    if not image_cache or not image_cache.get(name):
+        return None
+    try:
+        return np.load(image_cache[name], mmap_mode='r')
+    except (OSError, ValueError) as e:
+        print(f"image_cache: could not load '{name}' from {image_cache[name]}: {e}")
+        return None
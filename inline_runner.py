@@ -0,0 +1,184 @@
+# inline_runner.py
+# 受信任函数的内联快速路径。
+# 有些 action 非常简单 (例如不开 decode_cache 时的 recognizer_upload 只是拼出 /storage/sources/<name> 并检查文件存在)，
+# 却要占一个预热容器并走完 取容器 -> /init -> /run 的往返。create_manager 时指定 "inline": true 的函数
+# 由 InlineManager 在 controller 自己的工作进程池里执行 main，不经过 Docker、HTTP 和容器槽位:
+#   - 工作进程用 spawn 启动，和 controller 的线程隔离；启动时设置 rlimit (地址空间、写文件大小、core)，
+#     每次调用有超时，超时或进程崩溃时整个池被重建；
+#   - action 代码与 proxy 中一样从 actions/<fn>/main.py 加载并在进程内常驻；
+#   - 存储路径重映射: 模块级的 /storage 路径常量 (action 以及 image_cache 等辅助模块) 和输入中的 /storage/...
+#     路径映射到 manager 的 host_storage_path，结果中的宿主机路径再映射回 /storage/...，
+#     所以下游容器看到的结果与容器内执行完全相同。
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ACTIONS_DIR = os.path.join(BASE_DIR, "actions")
+CONTAINER_STORAGE_DIR = "/storage"
+HELPER_MODULES = ('image_cache',) # 容器里位于 /proxy/ 的辅助模块，内联执行时从仓库根目录导入
+
+INLINE_WORKERS = 2
+INLINE_TIMEOUT = 30 # 秒
+INLINE_MEMORY_MB = 1024 # 工作进程的地址空间上限；0 表示不限制 (RLIMIT_AS 按虚拟内存计，numpy/PIL 解码等会超出)
+INLINE_FILE_MB = 512 # 工作进程单个文件的写入上限
+
+_host_storage = None
+_contexts = {}
+
+
+def _to_host(value):
+    if isinstance(value, str) and _host_storage and \
+            (value == CONTAINER_STORAGE_DIR or value.startswith(CONTAINER_STORAGE_DIR + '/')):
+        return _host_storage + value[len(CONTAINER_STORAGE_DIR):]
+    if isinstance(value, dict):
+        return {k: _to_host(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_host(v) for v in value]
+    return value
+
+
+def _to_container(value):
+    if isinstance(value, str) and _host_storage and \
+            (value == _host_storage or value.startswith(_host_storage + '/')):
+        return CONTAINER_STORAGE_DIR + value[len(_host_storage):]
+    if isinstance(value, dict):
+        return {k: _to_container(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_container(v) for v in value]
+    return value
+
+
+def _remap_globals(namespace):
+    for key, value in list(namespace.items()):
+        if isinstance(value, str) and not key.startswith('__'):
+            namespace[key] = _to_host(value)
+
+
+def _init_worker(host_storage_path, memory_mb, file_mb):
+    global _host_storage
+    _host_storage = os.path.abspath(host_storage_path) if host_storage_path else None
+    try:
+        import resource
+        if memory_mb:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_mb << 20, memory_mb << 20))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (file_mb << 20, file_mb << 20))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Warning: inline worker rlimits not applied: {e}")
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    for name in HELPER_MODULES:
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        _remap_globals(module.__dict__)
+
+
+def _load(action):
+    context = _contexts.get(action)
+    if context is None:
+        filename = os.path.join(ACTIONS_DIR, action, 'main.py')
+        with open(filename, 'r') as f:
+            code = compile(f.read(), filename, mode='exec')
+        context = {'__file__': filename}
+        exec(code, context)
+        _remap_globals(context)
+        _contexts[action] = context
+    return context
+
+
+def _run(action, payload):
+    # 在工作进程中执行: 返回 (结果, 执行秒数)，与 proxy /run 的 result / duration 对应
+    context = _load(action)
+    start = time.time()
+    try:
+        out = eval('main(data)', context, {'data': _to_host(payload)})
+    except Exception as e:
+        # 错误信息里也使用容器内路径
+        if _host_storage:
+            e.args = tuple(arg.replace(_host_storage, CONTAINER_STORAGE_DIR) if isinstance(arg, str) else arg for arg in e.args)
+        raise
+    return _to_container(out), time.time() - start
+
+
+class InlineManager:
+    """
+    与 FunctionManager 对外接口相同的部分 (function_name / host_storage_path / placement / containers / lock /
+    count_idle / max_parallelism / wait_until_warm / stop_all_containers)，controller 可以同样登记和查看；调用走 run() 而不是容器。
+    """
+    def __init__(self, function_name, host_storage_path=None, workers=INLINE_WORKERS, timeout=INLINE_TIMEOUT,
+                 memory_mb=INLINE_MEMORY_MB):
+        if not os.path.isfile(os.path.join(ACTIONS_DIR, function_name, 'main.py')):
+            raise ValueError(f"Unknown action for inline execution: {function_name}")
+        self.function_name = function_name
+        self.host_storage_path = host_storage_path
+        self.placement = None
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.executor = None
+        self._start_pool()
+        print(f"InlineManager for {self.function_name} initialized ({self.workers} workers).")
+
+    def _start_pool(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(self.host_storage_path, self.memory_mb, INLINE_FILE_MB))
+        # 预热: 每个工作进程先加载一次 action (相当于容器的 /init)
+        for _ in range(self.workers):
+            self.executor.submit(_load, self.function_name)
+
+    def _reset_pool(self):
+        # 超时或进程崩溃: 杀掉旧池的工作进程并重建 (ProcessPoolExecutor 没有公开的终止接口)
+        with self.lock:
+            executor, self.executor = self.executor, None
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.kill()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._start_pool()
+
+    def run(self, payload):
+        """执行一次 main，返回 (结果, 容器内等价的执行秒数)；超时或工作进程崩溃时抛出异常。"""
+        with self.lock:
+            future = self.executor.submit(_run, self.function_name, payload)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._reset_pool()
+            raise TimeoutError(f"inline {self.function_name} exceeded {self.timeout}s")
+        except BrokenProcessPool as e:
+            self._reset_pool()
+            raise RuntimeError(f"inline worker for {self.function_name} crashed: {e}")
+
+    def reload(self):
+        """代码更新后换一个新的工作进程池 (从 actions/<fn>/ 重新加载)；已提交的调用在旧池里执行完，旧池随后退出。"""
+        with self.lock:
+            executor = self.executor
+            self._start_pool()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def max_parallelism(self):
+        return self.workers
+
+    def count_idle(self, running_only=True):
+        return self.workers
+
+    def wait_until_warm(self, timeout=60):
+        # 工作进程池在构造时已经启动并预加载了 action
+        return self.executor is not None
+
+    def stop_all_containers(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+        print(f"Inline workers for {self.function_name} stopped.")
@@ -0,0 +1,284 @@
+# interference.py
+# 基于硬件计数器的干扰感知调度。
+# controller 的 _dispatch_request 对每次调用都用 perf stat 采集计数器 (storage/perf_logs/<fn>_<cid>_<时间>_<随机>.txt)，
+# 这里解析这些日志，按最近的计数器画像把函数分为:
+#   memory   - 内存带宽/延迟受限 (L3 miss 多、L3 miss 停顿占比高)，例如 matmul / svd_compute
+#   frontend - 前端受限 (uop 供给不足)
+#   io       - I/O 受限 (CPU 利用率低，大部分时间在等待)
+#   compute  - 其余 CPU 受限的函数
+# 再用冲突矩阵给 "某类函数落在与另一类函数共享物理核的兄弟线程上" 打分，
+# cpu_topology 的 interference_aware 放置策略和 FunctionManager 的容器选择都以这个分数最小为目标。
+# 离线评估: python3 interference.py replay storage/perf_logs
+import os
+import re
+import threading
+from collections import deque
+
+# perf stat 采集的事件 (与 compete_ht.sh / compete_iso.sh 相同)；controller 和 colocation_experiment.py 共用
+PERF_EVENTS = (
+    'cycles,instructions,cache-misses,cycle_activity.stalls_total,'
+    'idq_uops_not_delivered.core,cpu-clock,mem_load_retired.l3_hit,'
+    'mem_load_retired.l3_miss,cycle_activity.stalls_l3_miss,'
+    'memory_activity.stalls_l2_miss,mem_load_retired.l1_miss,'
+    'mem_load_retired.l2_miss,mem_inst_retired.stlb_miss_loads,'
+    'mem_load_l3_miss_retired.local_dram,mem_load_l3_hit_retired.xsnp_fwd'
+)
+
+CLASSES = ('compute', 'memory', 'frontend', 'io', 'unknown')
+PROFILE_HISTORY = 20 # 每个函数保留的最近画像数
+PERF_LOG_KEEP = 100 # 每个函数在 perf 日志目录里保留的最近日志数 (多于 PROFILE_HISTORY，留给离线 replay)
+
+# 分类阈值
+IO_UTILIZATION = 0.3 # CPU 利用率 (cpu-clock / 墙钟时间) 低于该值视为 I/O 受限
+MEMORY_STALL_FRACTION = 0.2 # cycle_activity.stalls_l3_miss / cycles
+MEMORY_L3_MPKI = 5.0 # 每千条指令的 L3 miss
+FRONTEND_FRACTION = 0.3 # idq_uops_not_delivered.core / (4 * cycles)
+ISSUE_WIDTH = 4
+
+# 两个类别的函数落在同一物理核的兄弟线程上时的冲突代价 (对称)
+CONFLICT = {
+    ('memory', 'memory'): 3.0,
+    ('compute', 'compute'): 2.0,
+    ('frontend', 'frontend'): 2.0,
+    ('compute', 'memory'): 1.0,
+    ('frontend', 'memory'): 1.0,
+    ('compute', 'frontend'): 1.0,
+}
+UNKNOWN_CONFLICT = 1.0 # 没有画像的函数按中等代价处理
+
+_COUNTER_LINE = re.compile(r'^\s*([\d,\.]+)\s+(?:msec\s+)?([\w\.\-:/]+)')
+_ELAPSED_LINE = re.compile(r'^\s*([\d\.]+)\s+seconds time elapsed')
+_CPU_COUNTER_LINE = re.compile(r'^\s*CPU(\d+)\s+([\d,\.]+)\s+(?:msec\s+)?([\w\.\-:/]+)') # perf stat -A (不聚合) 的行
+
+
+def conflict(cls_a, cls_b):
+    if 'io' in (cls_a, cls_b):
+        return 0.0
+    if 'unknown' in (cls_a, cls_b):
+        return UNKNOWN_CONFLICT
+    return CONFLICT.get(tuple(sorted((cls_a, cls_b))), 0.0)
+
+
+def parse_perf_log(path):
+    """解析一份 perf stat 输出，返回 {event: value}；cpu-clock 以毫秒计，另有 elapsed_ms。<not counted> 的事件被跳过。"""
+    counters = {}
+    try:
+        with open(path, errors='ignore') as f:
+            lines = f.readlines()
+    except OSError:
+        return counters
+    for line in lines:
+        match = _ELAPSED_LINE.match(line)
+        if match:
+            counters['elapsed_ms'] = float(match.group(1)) * 1000.0
+            continue
+        match = _COUNTER_LINE.match(line)
+        if match:
+            try:
+                counters[match.group(2)] = float(match.group(1).replace(',', ''))
+            except ValueError:
+                continue
+    return counters
+
+
+def parse_perf_log_per_cpu(path):
+    """解析 perf stat -A 的输出，返回 {cpu: {event: value}}；每个 cpu 都带上同一个 elapsed_ms。"""
+    per_cpu = {}
+    elapsed_ms = None
+    try:
+        with open(path, errors='ignore') as f:
+            lines = f.readlines()
+    except OSError:
+        return per_cpu
+    for line in lines:
+        match = _ELAPSED_LINE.match(line)
+        if match:
+            elapsed_ms = float(match.group(1)) * 1000.0
+            continue
+        match = _CPU_COUNTER_LINE.match(line)
+        if match:
+            try:
+                per_cpu.setdefault(int(match.group(1)), {})[match.group(3)] = float(match.group(2).replace(',', ''))
+            except ValueError:
+                continue
+    if elapsed_ms is not None:
+        for counters in per_cpu.values():
+            counters['elapsed_ms'] = elapsed_ms
+    return per_cpu
+
+
+def features(counters):
+    """从计数器得到与机器规模无关的比例特征；计数器缺失时对应特征为 None。"""
+    def ratio(num, den, scale=1.0):
+        if counters.get(num) is None or not counters.get(den):
+            return None
+        return counters[num] * scale / counters[den]
+
+    frontend = ratio('idq_uops_not_delivered.core', 'cycles')
+    return {
+        "ipc": ratio('instructions', 'cycles'),
+        "utilization": ratio('cpu-clock', 'elapsed_ms'),
+        "l3_mpki": ratio('mem_load_retired.l3_miss', 'instructions', 1000.0),
+        "l3_stall_fraction": ratio('cycle_activity.stalls_l3_miss', 'cycles'),
+        "frontend_fraction": frontend / ISSUE_WIDTH if frontend is not None else None,
+    }
+
+
+def classify(feature):
+    if not feature or feature.get("ipc") is None:
+        return 'unknown'
+    if feature.get("utilization") is not None and feature["utilization"] < IO_UTILIZATION:
+        return 'io'
+    if (feature.get("l3_stall_fraction") or 0) >= MEMORY_STALL_FRACTION or (feature.get("l3_mpki") or 0) >= MEMORY_L3_MPKI:
+        return 'memory'
+    if (feature.get("frontend_fraction") or 0) >= FRONTEND_FRACTION:
+        return 'frontend'
+    return 'compute'
+
+
+def _mean_feature(samples):
+    merged = {}
+    for key in ("ipc", "utilization", "l3_mpki", "l3_stall_fraction", "frontend_fraction"):
+        values = [s[key] for s in samples if s.get(key) is not None]
+        merged[key] = (sum(values) / len(values)) if values else None
+    return merged
+
+
+class InterferenceScheduler:
+    """按函数保存最近的计数器画像并给出类别；线程安全。"""
+    def __init__(self):
+        self.profiles = {} # {function_name: deque([feature, ...])}
+        self.lock = threading.Lock()
+
+    def record(self, function_name, counters):
+        feature = features(counters)
+        if feature["ipc"] is None:
+            return None # perf 没有采到数据 (例如没有权限)
+        with self.lock:
+            self.profiles.setdefault(function_name, deque(maxlen=PROFILE_HISTORY)).append(feature)
+        return feature
+
+    def load_dir(self, perf_dir):
+        """
+        回放目录里的 perf 日志 (每次调用一个，见 function_from_log_name)，返回读入的日志数。
+        每个函数只解析最新的 PROFILE_HISTORY 个 (更早的反正会被挤出画像)，按时间顺序读入。
+        """
+        loaded = 0
+        for function_name, paths in logs_by_function(perf_dir).items():
+            for path in paths[-PROFILE_HISTORY:]:
+                if self.record(function_name, parse_perf_log(path)):
+                    loaded += 1
+        return loaded
+
+    def profile(self, function_name):
+        with self.lock:
+            samples = list(self.profiles.get(function_name, ()))
+        return _mean_feature(samples) if samples else None
+
+    def function_class(self, function_name):
+        return classify(self.profile(function_name))
+
+    def snapshot(self):
+        with self.lock:
+            names = list(self.profiles)
+        return {name: {"class": self.function_class(name), "samples": len(self.profiles[name]),
+                       "profile": self.profile(name)} for name in names}
+
+
+def function_from_log_name(filename):
+    # 日志名为 <function_name>_<container_id[:12]>_<YYYYmmddHHMMSS>_<6 位十六进制>.txt；
+    # 旧版本的 <function_name>_<container_id[:12]>.txt 也接受。local 后端的容器 id 以 "local" 开头
+    match = re.match(r'^(.+)_[0-9a-z]{12}(?:_\d{14}_[0-9a-f]{6})?\.txt$', filename)
+    return match.group(1) if match else None
+
+
+def logs_by_function(perf_dir, function_name=None):
+    """{函数名: [日志路径, ...]}，每个函数的日志按修改时间从旧到新排列；只要 function_name 的日志时先按文件名前缀过滤。"""
+    logs = {}
+    if not os.path.isdir(perf_dir):
+        return logs
+    prefix = f"{function_name}_" if function_name else ''
+    for filename in os.listdir(perf_dir):
+        if not filename.startswith(prefix):
+            continue
+        name = function_from_log_name(filename)
+        if name and (function_name is None or name == function_name):
+            path = os.path.join(perf_dir, filename)
+            try:
+                logs.setdefault(name, []).append((os.path.getmtime(path), path))
+            except OSError:
+                continue # 并发清理时已被删除
+    return {name: [path for _, path in sorted(entries)] for name, entries in logs.items()}
+
+
+def prune_logs(perf_dir, function_name=None, keep=PERF_LOG_KEEP):
+    """删除每个函数 (或只是 function_name) 最新 keep 个之外的 perf 日志，返回删除的数量。"""
+    removed = 0
+    for paths in logs_by_function(perf_dir, function_name).values():
+        for path in paths[:-keep] if keep > 0 else paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InterferenceScheduler()
+        return _scheduler
+
+
+def replay(perf_dir, containers_per_function=2, topology=None):
+    """
+    离线评估: 用 perf 日志给函数分类，然后把每个函数 containers_per_function 个容器依次放到本机拓扑上，
+    比较不考虑干扰的放置 (smt_shared) 与 interference_aware 放置的总冲突代价 (兄弟线程上每对容器的冲突之和)。
+    """
+    import cpu_topology
+    scheduler = InterferenceScheduler()
+    loaded = scheduler.load_dir(perf_dir)
+    classes = {name: info["class"] for name, info in scheduler.snapshot().items()}
+
+    results = {"logs": loaded, "functions": scheduler.snapshot(), "placements": {}}
+    for policy in ("smt_shared", "interference_aware"):
+        placer = cpu_topology.CpuPlacer(topology)
+        placed = 0
+        for i in range(containers_per_function):
+            for name, cls in sorted(classes.items()):
+                if placer.allocate(f"{name}-{i}", {"policy": policy, "cpus": 1, "class": cls}):
+                    placed += 1
+        results["placements"][policy] = {"containers": placed, "conflict_cost": placer.conflict_cost()}
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["replay", "parse"])
+    parser.add_argument("path", help="perf 日志目录 (replay) 或单个日志文件 (parse)")
+    parser.add_argument("--containers", type=int, default=2, help="replay 时每个函数放置的容器数")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        counters = parse_perf_log(args.path)
+        feature = features(counters)
+        print(json.dumps({"counters": counters, "features": feature, "class": classify(feature)}, indent=2))
+    else:
+        result = replay(args.path, args.containers)
+        print(f"{result['logs']} perf logs replayed")
+        print(f"{'function':<24} {'class':<9} {'samples':>7} {'ipc':>6} {'util':>6} {'l3mpki':>7} {'l3stall':>8} {'fe':>6}")
+        for name, info in sorted(result["functions"].items()):
+            p = info["profile"] or {}
+            fmt = lambda v: f"{v:.2f}" if v is not None else "-"
+            print(f"{name:<24} {info['class']:<9} {info['samples']:>7} {fmt(p.get('ipc')):>6} {fmt(p.get('utilization')):>6} "
+                  f"{fmt(p.get('l3_mpki')):>7} {fmt(p.get('l3_stall_fraction')):>8} {fmt(p.get('frontend_fraction')):>6}")
+        for policy, placement in result["placements"].items():
+            print(f"{policy:<20} containers={placement['containers']} sibling conflict cost={placement['conflict_cost']:.1f}")
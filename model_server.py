@@ -0,0 +1,179 @@
+# model_server.py
+# 容器内共享的分类模型层 (复制到 /proxy/，action 通过 import model_server 使用)。
+# 作为真正的 Python 模块导入，因此模型和批处理线程在同一个 proxy 进程内跨 /init、跨请求常驻，
+# recognizer_adult / recognizer_violence / recognizer_classify 共享同一份。
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from model_store import MODEL_FILES # 模型名 -> .h5 文件名，只在 model_store 中定义
+
+MODEL_DIR = '/proxy'
+SIZE = (224, 224)
+ILLEGAL_THRESHOLD = 0.95
+# 推理后端 (见 model_store.py): auto = 已有扁平模型就用 tflite，否则加载 .h5；
+# keras / tflite / tflite_int8 强制指定，tflite* 找不到转换结果时会在 /storage/cache/models 中转换一次
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'auto')
+MODEL_SHARE_WEIGHTS = os.environ.get('MODEL_SHARE_WEIGHTS', '1') == '1' # 0 = 启用 XNNPACK，更快但权重不再跨容器共享
+MODEL_THREADS = int(os.environ['MODEL_THREADS']) if os.environ.get('MODEL_THREADS') else None
+
+# 动态批处理配置 (通过容器环境变量设置)
+BATCHING = os.environ.get('BATCHING', '0') == '1'
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 5))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+
+_models = {}
+_batchers = {}
+_lock = threading.Lock()
+
+
+def get_model(name):
+    """惰性加载并缓存模型；同一进程内只加载一次。"""
+    with _lock:
+        model = _models.get(name)
+        if model is None and MODEL_BACKEND != 'keras':
+            # 优先使用 mmap 加载的扁平模型: 不导入 tensorflow，权重在多个容器间共享物理内存
+            import model_store
+            backend = 'tflite' if MODEL_BACKEND == 'auto' else MODEL_BACKEND
+            model = model_store.load_flat(name, backend, convert_missing=(MODEL_BACKEND != 'auto'), src_dir=MODEL_DIR,
+                                          share_weights=MODEL_SHARE_WEIGHTS, num_threads=MODEL_THREADS)
+            if model is not None:
+                _models[name] = model
+                print(f"model_server: Model '{name}' ({backend}) mapped from {model.path}, rss={model_store.rss_report()}")
+        if model is None:
+            from tensorflow.keras.models import load_model
+            model_file_path = os.path.join(MODEL_DIR, MODEL_FILES[name])
+            print(f"model_server: Loading model '{name}' from {model_file_path} ...")
+            # compile=False 避免 ValueError
+            model = load_model(model_file_path, compile=False)
+            _models[name] = model
+            print(f"model_server: Model '{name}' loaded successfully.")
+        return model
+
+
+def load_input(image_path):
+    """读取图片并转为 (224, 224, 3) 的 float32 数组 (不带 batch 维)。"""
+    # 与 keras load_img(target_size=SIZE) + img_to_array 相同 (RGB、最近邻缩放)，但不需要导入 tensorflow
+    from PIL import Image
+    with Image.open(image_path) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = img.resize((SIZE[1], SIZE[0]), Image.NEAREST)
+        return np.asarray(img, dtype=np.float32)
+
+
+class DynamicBatcher:
+    """
+    把并发到达的单张图片请求在一个短时间窗口内 (或凑满 max_batch 张) 合并成一次 predict，
+    再把结果按顺序拆回给各个调用方。submit() 会阻塞调用线程直到结果返回。
+    """
+    def __init__(self, predict_fn, max_batch=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.pending = [] # [(input_x, future), ...]
+        self.cond = threading.Condition()
+        self.batches = 0
+        self.items = 0
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, input_x):
+        future = Future()
+        with self.cond:
+            self.pending.append((input_x, future))
+            self.cond.notify()
+        return future.result()
+
+    def _take_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            # 第一条请求到达后最多再等 window，期间凑满 max_batch 就立即执行
+            deadline = time.time() + self.window
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(timeout=remaining)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                preds = self.predict_fn(np.stack([x for x, _ in batch]))
+                for (_, future), pred in zip(batch, preds):
+                    future.set_result(pred)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": (self.items / self.batches) if self.batches else 0.0}
+
+
+def get_batcher(name):
+    with _lock:
+        batcher = _batchers.get(name)
+        if batcher is None:
+            batcher = DynamicBatcher(lambda batch, name=name: get_model(name).predict(batch, verbose=0))
+            _batchers[name] = batcher
+        return batcher
+
+
+def predict(name, input_x, batching=None):
+    """对单张图片 (不带 batch 维) 运行分类器，返回该图片的预测向量。"""
+    use_batching = BATCHING if batching is None else batching
+    if use_batching:
+        return get_batcher(name).submit(input_x)
+    return get_model(name).predict(np.expand_dims(input_x, axis=0), verbose=0)[0]
+
+
+def load_cached_input(image_path, cache=None):
+    """优先使用 recognizer_upload 生成的 cls224 解码缓存 (mmap)，没有时再解码图片。"""
+    if cache:
+        import image_cache
+        input_x = image_cache.load(cache, 'cls224')
+        if input_x is not None:
+            return input_x
+    return load_input(image_path)
+
+
+def classify(name, image_path, input_x=None, batching=None, cache=None):
+    """action 的统一出口: 返回与原 recognizer_adult/violence 相同格式的结果。"""
+    if input_x is None:
+        input_x = load_cached_input(image_path, cache)
+    preds = predict(name, input_x, batching)
+    return {"illegal": bool(preds[0] > ILLEGAL_THRESHOLD), "confidence": str(preds[0])}
+
+
+if __name__ == '__main__':
+    # 在容器里对比逐张 predict 与动态批处理的吞吐: python3 model_server.py --model adult --requests 64 --concurrency 16
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="adult", choices=sorted(MODEL_FILES))
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    sample = np.random.default_rng(0).uniform(0, 255, SIZE + (3,)).astype(np.float32)
+    get_model(args.model)
+    predict(args.model, sample, batching=False) # 预热
+
+    for batching in (False, True):
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda _: predict(args.model, sample, batching), range(args.requests)))
+        elapsed = time.time() - start
+        extra = f" {get_batcher(args.model).stats()}" if batching else ""
+        print(f"batching={batching}: {args.requests / elapsed:.1f} images/s{extra}")
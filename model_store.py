@@ -0,0 +1,282 @@
+# model_store.py
+# 把 recognizer 的 Keras .h5 模型转换成可 mmap 的扁平格式 (TFLite flatbuffer)，并按后端加载。
+# 后端 (model_server 通过 MODEL_BACKEND 选择):
+#   keras       - 原始 .h5 + tensorflow
+#   tflite      - float32 TFLite，权重通过 mmap 在多个容器间共享
+#   tflite_int8 - 动态范围量化 (权重 int8，激活 float)，模型约为 1/4 大小，CPU 推理更快
+# 转换结果按源文件 sha256 缓存，查找顺序: /models (宿主机共享目录，只读挂载)、
+# /proxy/models_flat (构建镜像时转换)、/storage/cache/models (运行时转换，所有容器共享)。
+# 解释器优先从轻量的 tflite_runtime 导入，避免为推理导入整个 tensorflow。
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+FLAT_MODEL_DIR = os.environ.get('FLAT_MODEL_DIR', '/models') # 容器内共享模型目录 (只读挂载)
+BUILTIN_MODEL_DIR = '/proxy/models_flat'
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', '/storage/cache/models')
+FLAT_SUFFIX = '.tflite'
+MANIFEST_SUFFIX = '.json'
+
+MODEL_FILES = {
+    "adult": 'resnet50_final_adult.h5',
+    "violence": 'resnet50_final_violence.h5',
+}
+BACKENDS = ('keras', 'tflite', 'tflite_int8')
+
+
+def variant_name(name, backend='tflite'):
+    return name + '_int8' if backend == 'tflite_int8' else name
+
+
+def flat_model_path(name, model_dir=FLAT_MODEL_DIR, backend='tflite'):
+    return os.path.join(model_dir, variant_name(name, backend) + FLAT_SUFFIX)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convert(name, h5_path, model_dir, backend='tflite'):
+    """把一个 .h5 模型转换为 <model_dir>/<variant>.tflite 及其清单；源文件未变化时跳过。"""
+    import tensorflow as tf
+    out_path = flat_model_path(name, model_dir, backend)
+    manifest_path = os.path.join(model_dir, variant_name(name, backend) + MANIFEST_SUFFIX)
+    source_sha = file_sha256(h5_path)
+
+    if os.path.exists(out_path) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f).get('source_sha256') == source_sha:
+                print(f"model_store: {out_path} is up to date.")
+                return out_path
+
+    model = tf.keras.models.load_model(h5_path, compile=False)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if backend == 'tflite_int8':
+        # 不提供代表性数据集时 Optimize.DEFAULT 即动态范围量化
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    flat = converter.convert()
+
+    os.makedirs(model_dir, exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(flat)
+    os.replace(tmp_path, out_path) # 原子替换，正在映射旧文件的容器不受影响
+
+    manifest = {
+        "name": name,
+        "backend": backend,
+        "source": os.path.basename(h5_path),
+        "source_sha256": source_sha,
+        "format": "tflite",
+        "size_bytes": len(flat),
+        "input_shape": [d if d is not None else -1 for d in model.input_shape],
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"model_store: Converted {h5_path} -> {out_path} ({len(flat) / 1e6:.1f} MB).")
+    return out_path
+
+
+def _op_resolver_type(lite):
+    # tflite_runtime 在模块顶层导出 OpResolverType；tf.lite 放在 experimental 下
+    return getattr(lite, 'OpResolverType', None) or lite.experimental.OpResolverType
+
+
+def _interpreter_module():
+    # tflite_runtime 只包含解释器，导入耗时远小于 tensorflow
+    try:
+        from tflite_runtime import interpreter
+        return interpreter
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite
+
+
+class FlatModel:
+    """
+    mmap 加载的扁平模型，提供与 Keras 相同的 predict(batch) 接口。
+    share_weights=True 时关闭默认 delegate (XNNPACK 会把权重重新打包到私有内存)，保证权重留在共享映射中；
+    share_weights=False 时启用 XNNPACK，以每个容器多占一份权重为代价换取更低的推理延迟。
+    """
+    def __init__(self, path, share_weights=True, num_threads=None):
+        lite = _interpreter_module()
+        kwargs = {"model_path": path, "num_threads": num_threads}
+        if share_weights:
+            kwargs["experimental_op_resolver_type"] = _op_resolver_type(lite).BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.path = path
+        self.interpreter = lite.Interpreter(**kwargs)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+        self.lock = threading.Lock() # 解释器不是线程安全的
+
+    def predict(self, batch, verbose=0):
+        with self.lock:
+            if batch.shape[0] != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input_index, batch.astype('float32', copy=False))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+
+# 自检用的最小扁平模型 (412 字节): 输入 float32 [N, 2]，输出 = 输入 + 常量 [1, 2]
+SELFTEST_MODEL = (
+    'GAAAAFRGTDMAAA4AFAAQAAwACAAAAAQADgAAABAAAAAYAAAAHAAAAAMAAAACAAAAXAEAAEwBAAABAAAAHAAAAAEAAAAEAAAAwP7/'
+    '/wwAFAAQAAwACAAEAAwAAAAQAAAAFAAAABgAAAAcAAAAAQAAADQAAAABAAAAAgAAAAEAAAAAAAAAAwAAAMAAAACEAAAAQAAAAAAA'
+    'DgAUAAAAEAAMAAsABAAOAAAAEAAAAAAAAAsMAAAAEAAAADD///8BAAAAAgAAAAIAAAAAAAAAAQAAAJz///8kAAAACAAAABAAAAAC'
+    'AAAA/////wIAAAACAAAAAQAAAAIAAAAGAAAAb3V0cHV0AAAMABAADAAAAAgABAAMAAAAFAAAAAEAAAAEAAAAAQAAAAIAAAAEAAAA'
+    'YmlhcwAAAAAUABAADAAAAAAABAAAAAAAAAAIABQAAAAkAAAACAAAABAAAAACAAAA/////wIAAAACAAAAAQAAAAIAAAAFAAAAaW5w'
+    'dXQABgAIAAQABgAAAAwAAAAEAAQABAAAAAgAAAAAAIA/AAAAQA=='
+)
+
+
+def selftest(share_weights=True):
+    """用当前可用的解释器 (镜像里是 tflite_runtime) 构造 FlatModel 并推理一次，确认加载路径可用；返回解释器模块名。"""
+    import base64
+    import tempfile
+    import numpy as np
+    with tempfile.NamedTemporaryFile(suffix=FLAT_SUFFIX) as f:
+        f.write(base64.b64decode(''.join(SELFTEST_MODEL)))
+        f.flush()
+        model = FlatModel(f.name, share_weights=share_weights)
+        out = model.predict(np.array([[0.5, -1.0], [2.0, 3.0]], dtype=np.float32))
+    if not np.allclose(out, [[1.5, 1.0], [3.0, 5.0]]):
+        raise RuntimeError(f"model_store selftest: unexpected output {out.tolist()}")
+    return _interpreter_module().__name__
+
+
+def find_flat(name, backend='tflite'):
+    for model_dir in (FLAT_MODEL_DIR, BUILTIN_MODEL_DIR, MODEL_CACHE_DIR):
+        path = flat_model_path(name, model_dir, backend)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_flat(name, backend='tflite', convert_missing=False, src_dir='/proxy', **kwargs):
+    """
+    返回扁平模型；找不到时若 convert_missing 则在 MODEL_CACHE_DIR 中转换一次 (需要 tensorflow)，
+    否则返回 None，由调用方回退到 .h5。
+    """
+    path = find_flat(name, backend)
+    if path is None:
+        if not convert_missing:
+            return None
+        path = convert(name, os.path.join(src_dir, MODEL_FILES[name]), MODEL_CACHE_DIR, backend)
+    return FlatModel(path, **kwargs)
+
+
+def rss_report():
+    """当前进程的内存占用 (MB): VmRSS = RssAnon (私有堆) + RssFile (文件映射，可跨容器共享) + RssShmem。"""
+    report = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem'):
+                report[key] = int(value.split()[0]) / 1024.0
+    return report
+
+
+def _load_backend(name, backend, src_dir, model_dir):
+    if backend == 'keras':
+        import tensorflow as tf
+        return tf.keras.models.load_model(os.path.join(src_dir, MODEL_FILES[name]), compile=False)
+    return FlatModel(flat_model_path(name, model_dir, backend))
+
+
+def _measure(name, backend, src_dir, model_dir):
+    # 在独立进程中运行: 导入并加载一个后端、跑一次推理，打印耗时和前后的 RSS (JSON)
+    import numpy as np
+    before = rss_report()
+    start = time.time()
+    model = _load_backend(name, backend, src_dir, model_dir)
+    load_time = time.time() - start
+    model.predict(np.zeros((1, 224, 224, 3), dtype='float32'), verbose=0)
+    print(json.dumps({"model": name, "backend": backend, "load_s": load_time,
+                      "before": before, "after": rss_report()}))
+
+
+def _sample_inputs(samples, count):
+    # 精度校验样本: 目录中的图片 (按 model_server 的预处理)，没有则用固定种子的随机图片
+    import numpy as np
+    if samples:
+        import model_server
+        files = sorted(os.path.join(samples, f) for f in os.listdir(samples))
+        return np.stack([model_server.load_input(path) for path in files[:count]])
+    return np.random.default_rng(0).uniform(0, 255, (count, 224, 224, 3)).astype(np.float32)
+
+
+def check_accuracy(name, backend, src_dir, model_dir, samples=None, count=32, threshold=0.95):
+    """对比候选后端与原始 Keras 模型在样本集上的输出和判定，并给出单张图片延迟。"""
+    import numpy as np
+    inputs = _sample_inputs(samples, count)
+    reference = _load_backend(name, 'keras', src_dir, model_dir)
+    candidate = _load_backend(name, backend, src_dir, model_dir)
+
+    def run(model):
+        preds, start = [], time.time()
+        for x in inputs:
+            preds.append(model.predict(x[None], verbose=0)[0])
+        return np.array(preds), (time.time() - start) / len(inputs)
+
+    run(reference), run(candidate) # 预热
+    ref_preds, ref_latency = run(reference)
+    cand_preds, cand_latency = run(candidate)
+    diff = np.abs(ref_preds - cand_preds)
+    return {
+        "model": name, "backend": backend, "samples": len(inputs),
+        "max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean()),
+        "decision_agreement": float(np.mean((ref_preds[:, 0] > threshold) == (cand_preds[:, 0] > threshold))),
+        "keras_ms": ref_latency * 1000, "backend_ms": cand_latency * 1000,
+    }
+
+
+if __name__ == '__main__':
+    # python3 model_store.py convert [--src /proxy] [--dst /models] [--backend tflite tflite_int8]
+    # python3 model_store.py rss [--model adult]        (各后端在独立进程中的加载耗时和 RSS)
+    # python3 model_store.py check [--backend tflite_int8] [--samples DIR]   (与 .h5 对比精度和延迟)
+    # python3 model_store.py selftest                   (用内置的最小模型构造 FlatModel，构建镜像时运行)
+    import argparse
+    import subprocess
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["convert", "rss", "check", "selftest", "_measure"])
+    parser.add_argument("--src", default="/proxy", help=".h5 模型所在目录")
+    parser.add_argument("--dst", default=FLAT_MODEL_DIR, help="扁平模型输出目录 (共享目录)")
+    parser.add_argument("--model", default="adult", choices=sorted(MODEL_FILES))
+    parser.add_argument("--backend", nargs='+', default=None, choices=BACKENDS)
+    parser.add_argument("--samples", default=None, help="精度校验用的图片目录")
+    parser.add_argument("--count", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for backend in args.backend or ['tflite']:
+            if backend == 'keras':
+                continue
+            for name, filename in MODEL_FILES.items():
+                convert(name, os.path.join(args.src, filename), args.dst, backend)
+    elif args.command == "selftest":
+        for share_weights in (True, False):
+            print(f"model_store selftest ok: {selftest(share_weights)} share_weights={share_weights}")
+    elif args.command == "_measure":
+        _measure(args.model, (args.backend or ['tflite'])[0], args.src, args.dst)
+    elif args.command == "check":
+        for backend in args.backend or ['tflite', 'tflite_int8']:
+            print(json.dumps(check_accuracy(args.model, backend, args.src, args.dst, args.samples, args.count)))
+    else:
+        backends = args.backend or BACKENDS
+        print(f"{'backend':>12} {'load(s)':>8} {'RSS before':>11} {'RSS after':>10} {'anon':>8} {'file':>8}  (MB)")
+        for backend in backends:
+            out = subprocess.check_output([sys.executable, __file__, "_measure", "--model", args.model,
+                                           "--backend", backend, "--src", args.src, "--dst", args.dst])
+            r = json.loads(out.decode().strip().splitlines()[-1])
+            print(f"{backend:>12} {r['load_s']:>8.2f} {r['before']['VmRSS']:>11.1f} {r['after']['VmRSS']:>10.1f} "
+                  f"{r['after'].get('RssAnon', 0):>8.1f} {r['after'].get('RssFile', 0):>8.1f}")
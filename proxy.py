@@ -3,45 +3,168 @@ import time #计时工具
 from flask import Flask, request #flask是python的一个web框架；request用来获取用户请求中发来的数据
 from gevent.pywsgi import WSGIServer #高性能web服务器，让flask应用可以同时处理很多请求
 from multiprocessing import Process
+import gevent
+import io
+import base64
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
 
-exec_path = '/proxy/exec/actions' #告诉程序用户的Action代码在哪里
+PROXY_THREADS = int(os.environ.get('PROXY_THREADS', 0)) #大于 0 时 /run 在线程池中执行，同一容器可同时处理多个请求（用于动态批处理）
+
+exec_path = os.environ.get('PROXY_EXEC_PATH', '/proxy/exec/actions') #告诉程序用户的Action代码在哪里 (local 容器后端指向仓库里的 actions/)
 default_file = 'main.py' #规定每个Action文件夹内的入口文件名必须是main.py
+# 热更新的代码包 (见 controller 的 code_store.py) 按 <action>/<版本> 解压在这里，同一版本只解压一次
+code_cache = os.environ.get('PROXY_CODE_CACHE', '/tmp/proxy_code')
+
+
+def bundle_dir(action, version):
+    return os.path.join(code_cache, action, version)
+
+
+def install_bundle(action, version, encoded):
+    # 校验内容哈希后解压到临时目录，再整体改名为 <action>/<版本>，并发安装同一版本时只保留一份
+    data = base64.b64decode(encoded)
+    if hashlib.sha256(data).hexdigest()[:len(version)] != version:
+        raise ValueError(f"bundle for {action} does not match version {version}")
+    target = bundle_dir(action, version)
+    if os.path.isdir(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(target))
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+        for member in tar.getmembers():
+            if os.path.isabs(member.name) or '..' in member.name.split('/') or not (member.isfile() or member.isdir()):
+                raise ValueError(f"unsafe entry in bundle for {action}: {member.name}")
+        tar.extractall(tmp_dir)
+    try:
+        os.rename(tmp_dir, target)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True) # 其他请求已经装好了同一版本
 
 class ActionRunner: #一个蓝图，一个工厂，用于创建执行器对象
     def __init__(self): #创建runner对象时自动执行的一个构造函数
         self.code = None
         self.action = None
         self.action_context = None
+        self.contexts = {} # {(action, 版本): 已执行顶层代码的上下文}，切换 action 或融合多个 action 时不必重新加载；版本 None 是镜像里的代码
+        self.stages = None # 融合调用时依次执行的 [(action, 上下文), ...]
+        self.loaded = None # 当前加载的 (action, 各阶段版本)，同样的 init 直接返回
+        self.versions = {} # 当前各阶段的代码版本 (/status 显示)
+        # 每个 init 过的 action ("a" 或融合的 "a+b") 的 {"key", "stages", "context", "versions"}。
+        # /run?action=<action> 按请求选择上下文: PROXY_THREADS > 0 时 /init 与 /run 是分开的两次请求，
+        # 中间可能插入别的 action 的 /init，不能依赖 "最近一次 init" 的状态
+        self.selections = {}
+        # PROXY_THREADS > 0 时 /run 在线程池里执行，/init 可能同时切换 action: 切换和 run 开始时的快照都在锁内进行
+        self.state_lock = threading.Lock()
 
-    def init(self, inp): #代码加载方法（与前者不是一个东西），对应init接口，负责将main.py读入内存并编译，参数inp存储用户发来的输入字典
-        action = inp['action']
-
-        # update action status
-        self.action = action
+    def _load(self, action, version=None):
+        context = self.contexts.get((action, version))
+        if context is not None:
+            return context
 
         # compile the python file first
-        filename = os.path.join(exec_path, action + '/' + default_file)
+        action_dir = bundle_dir(action, version) if version else os.path.join(exec_path, action)
+        filename = os.path.join(action_dir, default_file)
         with open(filename, 'r') as f:#with 语句的作用是确保文件在代码块执行完毕后，无论是否发生错误，都会被自动关闭
             code = compile(f.read(), filename, mode='exec')
 
-        self.action_context = {} #清空上下文，创建一个干净的字典，用于存储 matmul Action 的所有代码元素？？？
-        self.action_context['__file__'] = filename # 手动注入 __file__ 变量
-        exec(code, self.action_context) #核心： 运行 matmul/main.py 中的所有顶级代码（import numpy、def main 等）。运行结束后，self.action_context 字典中就有了 main 函数和 np
+        context = {} #创建一个干净的字典，用于存储该 Action 的所有代码元素
+        context['__file__'] = filename # 手动注入 __file__ 变量
+        exec(code, context) #核心： 运行 matmul/main.py 中的所有顶级代码（import numpy、def main 等）。运行结束后，context 字典中就有了 main 函数和 np
+        # 同一 action 的其他版本不再需要 (正在执行的旧版本请求自己持有上下文的引用，可以正常结束)
+        for key in [key for key in self.contexts if key[0] == action]:
+            del self.contexts[key]
+        self.contexts[(action, version)] = context
+        return context
 
-        return True
+    def init(self, inp): #代码加载方法（与前者不是一个东西），对应init接口，负责将main.py读入内存并编译，参数inp存储用户发来的输入字典
+        # 返回容器里还没有的代码版本对应的 action 列表 (controller 随后在 "bundles" 里补发)，全部加载完成时返回 []
+        action = inp['action']
+        # 融合: {"action": "a+b", "stages": ["a", "b"]}，每个阶段的 main.py 都加载到各自的上下文里
+        stages = inp.get('stages') or [action]
+        # 热更新: {"versions": {action: 版本}, "bundles": {action: base64 包}}，没有版本的阶段使用镜像里的代码
+        versions = inp.get('versions') or {}
+        for stage, encoded in (inp.get('bundles') or {}).items():
+            install_bundle(stage, versions[stage], encoded)
+
+        # 同一个 action 和版本已经加载过时直接复用，避免每次请求都重新 exec 顶层代码 (模型、索引等)
+        key = (action, tuple(versions.get(stage) for stage in stages))
+        with self.state_lock:
+            selection = self.selections.get(action)
+            if selection is not None and selection["key"] == key:
+                self._activate(action, selection)
+                return []
+
+        missing = [stage for stage in stages if versions.get(stage) and not os.path.isdir(bundle_dir(stage, versions[stage]))]
+        if missing:
+            return missing
+        contexts = [self._load(stage, versions.get(stage)) for stage in stages]
+
+        # update action status
+        selection = {
+            "key": key,
+            "stages": list(zip(stages, contexts)) if len(stages) > 1 else None,
+            "context": contexts[0],
+            "versions": {stage: versions[stage] for stage in stages if versions.get(stage)},
+        }
+        with self.state_lock:
+            self.selections[action] = selection
+            self._activate(action, selection)
+        return []
+
+    def _activate(self, action, selection):
+        # 调用方持有 state_lock。设为不带 ?action= 的 /run 使用的 "当前" action
+        self.action = action
+        self.stages = selection["stages"]
+        self.action_context = selection["context"]
+        self.loaded = selection["key"]
+        self.versions = selection["versions"]
 
-    def run(self, inp): #代码运行方法，对应run接口
-        self.action_context['data'] = inp #将输入数据 inp 存储到上下文字典中，并命名为 data。这样 main 函数就可以通过 data 访问输入？？？
+    def select(self, action=None):
+        """
+        取出一次 /run 使用的 (融合阶段, 上下文) 快照: 指定 action 时用它自己 init 时的上下文，
+        没有 init 过时返回 None；不指定时用最近一次 init 的 (兼容直接调用 /init + /run 的脚本)。
+        """
+        with self.state_lock:
+            if action is None:
+                return self.stages, self.action_context
+            selection = self.selections.get(action)
+            return (selection["stages"], selection["context"]) if selection else None
 
-        out = eval('main(data)', self.action_context) #核心中的核心： 运行代码 main(data)。Python 在 self.action_context 中找到 main 函数和 data 变量，并调用 main({"param": 1000})。这行代码开始执行您的矩阵乘法。 矩阵乘法的结果（{"latency": 0.xxx}）被存储到 out 变量中。
+    def run(self, inp, selection=None): #代码运行方法，对应run接口
+        #输入数据 inp 放在单独的局部命名空间里（命名为 data），并发执行的请求不会互相覆盖
+        # selection 是 select() 的快照: 执行期间 init 切换 action、融合阶段或版本都不影响这次请求
+        stages, context = selection or self.select()
+        if stages:
+            return self.run_fused(inp, stages)
+
+        out = eval('main(data)', context, {'data': inp}) #核心中的核心： 运行代码 main(data)。Python 在 self.action_context 中找到 main 函数和 data 变量，并调用 main({"param": 1000})。这行代码开始执行您的矩阵乘法。 矩阵乘法的结果（{"latency": 0.xxx}）被存储到 out 变量中。
         return out
 
+    def run_fused(self, inp, stages):
+        # 依次执行各阶段，上一阶段的结果在内存中合并进下一阶段的输入 ({**输入, **上一阶段结果})，不经过 controller 和共享存储
+        # 返回 {"stages": [阶段结果, ...], "durations": [秒, ...]}
+        data = dict(inp)
+        outputs, durations = [], []
+        for stage, context in stages:
+            start = time.time()
+            out = eval('main(data)', context, {'data': data})
+            durations.append(time.time() - start)
+            outputs.append(out)
+            if isinstance(out, dict):
+                data = {**data, **out}
+        return {"stages": outputs, "durations": durations}
+
 #Flask应用配置
 #由于它不在任何函数或类内部，它在文件被加载和解析到这个位置时，立即就被执行了。
 #这段代码的作用是：在服务器正式启动（即 server.serve_forever() 运行）之前，先创建好所有核心对象（proxy 和 runner），并设置好它们的初始状态和配置，确保服务处于“可接收请求”的准备状态。
 proxy = Flask(__name__) #创建一个 Flask 应用程序实例，并命名为 proxy
 proxy.status = 'new' #设置服务的初始状态为 'new'（新启动）
 proxy.debug = False #关闭调试模式，让服务运行更安全。
+proxy.inflight = 0 #正在执行的 run 请求数
 runner = ActionRunner() #实例化（创建）我们上面解释的那个核心执行对象。
 
 #状态接口
@@ -50,17 +173,25 @@ def status():
     res = {}
     res['status'] = proxy.status #返回服务的当前状态（'new'、'init' 或 'ok'）。
     res['workdir'] = os.getcwd() #返回程序当前的工作目录。
+    res['inflight'] = proxy.inflight # 正在执行的 run 请求数 (controller 重启接管容器时据此判断是否空闲)
     if runner.action:
         res['action'] = runner.action
+    if runner.versions:
+        res['versions'] = runner.versions
     return res #将状态信息（JSON 格式）返回给用户？？？
 
 #初始化接口
 @proxy.route('/init', methods=['POST']) #设定：当收到 HTTP POST 请求访问 /init 时，运行下面的 init 函数。
 def init():
+    previous = proxy.status
     proxy.status = 'init' #临时更新服务状态为 'init'（正在初始化）。
 
     inp = request.get_json(force=True, silent=True) #获取用户通过 POST 请求发送过来的 JSON 数据（如{"action": "matmul"}）
-    runner.init(inp) #调用上面解释的 ActionRunner.init 方法，执行文件加载和编译
+    missing = runner.init(inp) #调用上面解释的 ActionRunner.init 方法，执行文件加载和编译
+    if missing:
+        # 请求的代码版本不在本地缓存中: 让 controller 带上代码包重发，当前加载的代码保持不变
+        proxy.status = previous
+        return ({"status": "missing", "missing": missing}, 409)
 
     proxy.status = 'ok' #初始化完成后，将服务状态设置为 'ok'（准备就绪）。
     return ('OK', 200) #返回 OK 文本和标准的成功状态码。
@@ -69,6 +200,11 @@ def init():
 #运行接口
 @proxy.route('/run', methods=['POST']) #设定：当收到 HTTP POST 请求访问 /run 时，运行下面的 run 函数。
 def run():
+    # controller 用 /run?action=<action> 指明要执行的 action (融合时是 "a+b")，与 /init 之间插入的其他 init 无关
+    action = request.args.get('action')
+    selection = runner.select(action)
+    if selection is None:
+        return ({"status": "not_initialized", "action": action}, 409)
     proxy.status = 'run'
     
     inp = request.get_json(force=True, silent=True)
@@ -83,7 +219,15 @@ def run():
     process_.terminate()
     '''
 
-    out = runner.run(inp)
+    proxy.inflight += 1
+    try:
+        if PROXY_THREADS > 0:
+            #在 gevent 的线程池中执行，当前 greenlet 让出，服务器可以继续接收其他请求
+            out = gevent.get_hub().threadpool.apply(runner.run, (inp, selection))
+        else:
+            out = runner.run(inp, selection)
+    finally:
+        proxy.inflight -= 1
     end = time.time() #记录结束计时。
     print('duration:', end - start)
     data = {
@@ -93,9 +237,31 @@ def run():
         "result": out
     }
 
-    proxy.status = 'ok'
+    if proxy.inflight == 0:
+        proxy.status = 'ok'
     return data
 
 if __name__ == '__main__': #这是一个通用的 Python 约定。它确保只有当您直接执行 python3 proxy.py 时，它里面的代码才会运行。如果文件是被其他程序导入的，这段代码就不会运行。这避免了当其他程序仅仅是想导入 proxy.py 中的某些函数时，服务器却意外启动的情况。
-    server = WSGIServer(('0.0.0.0', 5000), proxy) #1. WSGIServer 是一个高性能的服务器（来自 gevent 库）。2. ('0.0.0.0', 5000) 指定了服务器监听的网络地址和端口。0.0.0.0 表示监听所有网络接口（即允许外部访问），5000 是端口号？？？。3. proxy 是我们之前定义的 Flask 应用程序实例。这一行就是告诉服务器：“请使用这个 Flask 应用来处理所有传入到 5000 端口的请求。”
+    if PROXY_THREADS > 0:
+        gevent.get_hub().threadpool.maxsize = PROXY_THREADS
+    from gevent import socket as gsocket
+    unix_socket = os.environ.get('PROXY_UNIX_SOCKET') # uds 传输: 监听共享目录里的 Unix 域套接字 (见 proxy_client.py)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        listener = gsocket.socket(gsocket.AF_UNIX, gsocket.SOCK_STREAM)
+        listener.bind(unix_socket)
+        os.chmod(unix_socket, 0o777) # 容器内以 root 创建，宿主机上的 controller 也要能连接
+    else:
+        # PROXY_HOST / PROXY_PORT 由 local 容器后端设置 (每个进程一个宿主机端口)，容器里保持默认的 0.0.0.0:5000
+        listener = gsocket.socket(gsocket.AF_INET, gsocket.SOCK_STREAM)
+        listener.setsockopt(gsocket.SOL_SOCKET, gsocket.SO_REUSEADDR, 1)
+        # controller 使用持久连接: 关闭 Nagle (accept 出的连接继承该选项)，否则响应头和响应体分两次写出时要等对端的延迟 ACK (~40ms)
+        listener.setsockopt(gsocket.IPPROTO_TCP, gsocket.TCP_NODELAY, 1)
+        listener.bind((os.environ.get('PROXY_HOST', '0.0.0.0'), int(os.environ.get('PROXY_PORT', 5000))))
+    listener.listen(128)
+    server = WSGIServer(listener, proxy) #1. WSGIServer 是一个高性能的服务器（来自 gevent 库）。2. ('0.0.0.0', 5000) 指定了服务器监听的网络地址和端口。0.0.0.0 表示监听所有网络接口（即允许外部访问），5000 是端口号？？？。3. proxy 是我们之前定义的 Flask 应用程序实例。这一行就是告诉服务器：“请使用这个 Flask 应用来处理所有传入到 5000 端口的请求。”
+    # 容器里 proxy 是 PID 1，默认忽略 SIGTERM，docker stop 只能等到超时再 SIGKILL；这里收到 SIGTERM 就停止服务 (进行中的请求有 1 秒完成)
+    import signal
+    gevent.signal_handler(signal.SIGTERM, server.stop)
     server.serve_forever() #这是一个阻塞（Blocking）函数。一旦运行，程序就会一直保持活动状态，不断地等待、接收和响应来自网络（例如您的 curl 命令）的 HTTP 请求，直到您手动停止容器（docker stop）。
@@ -0,0 +1,127 @@
+# proxy_client.py
+# controller 访问容器内 proxy 的 HTTP 客户端，支持三种传输 (FunctionManager 的 transport 配置):
+#   port   - http://127.0.0.1:<HostPort>，经过 Docker 发布端口 (docker-proxy / iptables DNAT)
+#   bridge - http://<容器网桥 IP>:<容器端口>，直接访问容器，不发布端口 (宿主机需能路由到 docker 网桥，Linux 默认如此)
+#   uds    - unix://<共享目录>/<容器名>.sock，proxy 的 WSGI 服务监听挂载进容器的 Unix 域套接字
+# 端点统一写成字符串 (见 container_backend.address)。每个线程对每个端点保持一个持久连接 (keep-alive)。
+# 复用前先检查连接是否已被对端关闭，已关闭则换新连接；请求一旦开始发送就不再重试 (/run 不是幂等的，不能执行两次)。
+import json
+import socket
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+TRANSPORTS = ('port', 'bridge', 'uds')
+
+
+class ProxyConnectionError(Exception):
+    """无法连接到 proxy 或读取响应 (包括超时)。"""
+
+
+class ProxyHTTPError(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} from proxy: {response.text[:200]}")
+        self.response = response
+
+
+class ProxyResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='ignore')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ProxyHTTPError(self)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+_local = threading.local()
+
+
+def _new_connection(endpoint, timeout):
+    parts = urlsplit(endpoint)
+    if parts.scheme == 'unix':
+        return UnixHTTPConnection(parts.path, timeout=timeout)
+    return http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+
+
+def _is_stale(sock):
+    # 空闲的 keep-alive 连接上不应该有可读数据: 读到 EOF (对端已关闭)、数据或错误都说明不能再用。
+    # 带超时的 socket 在 recv 前会先等待可读 (忽略 MSG_DONTWAIT)，所以检查时临时切换为非阻塞
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+        return True
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.settimeout(timeout)
+
+
+def _connection(endpoint, timeout):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(endpoint)
+    if conn is not None and conn.sock is not None and _is_stale(conn.sock):
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = connections[endpoint] = _new_connection(endpoint, timeout)
+        return conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def _drop(endpoint):
+    conn = getattr(_local, 'connections', {}).pop(endpoint, None)
+    if conn is not None:
+        conn.close()
+
+
+def request(method, endpoint, path, payload=None, timeout=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    # 只发送一次: 发送开始后出错时无法知道服务端是否已经执行了请求，交给调用方处理
+    conn = _connection(endpoint, timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        content = response.read()
+    except (OSError, http.client.HTTPException) as e:
+        _drop(endpoint)
+        raise ProxyConnectionError(f"{endpoint}{path}: {e}")
+    if response.will_close:
+        _drop(endpoint)
+    return ProxyResponse(response.status, content)
+
+
+def get(endpoint, path, timeout=None):
+    return request('GET', endpoint, path, timeout=timeout)
+
+
+def post(endpoint, path, payload=None, timeout=None):
+    return request('POST', endpoint, path, payload, timeout=timeout)
@@ -0,0 +1,14 @@
+# segment_list.py
+# 边写边读的列表文件 (复制到 /proxy/，action 通过 import segment_list 使用)。
+# video_split 让 ffmpeg 每关闭一个分片就向 -segment_list 追加一行；controller 的流式视频工作流在切分进行中轮询该文件，
+# split 结束时再从同一个文件得到返回值。两边用同一个函数读取，对 "完整的行" 的判断总是一致。
+
+
+def read_complete_lines(path):
+    """读取一个正在被追加写入的文件，只返回以换行结尾的完整非空行；文件不存在时返回 []。"""
+    try:
+        with open(path, 'r') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return []
+    return [line for line in content.split('\n')[:-1] if line]
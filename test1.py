@@ -12,6 +12,7 @@ CONTROLLER = "http://127.0.0.1:5000"
 FUNCTION = "matmul"
 CREATE_PATH = f"{CONTROLLER}/create_manager"
 STATUS_PATH = f"{CONTROLLER}/manager_status/{FUNCTION}"
+READY_PATH = f"{CONTROLLER}/ready"
 DISPATCH_PATH = f"{CONTROLLER}/dispatch/{FUNCTION}"
 
 # Configuration for creation (adjust image_name to your local image)
@@ -52,20 +53,16 @@ def create_manager():
     print("create response:", r.status_code, r.text)
 
 def wait_for_prewarm(min_idle=2, timeout=60):
+    # controller 的 /ready 阻塞到 manager 的 min_idle_containers 个容器就绪 (min_idle 只用于打印)
     print(f"Waiting up to {timeout}s for pre-warm: need {min_idle} idle containers...")
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            r = requests.get(STATUS_PATH, timeout=3)
-            if r.status_code == 200:
-                j = r.json()
-                print("status:", j)
-                if j.get("idle", 0) >= min_idle:
-                    print("Pre-warm condition satisfied.")
-                    return True
-        except Exception as e:
-            print("status check error:", e)
-        time.sleep(1.0)
+    try:
+        r = requests.get(READY_PATH, params={"functions": FUNCTION, "timeout": timeout}, timeout=timeout + 10)
+        print("ready:", r.status_code, r.text)
+        if r.status_code == 200:
+            print("Pre-warm condition satisfied.")
+            return True
+    except Exception as e:
+        print("ready check error:", e)
     print("Pre-warm timed out.")
     return False
 
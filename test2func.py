@@ -17,6 +17,7 @@ FUNC_IMAGE = "image"
 
 CREATE_PATH = f"{CONTROLLER}/create_manager"
 STATUS_PATH_TMPL = f"{CONTROLLER}/manager_status/{{}}"
+READY_PATH = f"{CONTROLLER}/ready"
 DISPATCH_PATH_TMPL = f"{CONTROLLER}/dispatch/{{}}"
 
 # Configuration for creation (adjust image_name to your local images)
@@ -70,21 +71,16 @@ def create_manager_for(body):
         print(f"Failed to create manager '{name}': {e}")
 
 def wait_for_prewarm_for(function_name, min_idle=1, timeout=60):
-    status_path = STATUS_PATH_TMPL.format(function_name)
+    # controller 的 /ready 阻塞到 manager 的 min_idle_containers 个容器就绪 (min_idle 只用于打印)
     print(f"Waiting up to {timeout}s for pre-warm of '{function_name}': need {min_idle} idle containers...")
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            r = requests.get(status_path, timeout=3)
-            if r.status_code == 200:
-                j = r.json()
-                print(f"[{function_name}] status:", j)
-                if j.get("idle", 0) >= min_idle:
-                    print(f"[{function_name}] Pre-warm condition satisfied.")
-                    return True
-        except Exception as e:
-            print(f"[{function_name}] status check error:", e)
-        time.sleep(1.0)
+    try:
+        r = requests.get(READY_PATH, params={"functions": function_name, "timeout": timeout}, timeout=timeout + 10)
+        print(f"[{function_name}] ready:", r.status_code, r.text)
+        if r.status_code == 200:
+            print(f"[{function_name}] Pre-warm condition satisfied.")
+            return True
+    except Exception as e:
+        print(f"[{function_name}] ready check error:", e)
     print(f"[{function_name}] Pre-warm timed out.")
     return False
 
@@ -7,6 +7,8 @@ CONTROLLER_URL = 'http://localhost:5000'
 IMAGE_NAME = 'video-proxy:latest'
 PROXY_CONTAINER_PORT = 5000
 ACTION_NAME = "matmul"
+# CPU 放置策略 (见 cpu_topology.py): exclusive_core / smt_shared / numa_local；不设置则不绑定 CPU
+PLACEMENT_POLICY = os.environ.get("PLACEMENT_POLICY")
 
 # --- 1. 注册 Matmul Manager (此函数不变) ---
 def setup_manager():
@@ -23,6 +25,8 @@ def setup_manager():
         "min_idle_containers": 1,
         # (host_storage_path 被省略了，因为这个 Action 不需要它)
     }
+    if PLACEMENT_POLICY:
+        config["placement"] = {"policy": PLACEMENT_POLICY, "cpus": int(os.environ.get("PLACEMENT_CPUS", 1))}
     try:
         resp = requests.post(f"{CONTROLLER_URL}/create_manager", json=config)
         resp.raise_for_status()
@@ -8,8 +8,13 @@ CONTROLLER_URL = 'http://localhost:5000'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 HOST_STORAGE_PATH = os.path.join(BASE_DIR, "storage")
 HOST_SOURCE_DIR = os.path.join(BASE_DIR, "sources")
+HOST_MODEL_PATH = os.path.join(BASE_DIR, "models", "flat") # model_store.py convert 的输出目录
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND") # 分类器推理后端: keras / tflite / tflite_int8 (不设置则为 auto)
 IMAGE_NAME = 'workflow-proxy:latest'
+CONTAINER_BACKEND = os.environ.get("CONTAINER_BACKEND") # 容器后端: docker (默认) / local (本地 proxy.py 进程，不需要 Docker)
 PROXY_CONTAINER_PORT = 5000
+PREWARM_TIMEOUT = 180 # 等待所有 manager 预热完成的秒数 (controller 的 /ready)
+DECODE_CACHE = os.environ.get("DECODE_CACHE", "1") == "1" # recognizer: upload 解码一次，下游分析直接 mmap 读取派生数组
 
 # --- 2. (新) 目标性的 Manager 注册函数 ---
 def setup_managers_for(workflow_name):
@@ -26,13 +31,18 @@ def setup_managers_for(workflow_name):
             {"name": "video_merge", "min_idle": 0},
         ],
         "recognizer": [
-            {"name": "recognizer_upload", "min_idle": 1},
+            # 不解码时 upload 只拼接并检查路径: 在 controller 的工作进程池里内联执行，不占预热容器。
+            # decode_cache 时它要解码整张图片，内存随图片大小增长，放在容器里执行，不占用 controller 宿主机的内存
+            {"name": "recognizer_upload", "min_idle": 1} if DECODE_CACHE else {"name": "recognizer_upload", "inline": True},
             {"name": "recognizer_extract", "min_idle": 1},
-            {"name": "recognizer_adult", "min_idle": 1},
-            {"name": "recognizer_violence", "min_idle": 1},
+            {"name": "recognizer_adult", "min_idle": 1, "needs_models": True},
+            {"name": "recognizer_violence", "min_idle": 1, "needs_models": True},
             {"name": "recognizer_censor", "min_idle": 1},
             {"name": "recognizer_translate", "min_idle": 1},
             {"name": "recognizer_mosaic", "min_idle": 0},
+            # 合并分类 (payload 中 combined_classify=true 时使用)：单容器并发 + 动态批处理
+            {"name": "recognizer_classify", "min_idle": 0, "max_concurrency": 8,
+             "environment": {"BATCHING": "1"}, "needs_models": True},
         ],
         "svd": [
             {"name": "svd_start", "min_idle": 1},
@@ -52,7 +62,8 @@ def setup_managers_for(workflow_name):
         print(f"错误: 无法为 '{workflow_name}' 找到 managers 定义。")
         sys.exit(1)
 
-    # 循环注册
+    # 构造所有 manager 的配置，一次性登记 (controller 立即并行预热它们)
+    configs = []
     for func in managers_to_register:
         config = {
             "function_name": func["name"],
@@ -60,20 +71,48 @@ def setup_managers_for(workflow_name):
             "container_port": PROXY_CONTAINER_PORT,
             "min_idle_containers": func.get("min_idle", 0),
         }
+        for key in ("max_concurrency", "environment", "placement", "inline", "inline_memory_mb"):
+            if key in func:
+                config[key] = func[key]
         
         if func.get("needs_storage", True):
             config["host_storage_path"] = HOST_STORAGE_PATH
+        if func.get("needs_models") and os.path.isdir(HOST_MODEL_PATH):
+            config["host_model_path"] = HOST_MODEL_PATH
+        if CONTAINER_BACKEND:
+            config["backend"] = CONTAINER_BACKEND
+        if func.get("needs_models") and MODEL_BACKEND:
+            config["environment"] = {**config.get("environment", {}), "MODEL_BACKEND": MODEL_BACKEND}
+        configs.append(config)
 
-        try:
-            resp = requests.post(f"{CONTROLLER_URL}/create_manager", json=config)
-            resp.raise_for_status()
-            print(f"  > Manager '{func['name']}' 已创建/已存在。")
-        except requests.RequestException as e:
-            if e.response and e.response.status_code != 200: # 忽略 "exists"
-                print(f"  > 创建 manager '{func['name']}' 失败: {e}")
-                sys.exit(1)
+    try:
+        resp = requests.post(f"{CONTROLLER_URL}/create_managers", json={"managers": configs})
+        results = resp.json().get("managers", {})
+    except (requests.RequestException, ValueError) as e:
+        print(f"  > 注册 managers 失败: {e}")
+        sys.exit(1)
+    for name, result in results.items():
+        if "error" in result:
+            print(f"  > 创建 manager '{name}' 失败: {result['error']}")
+        else:
+            print(f"  > Manager '{name}' 已{'创建' if result.get('status') == 'created' else '存在'}。")
+    if resp.status_code >= 400:
+        sys.exit(1)
+
+    # 等待所有函数的预热完成 (controller 端阻塞等待，不再轮询 manager_status)
+    names = ",".join(config["function_name"] for config in configs)
+    try:
+        resp = requests.get(f"{CONTROLLER_URL}/ready", params={"functions": names, "timeout": PREWARM_TIMEOUT},
+                            timeout=PREWARM_TIMEOUT + 10)
+        ready = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"  > 等待预热失败: {e}")
+        ready = {"ready": False, "functions": {}}
+    for name, item in ready.get("functions", {}).items():
+        if not item["ready"]:
+            print(f"  > 警告: '{name}' 预热未完成 (idle {item['idle']}/{item['min_idle']})，继续执行。")
                 
-    print(f"'{workflow_name}' 的 Managers 均已注册。")
+    print(f"'{workflow_name}' 的 Managers 均已注册{'并预热' if ready.get('ready') else ''}。")
 
 
 # --- 3. (新) 目标性的存储准备函数 ---
@@ -152,7 +191,8 @@ def trigger_workflow(workflow_name):
         }
     elif workflow_name == "recognizer":
         payload = {
-            "image_filename": "test.png"
+            "image_filename": "test.png",
+            "decode_cache": DECODE_CACHE
         }
     elif workflow_name == "svd":
         payload = {